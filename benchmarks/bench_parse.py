@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""Run UsesthisSpider.parse_article(), the ValidationPipeline and the
+SQLPipeline over a directory of saved interview pages (and/or synthetic
+ones), and report throughput, per-stage latency percentiles and peak RSS.
+
+Each saved page `<slug>.html` is parsed as if it had been downloaded from
+https://usesthis.com/interviews/<slug>/.
+
+Usage: python benchmarks/bench_parse.py [-h] [--synthetic N] [--json PATH] [CORPUS_DIR]
+"""
+
+from __future__ import print_function
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse
+from benchutils import git_revision, peak_rss_mb, percentiles
+from usesthis_crawler import logger
+from usesthis_crawler.models import init_models
+from usesthis_crawler.pipelines import ValidationPipeline, SQLPipeline
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from usesthis_crawler.synthetic import make_article, make_slug
+
+
+STAGES = ('parse', 'validate', 'store')
+
+
+def load_corpus(corpus_dir, n_synthetic, n_paragraphs, n_links):
+    """Yield a (URL, HTML body) pair for each page of the corpus."""
+    if corpus_dir:
+        for path in sorted(glob.glob(os.path.join(corpus_dir, '*.html'))):
+            slug = os.path.splitext(os.path.basename(path))[0]
+            with io.open(path, 'rb') as page:
+                yield 'https://usesthis.com/interviews/{0}/'.format(slug), page.read()
+
+    for idx in range(n_synthetic):
+        slug = make_slug(idx)
+        html = make_article(slug, n_paragraphs=n_paragraphs, n_links=n_links)
+        yield 'https://usesthis.com/interviews/{0}/'.format(slug), html.encode('utf-8')
+
+
+def run(pages, db_path, batch_size):
+    """Push every page through the parse -> validate -> store stages, and
+    return the benchmark's results as a dictionary.
+    """
+    init_models(db_path)
+    spider = UsesthisSpider('usesthis')
+    validation = ValidationPipeline()
+    validation._verbose = False
+    storage = SQLPipeline(batch_size=batch_size)
+    storage.open_spider(spider)
+
+    latencies = dict((stage, []) for stage in STAGES)
+    n_pages = n_items = n_tools = n_dropped = 0
+    started = time.time()
+
+    for url, body in pages:
+        n_pages += 1
+        response = HtmlResponse(url=url, body=body, encoding='utf-8')
+
+        tick = time.time()
+        items = list(spider.parse_article(response))
+        latencies['parse'].append(time.time() - tick)
+
+        for item in items:
+            n_items += 1
+            tick = time.time()
+            try:
+                validation.process_item(item, spider)
+            except DropItem:
+                n_dropped += 1
+                continue
+            finally:
+                latencies['validate'].append(time.time() - tick)
+
+            n_tools += len(item['tools'])
+            tick = time.time()
+            storage.process_item(item, spider)
+            latencies['store'].append(time.time() - tick)
+
+    tick = time.time()
+    storage.close_spider(spider)
+    flush_time = time.time() - tick
+    elapsed = time.time() - started
+
+    return dict(
+        revision=git_revision(),
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        pages=n_pages,
+        items=n_items,
+        items_dropped=n_dropped,
+        tools=n_tools,
+        seconds=elapsed,
+        pages_per_sec=n_pages / elapsed if elapsed else None,
+        items_per_sec=n_items / elapsed if elapsed else None,
+        final_flush_ms=flush_time * 1000,
+        latency_ms=dict(
+            (stage, dict((key, value * 1000) for key, value in percentiles(samples).items()))
+            for stage, samples in latencies.items()
+        ),
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def print_report(results, stream=sys.stdout):
+    print('{pages} pages, {items} items ({items_dropped} dropped), {tools} tools '
+          'in {seconds:.2f}s'.format(**results), file=stream)
+    if results['pages_per_sec'] is not None:
+        print('{pages_per_sec:.1f} pages/s, {items_per_sec:.1f} items/s, '
+              'peak RSS {peak_rss_mb:.1f} MB'.format(**results), file=stream)
+    print('{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        'stage (ms)', 'p50', 'p90', 'p99', 'max'), file=stream)
+    for stage in STAGES:
+        stats = results['latency_ms'][stage]
+        if stats:
+            print('{0:>10} {p50:>10.3f} {p90:>10.3f} {p99:>10.3f} {max:>10.3f}'.format(
+                stage, **stats), file=stream)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__doc__.split('\n\n')[0])
+    parser.add_argument('corpus_dir', nargs='?',
+                        help='directory of saved interview pages (<slug>.html)')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='N',
+                        help='also generate N synthetic interviews')
+    parser.add_argument('--paragraphs', type=int, default=5,
+                        help='paragraphs per section of each synthetic interview')
+    parser.add_argument('--links', type=int, default=3,
+                        help='tool links per paragraph of each synthetic interview')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='SQLPipeline batch size')
+    parser.add_argument('--db-path',
+                        help='database to write to (default: a temporary file)')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results as JSON to PATH ("-" for stdout)')
+    args = parser.parse_args(argv[1:])
+    if not args.corpus_dir and not args.synthetic:
+        parser.error('give a corpus directory and/or --synthetic N')
+
+    logger.setLevel(logging.CRITICAL)
+    tmpdir = None
+    db_path = args.db_path
+    if db_path is None:
+        tmpdir = tempfile.mkdtemp()
+        db_path = os.path.join(tmpdir, 'bench.db')
+
+    try:
+        pages = load_corpus(args.corpus_dir, args.synthetic, args.paragraphs, args.links)
+        results = run(pages, db_path, args.batch_size)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+    print_report(results, stream=sys.stderr if args.json == '-' else sys.stdout)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    elif args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
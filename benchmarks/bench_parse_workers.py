@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""Compare parsing interviews in the main process with parsing them in a pool
+of 1, 2, 4... worker processes (as with PARSE_WORKERS), in pages per second.
+Each page is a separate task, as it is during a crawl.
+
+Usage: python benchmarks/bench_parse_workers.py [--pages N] [--paragraphs N] [--links N] [WORKERS ...]
+"""
+
+from __future__ import print_function
+import argparse
+import multiprocessing
+import sys
+import time
+from scrapy.http import HtmlResponse
+from usesthis_crawler.spiders.usesthis import UsesthisSpider, article_hash
+from usesthis_crawler.synthetic import make_article, make_slug
+from usesthis_crawler.workers import init_worker, parse_page
+
+
+def parse_task(page):
+    return parse_page(*page)
+
+
+def parse_in_process(pages):
+    spider = UsesthisSpider('usesthis')
+    for url, body, encoding in pages:
+        # Hashed and parsed, as by the workers
+        response = HtmlResponse(url=url, body=body, encoding=encoding)
+        article_hash(response)
+        spider.load_article(response)
+
+
+def parse_in_pool(pages, processes):
+    pool = multiprocessing.Pool(processes, init_worker, (True,))
+    try:
+        # Let the workers start up before the clock does
+        pool.map(parse_task, pages[:processes], chunksize=1)
+        started = time.time()
+        for _, error in pool.imap_unordered(parse_task, pages, chunksize=1):
+            if error is not None:
+                raise RuntimeError(error)
+        return time.time() - started
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__doc__.split('\n\n')[0])
+    parser.add_argument('workers', nargs='*', type=int,
+                        help='pool sizes to try (default: powers of 2 up to the number of CPUs)')
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--paragraphs', type=int, default=5,
+                        help='paragraphs per section of each interview')
+    parser.add_argument('--links', type=int, default=3,
+                        help='tool links per paragraph of each interview')
+    args = parser.parse_args(argv[1:])
+
+    workers = args.workers
+    if not workers:
+        workers = [1]
+        while workers[-1] * 2 <= multiprocessing.cpu_count():
+            workers.append(workers[-1] * 2)
+
+    pages = []
+    for idx in range(args.pages):
+        slug = make_slug(idx)
+        html = make_article(slug, n_paragraphs=args.paragraphs, n_links=args.links)
+        pages.append(('https://usesthis.com/interviews/{0}/'.format(slug),
+                      html.encode('utf-8'), 'utf-8'))
+
+    started = time.time()
+    parse_in_process(pages)
+    baseline = time.time() - started
+
+    print('{0} CPUs, {1} pages'.format(multiprocessing.cpu_count(), len(pages)))
+    print('{0:>8} {1:>12} {2:>9}'.format('workers', 'pages/s', 'speedup'))
+    print('{0:>8} {1:>12.1f} {2:>8.2f}x'.format('-', len(pages) / baseline, 1.0))
+    for processes in workers:
+        elapsed = parse_in_pool(pages, processes)
+        print('{0:>8} {1:>12.1f} {2:>8.2f}x'.format(
+            processes, len(pages) / elapsed, baseline / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Compare how the interview-section extraction scales with article length:
+the old per-section `p[count(preceding-sibling::h4)=k]` XPath queries against
+the single-pass `split_sections()`.
+
+Usage: python benchmarks/bench_sections.py [N_PARAGRAPHS ...]
+"""
+
+from __future__ import print_function
+import sys
+from scrapy.http import HtmlResponse
+from benchutils import best_time
+from usesthis_crawler.spiders.usesthis import split_sections
+from usesthis_crawler.synthetic import make_article
+
+
+def xpath_sections(response):
+    return [
+        response.xpath('//div[@class="e-content"]/p[count(preceding-sibling::h4)={0}]'
+                       '/descendant-or-self::*/text()'.format(section)).extract()
+        for section in range(1, 5)
+    ]
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [10, 100, 500, 1000, 2000]
+    print('{0:>12} {1:>14} {2:>14} {3:>9}'.format(
+        'paragraphs', 'xpath (ms)', 'single (ms)', 'speedup'))
+    for size in sizes:
+        response = HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=make_article('joe.schmoe', n_paragraphs=size).encode('utf-8'),
+            encoding='utf-8',
+        )
+        assert xpath_sections(response) == split_sections(response, 4)
+        old = best_time(xpath_sections, response)
+        new = best_time(lambda response: split_sections(response, 4), response)
+        print('{0:>12} {1:>14.3f} {2:>14.3f} {3:>8.1f}x'.format(
+            size * 4, old * 1000, new * 1000, old / new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Measure the SQLPipeline's insert throughput under each SQLite performance
+profile (see usesthis_crawler.models.SQLITE_PROFILES), with and without
+batching.
+
+Usage: python benchmarks/bench_sqlite_profiles.py [N_ITEMS]
+"""
+
+from __future__ import print_function
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from usesthis_crawler import logger
+from usesthis_crawler.items import PersonItem, ToolItem
+from usesthis_crawler.models import init_models, SQLITE_PROFILES
+from usesthis_crawler.pipelines import SQLPipeline
+from usesthis_crawler.synthetic import make_slug
+
+
+def make_items(n_items, n_tools=30):
+    for idx in range(n_items):
+        slug = make_slug(idx)
+        person = PersonItem(
+            name=slug, article_url='https://usesthis.com/interviews/%s/' % slug,
+            pub_date='2015-08-16', title='Synthetic interviewee',
+            img_src='https://usesthis.com/images/portraits/%s.jpg' % slug,
+            bio='Bio ' * 50, hardware='Hardware ' * 100,
+            software='Software ' * 100, dream='Dream ' * 50,
+        )
+        # A mix of popular tools and tools that only this person uses
+        tools = [ToolItem(tool_name='Tool %d' % (tool_idx if tool_idx % 2 else idx * n_tools + tool_idx),
+                          tool_url='https://tools.example.com/%d/' % tool_idx)
+                 for tool_idx in range(n_tools)]
+        yield dict(person=person, tools=tools)
+
+
+def items_per_sec(profile, batch_size, n_items, tmpdir):
+    db_path = os.path.join(tmpdir, '%s-%d.db' % (profile, batch_size))
+    engine = init_models(db_path, profile=profile)
+    pipeline = SQLPipeline(batch_size=batch_size)
+    pipeline.open_spider(None)
+    started = time.time()
+    for item in make_items(n_items):
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+    elapsed = time.time() - started
+    engine.dispose()
+    return n_items / elapsed
+
+
+def main(argv):
+    n_items = int(argv[1]) if len(argv) > 1 else 2000
+    logger.setLevel(logging.CRITICAL)
+    # SQLPipeline marks every stored item on stderr
+    sys.stderr = open(os.devnull, 'w')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{0:>10} {1:>16} {2:>16}'.format('profile', 'batch=1 (it/s)', 'batch=100 (it/s)'))
+        for profile in sorted(SQLITE_PROFILES):
+            print('{0:>10} {1:>16.1f} {2:>16.1f}'.format(
+                profile,
+                items_per_sec(profile, 1, n_items, tmpdir),
+                items_per_sec(profile, 100, n_items, tmpdir)))
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+"""Compare the two tool-link extraction paths of UsesthisSpider (one
+ItemLoader per link, or `extract_tool_items()`) on link-heavy synthetic
+interviews.
+
+Usage: python benchmarks/bench_tools.py [N_LINKS ...]
+"""
+
+from __future__ import print_function
+import sys
+from scrapy.http import HtmlResponse
+from benchutils import best_time
+from usesthis_crawler.spiders.usesthis import UsesthisSpider, extract_tool_items
+from usesthis_crawler.synthetic import make_article
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [10, 100, 1000, 5000]
+    spider = UsesthisSpider('usesthis')
+    print('{0:>8} {1:>14} {2:>14} {3:>9}'.format(
+        'links', 'loader (ms)', 'fast (ms)', 'speedup'))
+    for size in sizes:
+        # Spread the links over 4 sections of 5 paragraphs each
+        n_links = max(1, size // 20)
+        response = HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=make_article('joe.schmoe', n_paragraphs=5, n_links=n_links).encode('utf-8'),
+            encoding='utf-8',
+        )
+        assert spider.load_tool_items(response) == extract_tool_items(response)
+        old = best_time(spider.load_tool_items, response)
+        new = best_time(extract_tool_items, response)
+        print('{0:>8} {1:>14.3f} {2:>14.3f} {3:>8.1f}x'.format(
+            n_links * 20, old * 1000, new * 1000, old / new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""Compare the original (urlparse/strptime) and precompiled validation paths
+on interviews with large tool lists, in validated items per second.
+
+Usage: python benchmarks/bench_validation.py [N_TOOLS ...]
+"""
+
+from __future__ import print_function
+import logging
+import sys
+from benchutils import best_time
+from usesthis_crawler import logger
+from usesthis_crawler.items import PersonItem, ToolItem
+from usesthis_crawler.validation import \
+    validate_person_item, validate_tool_items, \
+    fast_validate_person_item, fast_validate_tool_items
+
+
+def make_item(n_tools):
+    person = PersonItem(
+        name=u'Joe Schmoe',
+        article_url=u'https://usesthis.com/interviews/joe.schmoe/',
+        pub_date=u'2015-08-16',
+        title=u'Plumber',
+        img_src=u'https://usesthis.com/images/portraits/joe.schmoe.jpg',
+        bio=u'Bio', hardware=u'Hardware', software=u'Software', dream=u'Dream',
+    )
+    tools = [ToolItem(tool_name=u'Tool {0}'.format(idx),
+                      tool_url=u'https://tools.example.com/{0}/'.format(idx))
+             for idx in range(n_tools)]
+    return dict(person=person, tools=tools)
+
+
+def validator(validate_person, validate_tools):
+    def validate(item):
+        validate_person(item['person'])
+        # The tool validation filters the list in place
+        validate_tools(list(item['tools']), item['person'])
+    return validate
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [10, 100, 1000, 10000]
+    logger.setLevel(logging.CRITICAL)
+    old_validate = validator(validate_person_item, validate_tool_items)
+    new_validate = validator(fast_validate_person_item, fast_validate_tool_items)
+    print('{0:>8} {1:>16} {2:>16} {3:>9}'.format(
+        'tools', 'old (items/s)', 'fast (items/s)', 'speedup'))
+    for size in sizes:
+        item = make_item(size)
+        old = best_time(old_validate, item)
+        new = best_time(new_validate, item)
+        print('{0:>8} {1:>16,.0f} {2:>16,.0f} {3:>8.1f}x'.format(
+            size, (size + 1) / old, (size + 1) / new, old / new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,52 @@
+"""Helpers shared by the benchmark scripts."""
+
+import resource
+import subprocess
+import sys
+import timeit
+
+
+def best_time(func, arg, repeat=3):
+    """Return the best time (in seconds) of one `func(arg)` call, repeating
+    the call enough times to get a measurable total.
+    """
+    number = 1
+    while True:
+        elapsed = min(timeit.repeat(lambda: func(arg), number=number, repeat=repeat))
+        if elapsed > 0.2 or number >= 1000:
+            return elapsed / number
+        number *= 10
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Return a dictionary of the requested percentiles (nearest-rank) of
+    `samples`, plus their mean and maximum.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    stats = dict(
+        ('p%d' % point, ordered[min(len(ordered) - 1, int(len(ordered) * point / 100.0))])
+        for point in points
+    )
+    stats['mean'] = sum(ordered) / float(len(ordered))
+    stats['max'] = ordered[-1]
+    return stats
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process, in megabytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return maxrss / (1024.0 * 1024.0)
+    return maxrss / 1024.0
+
+
+def git_revision():
+    """Return the commit that is checked out, if any."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
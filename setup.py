@@ -14,7 +14,11 @@ setup(
     license='MIT',
     packages=find_packages(),
     entry_points=dict(
-        console_scripts=['crawl-usesthis = usesthis_crawler.cli:main'],
+        console_scripts=[
+            'crawl-usesthis = usesthis_crawler.cli:main',
+            'search-usesthis = usesthis_crawler.cli.search:main',
+            'export-usesthis = usesthis_crawler.cli.export:main',
+        ],
     ),
     setup_requires=['nose >=1.0'],
     install_requires=['scrapy >=1.0.3', 'sqlalchemy >=1.0.8', 'pyasn1 >=0.1.8'],
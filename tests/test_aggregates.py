@@ -0,0 +1,198 @@
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from usesthis_crawler import logger
+from usesthis_crawler.aggregates import AGGREGATE_TABLES, YEAR_SQL, count_people, \
+    has_tool_stats, most_common_pairs, most_used_tools, pub_year, tool_years, tools_used_with
+from usesthis_crawler.models import init_models
+from usesthis_crawler.pipelines import SQLPipeline
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from tests.test_models import OLD_SCHEMA
+from tests.test_pipelines import make_item
+
+
+class ToolStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        logger.setLevel(logging.CRITICAL)
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'interviews.db')
+        self.engine = init_models(self.db_path, tool_stats=True)
+        self.spider = UsesthisSpider('usesthis')
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def crawl(self, items, replace=False, reason='finished', tool_stats=True):
+        """Write `items` to the database through the SQLPipeline."""
+        pipeline = SQLPipeline(batch_size=2, replace=replace, tool_stats=tool_stats)
+        pipeline.open_spider(self.spider)
+        for item in items:
+            pipeline.process_item(item, self.spider)
+        pipeline.close_spider(self.spider)
+        if replace:
+            pipeline.spider_closed(self.spider, reason)
+
+    def make_items(self):
+        joe = make_item('joe.schmoe', ('Vim', 'Git', 'Make'))
+        jane = make_item('jane.schmoe', ('Vim', 'Git'))
+        jane['person']['pub_date'] = '2015-06-01'
+        jim = make_item('jim.schmoe', ('Emacs', 'Git'))
+        return [joe, jane, jim]
+
+    def tool_id(self, tool_name):
+        return self.engine.execute('SELECT id FROM tools WHERE tool_name = ?',
+                                   (tool_name,)).scalar()
+
+    def tool_names(self, tool_counts):
+        return [(tool_count.tool_name, tool_count.n_people) for tool_count in tool_counts]
+
+    def assertCountsUpToDate(self):
+        """Check the aggregate tables against counts made from scratch."""
+        with self.engine.connect() as conn:
+            def snapshot():
+                return dict((table, sorted(tuple(row) for row in
+                                           conn.execute('SELECT * FROM {0}'.format(table))))
+                            for table in AGGREGATE_TABLES)
+            counts = snapshot()
+            transaction = conn.begin()
+            for table in AGGREGATE_TABLES:
+                conn.execute('DELETE FROM {0}'.format(table))
+            count_people(conn)
+            recounted = snapshot()
+            transaction.rollback()
+        self.assertEquals(counts, recounted)
+
+    def test_counts_kept_in_sync(self):
+        """Verify that the tools of the people written by the SQLPipeline are counted, overall, per year and per pair of tools.
+        """
+        self.crawl(self.make_items())
+        self.assertCountsUpToDate()
+        with self.engine.connect() as conn:
+            self.assertEquals(self.tool_names(most_used_tools(conn, limit=2)),
+                              [('Git', 3), ('Vim', 2)])
+            self.assertEquals(sorted(self.tool_names(most_used_tools(conn, year=2015))),
+                              [('Git', 1), ('Vim', 1)])
+            self.assertEquals(tool_years(conn, self.tool_id('Git')), [(2014, 2), (2015, 1)])
+
+            self.assertEquals(self.tool_names(tools_used_with(conn, self.tool_id('Git'), limit=1)),
+                              [('Vim', 2)])
+            self.assertEquals(sorted(self.tool_names(tools_used_with(conn, self.tool_id('Git')))),
+                              [('Emacs', 1), ('Make', 1), ('Vim', 2)])
+            self.assertEquals(most_common_pairs(conn, limit=1),
+                              [(self.tool_id('Vim'), self.tool_id('Git'), 2)])
+
+    def test_changed_people_recounted(self):
+        """Verify that the counts follow the people whose tools or pub_date changed, and that the counts that get to 0 are dropped.
+        """
+        self.crawl(self.make_items())
+        joe = make_item('joe.schmoe', ('Vim', 'Git', 'Make'))
+        joe['person']['pub_date'] = '2016-01-01'
+        # Changed twice in the same batch: the last item wins
+        jane_before = make_item('jane.schmoe', ('Vim',))
+        jane = make_item('jane.schmoe', ('Emacs',))
+        jane['person']['pub_date'] = '2015-06-01'
+        self.crawl([joe, jane_before, jane, make_item('jack.schmoe', ('Vim', 'Make'))])
+        self.assertCountsUpToDate()
+
+        with self.engine.connect() as conn:
+            self.assertEquals(tool_years(conn, self.tool_id('Git')), [(2014, 1), (2016, 1)])
+            self.assertEquals(self.tool_names(tools_used_with(conn, self.tool_id('Emacs'))),
+                              [('Git', 1)])
+            self.assertEquals(conn.execute(
+                'SELECT count(*) FROM tool_pairs WHERE n_people <= 0').scalar(), 0)
+
+    def test_counts_rebuilt_when_not_kept(self):
+        """Verify that a crawl that doesn't keep the counts in sync rebuilds them once it's done, if the database has them.
+        """
+        self.crawl(self.make_items())
+        joe = make_item('joe.schmoe', ('Emacs',))
+        joe['person']['pub_date'] = '2016-01-01'
+        self.crawl([joe, make_item('jack.schmoe', ('Vim', 'Make'))], tool_stats=False)
+        self.assertCountsUpToDate()
+        with self.engine.connect() as conn:
+            self.assertEquals(tool_years(conn, self.tool_id('Emacs')), [(2014, 1), (2016, 1)])
+
+    def test_counts_opt_in(self):
+        """Verify that the aggregate tables are only created when asked for.
+        """
+        self.engine.dispose()
+        os.remove(self.db_path)
+        self.engine = init_models(self.db_path)
+        self.crawl(self.make_items(), tool_stats=False)
+        with self.engine.connect() as conn:
+            self.assertFalse(has_tool_stats(conn))
+            self.assertEquals(conn.execute('SELECT count(*) FROM people').scalar(), 3)
+
+    def test_malformed_pub_dates_counted(self):
+        """Verify that people whose pub_date has no year (as can be stored without validation) are written, and counted in year 0 like count_people() does.
+        """
+        joe, jane, jim = self.make_items()
+        jane['person']['pub_date'] = ''
+        jim['person']['pub_date'] = 'June 2015'
+        self.crawl([joe, jane, jim])
+        self.assertEquals(self.engine.execute('SELECT count(*) FROM people').scalar(), 3)
+        self.assertCountsUpToDate()
+        with self.engine.connect() as conn:
+            self.assertEquals(tool_years(conn, self.tool_id('Git')), [(0, 2), (2014, 1)])
+
+    def test_pub_year_matches_sql(self):
+        """Verify that pub_year() finds the same year as YEAR_SQL.
+        """
+        with self.engine.connect() as conn:
+            for pub_date in ('2014-04-08', '', 'June 2015', ' 2015-01-01', '-12', '20x1', '0099'):
+                self.assertEquals(pub_year(pub_date), conn.execute(
+                    'SELECT ' + YEAR_SQL.format('?'), (pub_date,)).scalar(), pub_date)
+
+    def test_replaced_database_recounted(self):
+        """Verify that the counts follow the changes applied when replacing the database, including the interviews that get deleted.
+        """
+        self.crawl(self.make_items())
+        joe = make_item('joe.schmoe', ('Vim', 'Make'))
+        self.crawl([joe, make_item('jack.schmoe', ('Vim', 'Git'))], replace=True)
+        self.assertCountsUpToDate()
+
+        with self.engine.connect() as conn:
+            self.assertEquals(sorted(self.tool_names(most_used_tools(conn))),
+                              [('Git', 1), ('Make', 1), ('Vim', 2)])
+
+    def test_queries_read_indexes(self):
+        """Verify that the queries read the counts in order from an index, instead of sorting them.
+        """
+        self.crawl(self.make_items())
+        with self.engine.connect() as conn:
+            for query in ('SELECT * FROM tool_counts ORDER BY n_people DESC LIMIT 5',
+                          'SELECT * FROM tool_year_counts WHERE year = 2014 '
+                          'ORDER BY n_people DESC LIMIT 5',
+                          'SELECT * FROM tool_pairs WHERE tool_b = 1 ORDER BY n_people DESC LIMIT 5',
+                          'SELECT * FROM tool_pairs ORDER BY n_people DESC LIMIT 5'):
+                plan = ' '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query))
+                self.assertIn('INDEX', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_existing_database_counted(self):
+        """Verify that init_models() counts the tools of a database created without the aggregate tables.
+        """
+        self.engine.dispose()
+        os.remove(self.db_path)
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        con.executescript('''
+            INSERT INTO people VALUES (1, 'Joe Schmoe', '2014-04-08', 'Plumber',
+                'joe.jpg', 'https://usesthis.com/interviews/joe.schmoe/',
+                'Bio', 'A ThinkPad', 'Software', 'Dream');
+            INSERT INTO tools VALUES (1, 'Vim', 'http://www.vim.org/');
+            INSERT INTO tools VALUES (2, 'Git', 'http://git-scm.com/');
+            INSERT INTO people_to_tools VALUES (1, 1);
+            INSERT INTO people_to_tools VALUES (1, 2);
+        ''')
+        con.close()
+
+        self.engine = init_models(self.db_path, tool_stats=True)
+        with self.engine.connect() as conn:
+            self.assertEquals(sorted(self.tool_names(most_used_tools(conn))),
+                              [('Git', 1), ('Vim', 1)])
+            self.assertEquals(most_common_pairs(conn), [(1, 2, 1)])
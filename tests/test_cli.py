@@ -242,7 +242,8 @@ class CmdlineArgsTestCase(ConfigCheckingTestCase):
 
         settings = process_mock.call_args[0][0]
 
-        self.assertSettingEquals(settings, 'DB_PATH', 'some-test-dir/here/test.db_new')
+        self.assertSettingEquals(settings, 'DB_PATH', 'some-test-dir/here/test.db')
+        self.assertSettingEquals(settings, 'DB_REPLACE', True)
         self.assertTrue(os.path.exists('some-test-dir/here/test.db'))
         self.assertFalse(os.path.exists('some-test-dir/here/test.db_new'))
 
@@ -262,10 +263,21 @@ class CmdlineArgsTestCase(ConfigCheckingTestCase):
 
         settings = process_mock.call_args[0][0]
 
-        self.assertSettingEquals(settings, 'DB_PATH', 'some-test-dir/here/test.db_new')
+        self.assertSettingEquals(settings, 'DB_PATH', 'some-test-dir/here/test.db')
+        self.assertSettingEquals(settings, 'DB_REPLACE', True)
         self.assertTrue(os.path.exists('some-test-dir/here/test.db'))
         self.assertFalse(os.path.exists('some-test-dir/here/test.db_new'))
 
+    def test_db_replace_not_incremental(self):
+        """Verify that the "replace database" and "incremental" options can't be used together.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            with self.assertRaises(SystemExit):
+                main(['', '-d', 'some-test-dir/here/test.db', '-r', '-i'])
+
+        self.assertFalse(process_mock.called)
+
     def test_verbose_works(self):
         """Verify that the verbose option can be enabled via the command-line.
         """
@@ -296,3 +308,210 @@ class CmdlineArgsTestCase(ConfigCheckingTestCase):
         self.assertSettingEquals(settings, 'LOG_LEVEL', 'DEBUG')
         self.assertTrue(ValidationPipeline._verbose)
 
+
+    def test_incremental_works(self):
+        """Verify that the incremental-crawl option can be enabled via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '-i'])
+
+        self.assertTrue(process_mock.called)
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertSettingEquals(settings, 'INCREMENTAL_CRAWL', True)
+
+    def test_incremental_requires_database(self):
+        """Verify that the incremental-crawl option can't be combined with the skip-database option.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            with self.assertRaises(SystemExit):
+                main(['', '-i', '-s'])
+
+        self.assertFalse(process_mock.called)
+
+    def test_resume_works(self):
+        """Verify that the crawl state directory can be set via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '--resume', 'some-test-dir/job'])
+
+        self.assertTrue(process_mock.called)
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertSettingEquals(settings, 'JOBDIR', 'some-test-dir/job')
+        self.assertSettingEquals(settings, 'JOB_RESUMED', False)
+
+        os.makedirs('some-test-dir/job')
+        open('some-test-dir/job/spider.state', 'w').close()
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '--resume', 'some-test-dir/job'])
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertSettingEquals(settings, 'JOB_RESUMED', True)
+
+    def test_resume_clears_stale_job_files(self):
+        """Verify that the files of a crawl that was killed before saving its state are deleted, except for the commit log of what it wrote.
+        """
+        os.makedirs('some-test-dir/job/requests.queue')
+        with open('some-test-dir/job/requests.seen', 'w') as seen_file:
+            seen_file.write('0123456789abcdef\n')
+
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True):
+            main(['', '-s', '--resume', 'some-test-dir/job'])
+        self.assertEquals(os.listdir('some-test-dir/job'), [])
+
+        os.makedirs('some-test-dir/job/requests.queue')
+        with open('some-test-dir/job/committed.urls', 'w') as log_file:
+            log_file.write('https://usesthis.com/interviews/joe.schmoe/\n')
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True):
+            main(['', '-s', '--resume', 'some-test-dir/job'])
+        self.assertEquals(os.listdir('some-test-dir/job'), ['committed.urls'])
+
+    def test_resume_replace_requires_staging(self):
+        """Verify that a stopped crawl that wasn't replacing the database can't be resumed with the "replace database" option.
+        """
+        os.makedirs('some-test-dir/job')
+        open('some-test-dir/job/spider.state', 'w').close()
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            with self.assertRaises(SystemExit):
+                main(['', '-d', 'some-test-dir/test.db', '-r', '--resume', 'some-test-dir/job'])
+
+        self.assertFalse(process_mock.called)
+
+    def test_http_cache_works(self):
+        """Verify that the HTTP cache can be enabled (and sized) via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '-c', 'some-test-dir/cache', '--http-cache-size', '5'])
+
+        self.assertTrue(process_mock.called)
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertSettingEquals(settings, 'HTTPCACHE_ENABLED', True)
+        self.assertSettingEquals(settings, 'HTTPCACHE_DIR', os.path.abspath('some-test-dir/cache'))
+        self.assertSettingEquals(settings, 'HTTPCACHE_MAX_SIZE', 5 * 1024 * 1024)
+
+    def test_default_start_url(self):
+        """Verify that the crawl starts at usesthis.com by default.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main([''])
+
+        crawl_kwargs = process_mock.return_value.crawl.call_args[1]
+        self.assertEquals(crawl_kwargs['start_urls'], ('https://usesthis.com/interviews/',))
+        self.assertEquals(crawl_kwargs['allowed_domains'], ['usesthis.com'])
+
+    def test_start_url_works(self):
+        """Verify that the start URL (and with it, the allowed domain) can be changed via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '--start-url', 'http://127.0.0.1:8000/interviews/'])
+
+        crawl_kwargs = process_mock.return_value.crawl.call_args[1]
+        self.assertEquals(crawl_kwargs['start_urls'], ('http://127.0.0.1:8000/interviews/',))
+        self.assertEquals(crawl_kwargs['allowed_domains'], ['127.0.0.1'])
+
+    def test_allowed_domain_works(self):
+        """Verify that the allowed domain can be set via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '--start-url', 'http://www.example.com/interviews/',
+                  '--allowed-domain', 'example.com'])
+
+        crawl_kwargs = process_mock.return_value.crawl.call_args[1]
+        self.assertEquals(crawl_kwargs['allowed_domains'], ['example.com'])
+
+    def test_parallel_listing_works(self):
+        """Verify that the parallel-listing mode (and the page count) can be set via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '-p', '--listing-pages', '12'])
+
+        self.assertTrue(process_mock.called)
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertSettingEquals(settings, 'PARALLEL_LISTING', True)
+        self.assertSettingEquals(settings, 'LISTING_PAGE_COUNT', 12)
+
+    def test_jsonl_works(self):
+        """Verify that the JSON Lines export can be enabled (and configured) via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '-s', '-j', 'some-test-dir/interviews.jsonl.gz',
+                  '--jsonl-compression', 'gzip', '--jsonl-max-size', '64'])
+
+        self.assertTrue(process_mock.called)
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertDictSettingIsNone(settings, 'ITEM_PIPELINES', 'usesthis_crawler.pipelines.SQLPipeline')
+        self.assertDictSettingIsNotNone(settings, 'ITEM_PIPELINES', 'usesthis_crawler.pipelines.JSONLinesPipeline')
+        self.assertSettingEquals(settings, 'JSONL_PATH', 'some-test-dir/interviews.jsonl.gz')
+        self.assertSettingEquals(settings, 'JSONL_COMPRESSION', 'gzip')
+        self.assertSettingEquals(settings, 'JSONL_MAX_SIZE', 64 * 1024 * 1024)
+
+    def test_jsonl_parses_every_interview(self):
+        """Verify that the unchanged interviews aren't skipped when they are also written to a JSON Lines file.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '-d', 'path-to-interviews.db', '-j', 'some-test-dir/interviews.jsonl'])
+
+        settings = process_mock.call_args[0][0]
+        self.assertDictSettingIsNotNone(settings, 'ITEM_PIPELINES', 'usesthis_crawler.pipelines.SQLPipeline')
+        self.assertSettingEquals(settings, 'SKIP_UNCHANGED', False)
+
+    def test_jsonl_compression_requires_codec(self):
+        """Verify that asking for a compression whose package isn't installed is an error, rather than a crawl without the JSON Lines file.
+        """
+        with patch.dict('sys.modules', {'zstandard': None}), \
+             patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) as process_mock, \
+             patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                main(['', '-s', '-j', 'interviews.jsonl.zst', '--jsonl-compression', 'zstd'])
+
+        self.assertFalse(process_mock.called)
+
+    def test_db_profile_works(self):
+        """Verify that the SQLite performance profile can be set via the command-line.
+        """
+        with patch('usesthis_crawler.cli.CrawlerProcess', autospec=True) \
+             as process_mock:
+            main(['', '-d', 'path-to-interviews.db', '--db-profile', 'fast'])
+
+        self.assertTrue(process_mock.called)
+
+        settings = process_mock.call_args[0][0]
+
+        self.assertSettingEquals(settings, 'DB_PROFILE', 'fast')
+
+    def test_profile_works(self):
+        """Verify that the crawl can be profiled via the command-line.
+        """
+        with patch.multiple('usesthis_crawler.cli', CrawlerProcess=DEFAULT,
+                            profile_call=DEFAULT, autospec=True) as mocks:
+            main(['', '-s', '--profile', 'some-test-dir/crawl.prof', '--profile-top', '5'])
+
+        process = mocks['CrawlerProcess'].return_value
+        mocks['profile_call'].assert_called_once_with(
+            process.start, 'some-test-dir/crawl.prof', top=5)
+        self.assertFalse(process.start.called)
+        # The database writes happen in the profiled thread
+        settings = mocks['CrawlerProcess'].call_args[0][0]
+        self.assertSettingEquals(settings, 'DB_ASYNC_WRITES', False)
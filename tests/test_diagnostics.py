@@ -0,0 +1,122 @@
+import logging
+import threading
+import unittest
+from mock import Mock
+from usesthis_crawler import logger
+from usesthis_crawler.diagnostics import ValidationDiagnostics, validation_logger
+from usesthis_crawler.pipelines import ValidationPipeline
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from usesthis_crawler.validation import fast_validate_person_item, fast_validate_tool_items
+from tests.test_pipelines import make_item
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+        self.threads.add(threading.current_thread().name)
+
+
+def item_without_bio(idx):
+    item = make_item('joe.schmoe.{0}'.format(idx), tool_names=())
+    item['person']['bio'] = ''
+    return item
+
+
+class ValidationDiagnosticsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.level = logger.level
+        logger.setLevel(logging.WARN)
+        self.output = RecordingHandler()
+
+    def tearDown(self):
+        logger.setLevel(self.level)
+
+    def validate(self, n_items):
+        for idx in range(n_items):
+            item = item_without_bio(idx)
+            fast_validate_person_item(item['person'])
+            fast_validate_tool_items(item['tools'], item['person'])
+
+    def test_warnings_counted_and_sampled(self):
+        """Verify that every validation warning is counted per category, but only the first few of each category are output, from another thread.
+        """
+        diagnostics = ValidationDiagnostics(max_samples=2, output=self.output)
+        diagnostics.start()
+        self.validate(5)
+        diagnostics.stop()
+
+        self.assertEquals(dict(diagnostics.counts), dict(missing_bio=5, no_tools=5))
+        self.assertEquals(diagnostics.samples['missing_bio'], [
+            'Joe Schmoe 0 (https://usesthis.com/interviews/joe.schmoe.0/) doesn\'t have a bio.',
+            'Joe Schmoe 1 (https://usesthis.com/interviews/joe.schmoe.1/) doesn\'t have a bio.',
+        ])
+        self.assertEquals(len(self.output.records), 4)
+        self.assertEquals(self.output.threads, set(['QueueListener']))
+        summary = diagnostics.summary()
+        self.assertEquals(summary[0], 'Validation warnings:')
+        self.assertEquals(sorted(summary[1:]), [
+            '       5 missing_bio, e.g. Joe Schmoe 0 (https://usesthis.com/interviews/joe.schmoe.0/) doesn\'t have a bio.',
+            '       5 no_tools, e.g. Joe Schmoe 0 (https://usesthis.com/interviews/joe.schmoe.0/) doesn\'t use any tools.',
+        ])
+
+        # The validation logger is back to normal
+        self.assertTrue(validation_logger.propagate)
+        self.assertEquals(validation_logger.handlers, [])
+
+    def test_every_warning_output(self):
+        """Verify that every warning can be output, while only the first few of each category are kept for the summary.
+        """
+        diagnostics = ValidationDiagnostics(max_samples=2, output=self.output, output_all=True)
+        diagnostics.start()
+        self.validate(5)
+        diagnostics.stop()
+
+        self.assertEquals(len(self.output.records), 10)
+        self.assertEquals(len(diagnostics.samples['no_tools']), 2)
+
+    def test_summary_at_close_spider(self):
+        """Verify that the ValidationPipeline logs a summary of the warnings when the spider closes, and records their counts in the crawl stats.
+        """
+        spider = UsesthisSpider('usesthis')
+        crawler = Mock(spec=['settings', 'stats'])
+        crawler.settings.getbool.return_value = True
+        crawler.settings.getint.return_value = 0
+        pipeline = ValidationPipeline.from_crawler(crawler)
+        pipeline._verbose = False
+        pipeline.open_spider(spider)
+        for idx in range(3):
+            pipeline.process_item(item_without_bio(idx), spider)
+
+        logger.addHandler(self.output)
+        try:
+            pipeline.close_spider(spider)
+        finally:
+            logger.removeHandler(self.output)
+
+        self.assertEquals(self.output.records[0], 'Validation warnings:')
+        self.assertEquals(len(self.output.records), 3)
+        crawler.stats.set_value.assert_any_call('validation/missing_bio', 3)
+        crawler.stats.set_value.assert_any_call('validation/no_tools', 3)
+
+    def test_samples_bounded_when_verbose(self):
+        """Verify that the ValidationPipeline outputs every warning in verbose mode, but still only keeps the first few of each category.
+        """
+        pipeline = ValidationPipeline()
+        pipeline._verbose = True
+        pipeline.log_samples = 1
+        pipeline.open_spider(None)
+        logger.addHandler(self.output)
+        try:
+            for idx in range(3):
+                pipeline.process_item(item_without_bio(idx), None)
+        finally:
+            pipeline.diagnostics.stop()
+            logger.removeHandler(self.output)
+
+        self.assertEquals(len(self.output.records), 6)
+        self.assertEquals(len(pipeline.diagnostics.samples['missing_bio']), 1)
@@ -0,0 +1,149 @@
+import datetime
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from StringIO import StringIO
+from usesthis_crawler import logger
+from usesthis_crawler.cli.export import main
+from usesthis_crawler.export import export_database
+from usesthis_crawler.models import init_models
+from usesthis_crawler.pipelines import SQLPipeline
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from tests.test_models import OLD_SCHEMA
+from tests.test_pipelines import make_item
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipIf(pyarrow is None, 'exporting requires the "pyarrow" package')
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        logger.setLevel(logging.CRITICAL)
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'interviews.db')
+        self.out_dir = os.path.join(self.tmpdir, 'export')
+
+        joe = make_item('joe.schmoe', ('Vim', 'Git'))
+        jane = make_item('jane.schmoe', ('Vim',))
+        jane['person']['pub_date'] = '2015-06-01'
+        jim = make_item('jim.schmoe', ('Git', 'Emacs'))
+        self.engine = init_models(self.db_path)
+        pipeline = SQLPipeline(batch_size=10)
+        spider = UsesthisSpider('usesthis')
+        pipeline.open_spider(spider)
+        for item in (joe, jane, jim):
+            pipeline.process_item(item, spider)
+        pipeline.close_spider(spider)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def export(self, **kwargs):
+        with self.engine.connect() as conn:
+            return export_database(conn, self.out_dir, **kwargs)
+
+    def test_parquet_export(self):
+        """Verify that the people, the tools and the exploded person-tool relation are written to Parquet files, in row groups of the given size, with the tool names and URLs dictionary-encoded.
+        """
+        written = self.export(row_group_size=2)
+        self.assertEquals([(os.path.basename(path), n_rows) for path, n_rows in written],
+                          [('people.parquet', 3), ('tools.parquet', 3), ('people_tools.parquet', 5)])
+        self.assertEquals(sorted(os.listdir(self.out_dir)),
+                          ['people.parquet', 'people_tools.parquet', 'tools.parquet'])
+
+        people = pyarrow.parquet.read_table(os.path.join(self.out_dir, 'people.parquet'))
+        self.assertEquals(people.column('name').to_pylist(),
+                          ['Joe Schmoe', 'Jane Schmoe', 'Jim Schmoe'])
+        self.assertEquals(people.column('pub_date').to_pylist(),
+                          [datetime.date(2014, 4, 8), datetime.date(2015, 6, 1),
+                           datetime.date(2014, 4, 8)])
+
+        path = os.path.join(self.out_dir, 'people_tools.parquet')
+        self.assertEquals(pyarrow.parquet.ParquetFile(path).metadata.num_row_groups, 3)
+        people_tools = pyarrow.parquet.read_table(path)
+        self.assertIsInstance(people_tools.schema.field_by_name('tool_name').type,
+                              pyarrow.DictionaryType)
+        self.assertEquals(
+            sorted(zip(people_tools.column('person_id').to_pylist(),
+                       people_tools.column('tool_name').to_pylist(),
+                       people_tools.column('tool_url').to_pylist())),
+            [(1, 'Git', 'http://plumbertools.org/git'),
+             (1, 'Vim', 'http://plumbertools.org/vim'),
+             (2, 'Vim', 'http://plumbertools.org/vim'),
+             (3, 'Emacs', 'http://plumbertools.org/emacs'),
+             (3, 'Git', 'http://plumbertools.org/git')])
+
+    def test_arrow_export(self):
+        """Verify that the files can be written in the Arrow IPC format, one record batch per row group.
+        """
+        self.export(file_format='arrow', row_group_size=2)
+        reader = pyarrow.ipc.open_file(pyarrow.OSFile(os.path.join(self.out_dir, 'people_tools.arrow')))
+        self.assertEquals(reader.num_record_batches, 3)
+        people_tools = reader.read_all()
+        self.assertEquals(sorted(people_tools.column('tool_name').to_pylist()),
+                          ['Emacs', 'Git', 'Git', 'Vim', 'Vim'])
+        self.assertEquals(people_tools.column('pub_date').to_pylist()[2],
+                          datetime.date(2015, 6, 1))
+
+    def test_malformed_rows_exported(self):
+        """Verify that dates that can't be parsed are exported as nulls, and that links to missing tools are left out.
+        """
+        self.engine.execute("UPDATE people SET pub_date = '' WHERE id = 1")
+        self.engine.execute("UPDATE people SET pub_date = 'June 2015' WHERE id = 2")
+        self.engine.execute('INSERT INTO people_to_tools VALUES (3, 42)')
+
+        written = self.export()
+        self.assertEquals([n_rows for path, n_rows in written], [3, 3, 5])
+        people = pyarrow.parquet.read_table(os.path.join(self.out_dir, 'people.parquet'))
+        self.assertEquals(people.column('pub_date').to_pylist(),
+                          [None, None, datetime.date(2014, 4, 8)])
+        people_tools = pyarrow.parquet.read_table(os.path.join(self.out_dir, 'people_tools.parquet'))
+        self.assertEquals(people_tools.column('pub_date').to_pylist()[:3], [None, None, None])
+
+    def test_export_command(self):
+        """Verify that the database can be exported via the command-line.
+        """
+        stdout = StringIO()
+        self.assertEquals(main(['', '-d', self.db_path, self.out_dir], stdout=stdout), 0)
+        self.assertEquals(stdout.getvalue().splitlines(), [
+            'Wrote 3 rows to {0}'.format(os.path.join(self.out_dir, 'people.parquet')),
+            'Wrote 3 rows to {0}'.format(os.path.join(self.out_dir, 'tools.parquet')),
+            'Wrote 5 rows to {0}'.format(os.path.join(self.out_dir, 'people_tools.parquet')),
+        ])
+
+    def test_export_command_leaves_database_alone(self):
+        """Verify that the export command reads a database from an older crawler as it is, without migrating it.
+        """
+        db_path = os.path.join(self.tmpdir, 'old.db')
+        con = sqlite3.connect(db_path)
+        con.executescript(OLD_SCHEMA)
+        con.executescript('''
+            INSERT INTO people VALUES (1, 'Joe Schmoe', '2014-04-08', 'Plumber',
+                'joe.jpg', 'https://usesthis.com/interviews/joe.schmoe/',
+                'Bio', 'Hardware', 'Software', 'Dream');
+            INSERT INTO tools VALUES (1, 'Vim', 'http://www.vim.org/');
+            INSERT INTO tools VALUES (2, 'Vim', 'http://www.vim.org/');
+            INSERT INTO people_to_tools VALUES (1, 1);
+        ''')
+        schema = con.execute('SELECT * FROM sqlite_master ORDER BY name').fetchall()
+        con.close()
+
+        self.assertEquals(main(['', '-d', db_path, self.out_dir], stdout=StringIO()), 0)
+        people = pyarrow.parquet.read_table(os.path.join(self.out_dir, 'people.parquet'))
+        self.assertNotIn('content_hash', people.schema.names)
+        self.assertEquals(people.column('name').to_pylist(), ['Joe Schmoe'])
+
+        con = sqlite3.connect(db_path)
+        self.assertEquals(con.execute('SELECT * FROM sqlite_master ORDER BY name').fetchall(),
+                          schema)
+        self.assertEquals(con.execute('SELECT count(*) FROM tools').fetchone()[0], 2)
+        self.assertEquals(con.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        con.close()
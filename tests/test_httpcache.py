@@ -0,0 +1,146 @@
+import shutil
+import tempfile
+import threading
+import unittest
+import requests
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from mock import Mock
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from usesthis_crawler import settings as project_settings
+from usesthis_crawler.httpcache import SQLiteCacheStorage
+
+
+class ConditionalHandler(BaseHTTPRequestHandler):
+    """Serve a page with an ETag, answering "304 Not Modified" when the
+    request's If-None-Match matches it.
+    """
+    etag = '"v1"'
+    full_responses = 0
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+
+        ConditionalHandler.full_responses += 1
+        body = '<html><body>{0}</body></html>'.format(self.etag)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        ConditionalHandler.full_responses = 0
+        self.server = HTTPServer(('127.0.0.1', 0), ConditionalHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/interviews/' % self.server.server_port
+
+        self.cachedir = tempfile.mkdtemp()
+        self.settings = Settings()
+        self.settings.setmodule(project_settings)
+        self.settings.set('HTTPCACHE_ENABLED', True)
+        self.settings.set('HTTPCACHE_DIR', self.cachedir)
+        self.spider = Mock()
+        self.spider.name = 'usesthis'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cachedir)
+
+    def fetch(self, middleware):
+        """Send a request through the cache middleware to the local server,
+        the way Scrapy's downloader would.
+        """
+        request = Request(self.url)
+        cached = middleware.process_request(request, self.spider)
+        if cached is not None:
+            return cached
+
+        headers = dict((key, values[0]) for key, values in request.headers.items())
+        http_response = requests.get(self.url, headers=headers)
+        response = HtmlResponse(
+            url=self.url,
+            status=http_response.status_code,
+            headers=dict(http_response.headers),
+            body=http_response.content,
+        )
+        return middleware.process_response(request, response, self.spider)
+
+    def test_unchanged_page_revalidated(self):
+        """Verify that a cached page is re-requested conditionally, and its cached body is reused when the server answers 304.
+        """
+        middleware = HttpCacheMiddleware(self.settings, Mock())
+        middleware.spider_opened(self.spider)
+        first = self.fetch(middleware)
+        second = self.fetch(middleware)
+        middleware.spider_closed(self.spider)
+
+        self.assertEquals(first.status, 200)
+        self.assertEquals(second.status, 200)
+        self.assertEquals(second.body, first.body)
+        self.assertIn('cached', second.flags)
+        self.assertEquals(ConditionalHandler.full_responses, 1)
+
+    def test_cache_persists_between_runs(self):
+        """Verify that the cache is still there for the next crawl.
+        """
+        for _ in range(2):
+            middleware = HttpCacheMiddleware(self.settings, Mock())
+            middleware.spider_opened(self.spider)
+            response = self.fetch(middleware)
+            middleware.spider_closed(self.spider)
+
+        self.assertEquals(response.body, '<html><body>"v1"</body></html>')
+        self.assertEquals(ConditionalHandler.full_responses, 1)
+
+    def test_changed_page_refetched(self):
+        """Verify that a page whose ETag changed is downloaded (and cached) again.
+        """
+        middleware = HttpCacheMiddleware(self.settings, Mock())
+        middleware.spider_opened(self.spider)
+        self.fetch(middleware)
+        ConditionalHandler.etag = '"v2"'
+        try:
+            response = self.fetch(middleware)
+        finally:
+            ConditionalHandler.etag = '"v1"'
+        middleware.spider_closed(self.spider)
+
+        self.assertEquals(response.body, '<html><body>"v2"</body></html>')
+        self.assertEquals(ConditionalHandler.full_responses, 2)
+
+    def test_least_recently_used_evicted(self):
+        """Verify that the storage evicts the least-recently used responses once it grows past HTTPCACHE_MAX_SIZE.
+        """
+        self.settings.set('HTTPCACHE_MAX_SIZE', 2500)
+        storage = SQLiteCacheStorage(self.settings)
+        storage.open_spider(self.spider)
+
+        urls = ['http://usesthis.test/%d/' % idx for idx in range(3)]
+        for url in urls[:2]:
+            storage.store_response(self.spider, Request(url),
+                                   HtmlResponse(url=url, body='x' * 1000))
+        # Touch the first response, so that the second one is the oldest
+        self.assertIsNotNone(storage.retrieve_response(self.spider, Request(urls[0])))
+        storage.store_response(self.spider, Request(urls[2]),
+                               HtmlResponse(url=urls[2], body='x' * 1000))
+
+        self.assertIsNotNone(storage.retrieve_response(self.spider, Request(urls[0])))
+        self.assertIsNone(storage.retrieve_response(self.spider, Request(urls[1])))
+        self.assertIsNotNone(storage.retrieve_response(self.spider, Request(urls[2])))
+        self.assertLessEqual(storage.size, 2500)
+        storage.close_spider(self.spider)
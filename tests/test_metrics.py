@@ -0,0 +1,84 @@
+import unittest
+from mock import Mock
+from scrapy.exceptions import NotConfigured
+from usesthis_crawler.metrics import \
+    Histogram, CrawlMetrics, MetricsExtension, NULL_METRICS, crawler_metrics
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_buckets_and_quantiles(self):
+        """Verify that observations are counted into the bucket of their upper bound, and that the quantiles are estimated from the buckets.
+        """
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 0.5, 3.0):
+            histogram.observe(value)
+
+        self.assertEquals(histogram.cumulative_counts(),
+                          [(0.1, 2), (1.0, 4), (float('inf'), 5)])
+        self.assertEquals(histogram.quantile(0.4), 0.1)
+        self.assertEquals(histogram.quantile(0.5), 1.0)
+        self.assertEquals(histogram.quantile(0.99), 3.0)
+        summary = histogram.to_dict()
+        self.assertEquals(summary['count'], 5)
+        self.assertAlmostEquals(summary['mean'], 4.15 / 5)
+        self.assertEquals(summary['max'], 3.0)
+
+    def test_empty(self):
+        """Verify that an empty histogram has quantiles of 0.
+        """
+        self.assertEquals(Histogram().to_dict()['p99'], 0.0)
+
+
+class CrawlMetricsTestCase(unittest.TestCase):
+    def test_timer(self):
+        """Verify that a timed block is observed once, even if it raises.
+        """
+        metrics = CrawlMetrics()
+        with metrics.timer('parse_article'):
+            pass
+        with self.assertRaises(ValueError):
+            with metrics.timer('parse_article'):
+                raise ValueError
+        self.assertEquals(metrics.report()['stages']['parse_article']['count'], 2)
+
+    def test_prometheus(self):
+        """Verify the Prometheus text format of the histograms (cumulative buckets) and the counters.
+        """
+        metrics = CrawlMetrics()
+        metrics.stages['download'] = Histogram(buckets=(0.5,))
+        metrics.observe('download', 0.25)
+        metrics.observe('download', 2.0)
+        metrics.inc('items_dropped')
+        metrics.inc('tools_rejected', 3)
+
+        self.assertEquals(metrics.prometheus().splitlines()[2:], [
+            'usesthis_stage_seconds_bucket{stage="download",le="0.5"} 1',
+            'usesthis_stage_seconds_bucket{stage="download",le="+Inf"} 2',
+            'usesthis_stage_seconds_sum{stage="download"} 2.25',
+            'usesthis_stage_seconds_count{stage="download"} 2',
+            '# HELP usesthis_events_total Number of times each event happened during the crawl.',
+            '# TYPE usesthis_events_total counter',
+            'usesthis_events_total{event="items_dropped"} 1',
+            'usesthis_events_total{event="tools_rejected"} 3',
+        ])
+
+
+class MetricsExtensionTestCase(unittest.TestCase):
+    def test_not_configured(self):
+        """Verify that the extension is disabled unless an output path is set, and that the crawler's components then get the no-op metrics.
+        """
+        crawler = Mock(spec=['settings', 'signals'])
+        crawler.settings.get.return_value = ''
+        with self.assertRaises(NotConfigured):
+            MetricsExtension.from_crawler(crawler)
+        self.assertIs(crawler_metrics(crawler), NULL_METRICS)
+
+    def test_download_latency(self):
+        """Verify that the download latency of every response is recorded.
+        """
+        extension = MetricsExtension(report_path='metrics.json')
+        for meta in (dict(download_latency=0.2), {}):
+            extension.response_received(Mock(), Mock(meta=meta), None)
+
+        self.assertEquals(extension.metrics.counters['responses'], 2)
+        self.assertEquals(extension.metrics.stages['download'].count, 1)
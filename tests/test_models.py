@@ -0,0 +1,165 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from sqlalchemy.exc import OperationalError
+from usesthis_crawler.models import \
+    init_models, create_indexes, read_only_engine, TOOL_INDEX_NAME
+
+
+OLD_SCHEMA = '''
+CREATE TABLE people (
+    id INTEGER NOT NULL, name VARCHAR NOT NULL, pub_date VARCHAR NOT NULL,
+    title VARCHAR NOT NULL, img_src VARCHAR NOT NULL,
+    article_url VARCHAR NOT NULL, bio VARCHAR NOT NULL,
+    hardware VARCHAR NOT NULL, software VARCHAR NOT NULL,
+    dream VARCHAR NOT NULL,
+    PRIMARY KEY (id), UNIQUE (name), UNIQUE (img_src), UNIQUE (article_url)
+);
+CREATE TABLE tools (
+    id INTEGER NOT NULL, tool_name VARCHAR NOT NULL,
+    tool_url VARCHAR NOT NULL, PRIMARY KEY (id)
+);
+CREATE TABLE people_to_tools (
+    person_id INTEGER NOT NULL, tool_id INTEGER NOT NULL,
+    PRIMARY KEY (person_id, tool_id),
+    FOREIGN KEY(person_id) REFERENCES people (id),
+    FOREIGN KEY(tool_id) REFERENCES tools (id)
+);
+'''
+
+
+SECONDARY_INDEXES = ['ix_people_pub_date', 'ix_people_to_tools_tool_id']
+
+
+class ModelsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'interviews.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def index_names(self):
+        con = sqlite3.connect(self.db_path)
+        names = [row[0] for row in con.execute(
+            "select name from sqlite_master where type = 'index' and name like 'ix_%' "
+            "and tbl_name in ('people', 'tools', 'people_to_tools') order by name"
+        )]
+        con.close()
+        return names
+
+    def query_plan(self, query):
+        con = sqlite3.connect(self.db_path)
+        plan = ' '.join(row[-1] for row in con.execute('explain query plan ' + query))
+        con.close()
+        return plan
+
+    def test_tools_table_migrated(self):
+        """Verify that init_models() collapses the duplicate tools of a database written by an older version of the crawler.
+        """
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        for person_id in (1, 2):
+            con.execute(
+                'insert into people values (?, ?, "2014-04-08", "", ?, ?, "", "", "", "")',
+                (person_id, 'p%d' % person_id, 'i%d.jpg' % person_id, 'a%d' % person_id),
+            )
+        con.executemany('insert into tools values (?, ?, ?)', [
+            (1, 'Vim', 'http://www.vim.org/'),
+            (2, 'Git', 'http://git-scm.com/'),
+            (3, 'Vim', 'http://www.vim.org/'),
+        ])
+        con.executemany('insert into people_to_tools values (?, ?)',
+                        [(1, 1), (1, 2), (2, 3)])
+        con.commit()
+        con.close()
+
+        init_models(self.db_path)
+        init_models(self.db_path)
+
+        con = sqlite3.connect(self.db_path)
+        tools = con.execute('select id, tool_name from tools order by id').fetchall()
+        relations = con.execute('select * from people_to_tools order by 1, 2').fetchall()
+        index_names = [row[1] for row in con.execute('pragma index_list(tools)')]
+        con.close()
+
+        self.assertEquals(tools, [(1, 'Vim'), (2, 'Git')])
+        self.assertEquals(relations, [(1, 1), (1, 2), (2, 1)])
+        self.assertIn(TOOL_INDEX_NAME, index_names)
+
+    def test_people_table_migrated(self):
+        """Verify that init_models() adds the content_hash column to the people of a database written by an older version of the crawler.
+        """
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        con.execute('insert into people values (1, "p1", "2014-04-08", "", "i1.jpg", "a1", "", "", "", "")')
+        con.commit()
+        con.close()
+
+        init_models(self.db_path)
+        init_models(self.db_path)
+
+        con = sqlite3.connect(self.db_path)
+        self.assertEquals(con.execute('select name, content_hash from people').fetchall(),
+                          [('p1', None)])
+        con.close()
+
+    def test_sqlite_profiles_applied(self):
+        """Verify that init_models() applies the pragmas of the requested SQLite profile to its connections.
+        """
+        for profile, journal_mode, synchronous in (('safe', 'wal', 2),
+                                                   ('fast', 'wal', 1),
+                                                   ('bulk-load', 'off', 0)):
+            engine = init_models(self.db_path, profile=profile)
+            conn = engine.connect()
+            self.assertEquals(conn.execute('pragma journal_mode').scalar().lower(), journal_mode)
+            self.assertEquals(conn.execute('pragma synchronous').scalar(), synchronous)
+            conn.close()
+            engine.dispose()
+
+    def test_read_only_engine(self):
+        """Verify that read_only_engine() opens a database as it is, and refuses to write to it.
+        """
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        con.close()
+
+        engine = read_only_engine(self.db_path)
+        with engine.connect() as conn:
+            self.assertEquals(conn.execute('select count(*) from people').scalar(), 0)
+            self.assertEquals(conn.execute('pragma journal_mode').scalar().lower(), 'delete')
+            with self.assertRaises(OperationalError):
+                conn.execute("insert into tools values (1, 'Vim', 'http://www.vim.org/')")
+        engine.dispose()
+
+    def test_secondary_indexes_added_to_old_database(self):
+        """Verify that init_models() adds the secondary indexes to a database created without them, and that the analytics queries use them.
+        """
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        con.close()
+
+        init_models(self.db_path)
+        self.assertEquals(self.index_names(), sorted(SECONDARY_INDEXES + [TOOL_INDEX_NAME]))
+
+        self.assertIn('ix_people_to_tools_tool_id', self.query_plan(
+            'select tool_id, count(*) from people_to_tools group by tool_id'))
+        self.assertIn('ix_people_to_tools_tool_id', self.query_plan(
+            'select person_id from people_to_tools where tool_id = 1'))
+        self.assertIn(TOOL_INDEX_NAME, self.query_plan(
+            "select id from tools where tool_name = 'Vim'"))
+        self.assertIn('ix_people_pub_date', self.query_plan(
+            "select count(*) from people where pub_date between '2014-01-01' and '2014-12-31'"))
+
+    def test_indexes_deferred_for_bulk_load(self):
+        """Verify that the secondary indexes can be left out during a bulk load, and built afterwards.
+        """
+        init_models(self.db_path)
+        engine = init_models(self.db_path, profile='bulk-load', defer_indexes=True)
+        self.assertEquals(self.index_names(), [TOOL_INDEX_NAME])
+
+        create_indexes(engine)
+        self.assertEquals(self.index_names(), sorted(SECONDARY_INDEXES + [TOOL_INDEX_NAME]))
+        engine.dispose()
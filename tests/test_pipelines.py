@@ -1,14 +1,23 @@
+import glob
+import gzip
+import json
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 import hypothesis.strategies as st
 from hypothesis import given
+from mock import patch
 from scrapy.exceptions import DropItem
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from usesthis_crawler import logger, Session
-from usesthis_crawler.pipelines import ValidationPipeline, SQLPipeline
-from usesthis_crawler.items import PersonItem, ToolItem
+from usesthis_crawler.pipelines import ValidationPipeline, SQLPipeline, JSONLinesPipeline
+from usesthis_crawler.items import PersonItem, ToolItem, required_fields
 from usesthis_crawler.spiders.usesthis import UsesthisSpider
-from usesthis_crawler.models import Base, Person, Tool, people_to_tools_tbl
+from usesthis_crawler.models import Base, Person, Tool, people_to_tools_tbl, init_models
+from usesthis_crawler.replace import ReplaceStage, STAGING_SUFFIX
+from usesthis_crawler.search import search
 
 class ValidationPipelineTestCase(unittest.TestCase):
     def setUp(self):
@@ -75,7 +84,7 @@ class ValidationPipelineTestCase(unittest.TestCase):
                             ('dream', 'My dream setup would be a PipeBuster6000.'),
                         ]),
                         min_size=0,
-                        max_size=len(PersonItem.fields)-1,
+                        max_size=len(required_fields(PersonItem))-1,
                         unique_by=lambda x: x
                     ),
                 ),
@@ -451,12 +460,18 @@ class SQLPipelineTestCase(unittest.TestCase):
         self.assertEquals(same_item, item)
 
         # Create some Person and Tool model objects for comparison
+        # (identical tools are only stored once)
         person = Person(**item['person'])
         person.id = 1
         tools = []
-        for tool_id, tool_item in enumerate(item['tools'], start=1):
+        seen_tools = set()
+        for tool_item in item['tools']:
+            key = (tool_item['tool_name'], tool_item['tool_url'])
+            if key in seen_tools:
+                continue
+            seen_tools.add(key)
             tool = Tool(**tool_item)
-            tool.id = tool_id
+            tool.id = len(tools) + 1
             tools.append(tool)
 
         # Assert that the correct Person model was inserted
@@ -474,6 +489,7 @@ class SQLPipelineTestCase(unittest.TestCase):
 
         # Assert that the correct Tool models were inserted
         same_tools = self.session.query(Tool).all()
+        self.assertEquals(len(same_tools), len(tools))
         for tool_idx, same_tool in enumerate(same_tools):
             tool = tools[tool_idx]
             self.assertEquals(same_tool.id, tool.id)
@@ -482,6 +498,7 @@ class SQLPipelineTestCase(unittest.TestCase):
 
         # Assert that the correct Person-Tool relations were inserted
         relations = self.session.query(people_to_tools_tbl).all()
+        self.assertEquals(len(relations), len(tools))
         for idx, relation in enumerate(sorted(relations)):
             tool = tools[idx]
             self.assertEquals(relation.person_id, person.id)
@@ -567,3 +584,396 @@ class SQLPipelineTestCase(unittest.TestCase):
         # Assert that the correct Person-Tool relations were inserted
         relations_in_db = self.session.query(people_to_tools_tbl).all()
         self.assertFalse(relations_in_db)
+
+
+def make_item(slug, tool_names=('PipeBuster5000',)):
+    person = PersonItem(
+        name=slug.replace('.', ' ').title(),
+        article_url='https://usesthis.com/interviews/{0}/'.format(slug),
+        pub_date='2014-04-08',
+        title='Plumber',
+        img_src='https://usesthis.com/images/portraits/{0}.jpg'.format(slug),
+        bio='Bio',
+        hardware='Hardware',
+        software='Software',
+        dream='Dream',
+    )
+    tools = [ToolItem(tool_name=tool_name,
+                      tool_url='http://plumbertools.org/'+tool_name.lower())
+             for tool_name in tool_names]
+    return dict(person=person, tools=tools)
+
+
+class SQLPipelineBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        logger.setLevel(logging.CRITICAL)
+        engine = create_engine('sqlite:///:memory:')
+        self.connection = engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = Session(bind=self.connection)
+        Base.metadata.create_all(engine)
+        self.spider = UsesthisSpider('usesthis')
+
+    def tearDown(self):
+        self.session.close()
+        self.transaction.rollback()
+        self.connection.close()
+
+    def make_pipeline(self, **kwargs):
+        pipeline = SQLPipeline(**kwargs)
+        pipeline.session = self.session
+        return pipeline
+
+    def test_items_buffered_until_batch_is_full(self):
+        """Verify that the SQLPipeline doesn't write anything until it has buffered `batch_size` items.
+        """
+        pipeline = self.make_pipeline(batch_size=3)
+        pipeline.process_item(make_item('joe.schmoe'), self.spider)
+        pipeline.process_item(make_item('jane.schmoe'), self.spider)
+        self.assertFalse(self.session.query(Person).all())
+
+        pipeline.process_item(make_item('jim.schmoe', ('Wrench', 'Pliers')), self.spider)
+        self.assertEquals(self.session.query(Person).count(), 3)
+        self.assertEquals(self.session.query(Tool).count(), 3)
+        self.assertEquals(self.session.query(people_to_tools_tbl).count(), 4)
+        self.assertFalse(pipeline.buffer)
+
+        jim = self.session.query(Person).filter_by(name='Jim Schmoe').one()
+        self.assertEquals(sorted(tool.tool_name for tool in jim.tools),
+                          ['Pliers', 'Wrench'])
+
+    def test_items_flushed_after_interval(self):
+        """Verify that the SQLPipeline writes its buffer once it is older than `flush_interval` milliseconds.
+        """
+        pipeline = self.make_pipeline(batch_size=100, flush_interval=1)
+        pipeline.process_item(make_item('joe.schmoe'), self.spider)
+        pipeline.buffer_started -= 1
+        pipeline.process_item(make_item('jane.schmoe'), self.spider)
+        self.assertEquals(self.session.query(Person).count(), 2)
+
+    def test_close_spider_flushes_buffer(self):
+        """Verify that closing the spider writes whatever is left in the buffer.
+        """
+        pipeline = self.make_pipeline(batch_size=100)
+        pipeline.process_item(make_item('joe.schmoe'), self.spider)
+        self.assertFalse(self.session.query(Person).all())
+
+        pipeline.close_spider(self.spider)
+        self.assertEquals(self.session.query(Person).count(), 1)
+        self.assertEquals(self.session.query(Tool).count(), 1)
+
+    def test_duplicate_people_skipped_per_row(self):
+        """Verify that a person whose name belongs to someone else in the database doesn't keep the rest of the batch from being written.
+        """
+        pipeline = self.make_pipeline(batch_size=1)
+        pipeline.process_item(make_item('joe.schmoe'), self.spider)
+
+        impostor = make_item('joe.schmoe.2', ('Wrench',))
+        impostor['person']['name'] = 'Joe Schmoe'
+        pipeline = self.make_pipeline(batch_size=3)
+        pipeline.process_item(make_item('jane.schmoe'), self.spider)
+        pipeline.process_item(impostor, self.spider)
+        pipeline.process_item(make_item('jane.schmoe'), self.spider)
+
+        self.assertEquals(
+            sorted(name for name, in self.session.query(Person.name)),
+            ['Jane Schmoe', 'Joe Schmoe'],
+        )
+        self.assertEquals(self.session.query(Tool).count(), 1)
+        self.assertEquals(self.session.query(people_to_tools_tbl).count(), 2)
+        self.assertEquals(pipeline.counts, dict(inserted=1, unchanged=1, duplicate=1))
+
+    def test_changed_people_updated_in_place(self):
+        """Verify that a person who is already in the database is updated in place, tools and all, if anything about them changed, and left alone if nothing did.
+        """
+        pipeline = self.make_pipeline(batch_size=1)
+        joe = make_item('joe.schmoe', ('Wrench', 'Pliers'))
+        joe['person']['content_hash'] = 'v1'
+        pipeline.process_item(joe, self.spider)
+        joe_id = self.session.query(Person.id).scalar()
+
+        joe = make_item('joe.schmoe', ('Wrench', 'Hammer'))
+        joe['person']['hardware'] = 'A new wrench.'
+        joe['person']['content_hash'] = 'v2'
+        pipeline.process_item(joe, self.spider)
+
+        self.assertEquals(self.session.query(Person.id, Person.hardware, Person.content_hash).all(),
+                          [(joe_id, 'A new wrench.', 'v2')])
+        self.assertEquals(sorted(tool.tool_name for tool in self.session.query(Person).one().tools),
+                          ['Hammer', 'Wrench'])
+
+        pipeline.process_item(joe, self.spider)
+        self.assertEquals(pipeline.counts, dict(inserted=1, updated=1, unchanged=1))
+
+        # e.g. parsed again with a better tool extraction
+        joe = make_item('joe.schmoe', ('Wrench', 'Claw hammer'))
+        joe['person']['hardware'] = 'A new wrench.'
+        joe['person']['content_hash'] = 'v2'
+        pipeline.process_item(joe, self.spider)
+        self.assertEquals(sorted(tool.tool_name for tool in self.session.query(Person).one().tools),
+                          ['Claw hammer', 'Wrench'])
+        self.assertEquals(pipeline.counts, dict(inserted=1, updated=2, unchanged=1))
+
+    def test_only_changed_relations_written(self):
+        """Verify that updating a person's tools only deletes and inserts the relations that changed.
+        """
+        pipeline = self.make_pipeline(batch_size=1)
+        pipeline.process_item(make_item('joe.schmoe', ('Wrench', 'Pliers')), self.spider)
+
+        statements = []
+        listen = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(self.connection, 'before_cursor_execute', listen)
+        try:
+            pipeline.process_item(make_item('joe.schmoe', ('Wrench', 'Hammer')), self.spider)
+        finally:
+            event.remove(self.connection, 'before_cursor_execute', listen)
+
+        writes = [statement.split(' (')[0] for statement in statements
+                  if not statement.startswith('SELECT')]
+        self.assertEquals(writes[1:], [
+            'INSERT INTO tools',
+            'DELETE FROM people_to_tools WHERE people_to_tools.person_id = ? AND people_to_tools.tool_id = ?',
+            'INSERT INTO people_to_tools',
+        ])
+        self.assertTrue(writes[0].startswith('INSERT OR IGNORE INTO people'))
+
+    def test_tools_shared_between_people(self):
+        """Verify that a tool used by several people (or linked several times by one person) is only stored once.
+        """
+        pipeline = self.make_pipeline(batch_size=2)
+        pipeline.process_item(make_item('joe.schmoe', ('Vim', 'Git', 'Vim')), self.spider)
+        pipeline.process_item(make_item('jane.schmoe', ('Vim',)), self.spider)
+
+        # A fresh pipeline has to warm its index from the database
+        pipeline = self.make_pipeline(batch_size=1)
+        pipeline.process_item(make_item('jim.schmoe', ('Git', 'Emacs')), self.spider)
+
+        self.assertEquals(
+            sorted(name for name, in self.session.query(Tool.tool_name)),
+            ['Emacs', 'Git', 'Vim'],
+        )
+        self.assertEquals(self.session.query(people_to_tools_tbl).count(), 5)
+        vim = self.session.query(Tool).filter_by(tool_name='Vim').one()
+        self.assertEquals(sorted(person.name for person in vim.people),
+                          ['Jane Schmoe', 'Joe Schmoe'])
+
+
+class SQLPipelineReplaceTestCase(unittest.TestCase):
+    def setUp(self):
+        logger.setLevel(logging.CRITICAL)
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'interviews.db')
+        self.engine = init_models(self.db_path)
+        self.spider = UsesthisSpider('usesthis')
+
+        items = [make_item('joe.schmoe', ('Wrench', 'Pliers')),
+                 make_item('jane.schmoe', ('Wrench',)),
+                 make_item('jim.schmoe', ('Plunger',))]
+        pipeline = SQLPipeline(batch_size=10)
+        pipeline.open_spider(self.spider)
+        for item in items:
+            pipeline.process_item(item, self.spider)
+        pipeline.close_spider(self.spider)
+        self.ids = self.person_ids()
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def person_ids(self):
+        return dict(self.engine.execute('SELECT article_url, id FROM people').fetchall())
+
+    def person_tools(self, slug):
+        return sorted(row[0] for row in self.engine.execute(
+            'SELECT t.tool_name FROM people p '
+            'JOIN people_to_tools pt ON pt.person_id = p.id '
+            'JOIN tools t ON t.id = pt.tool_id WHERE p.name = ?',
+            (slug.replace('.', ' ').title(),)))
+
+    def replace(self, items, reason='finished', **kwargs):
+        pipeline = SQLPipeline(batch_size=2, replace=True, **kwargs)
+        pipeline.open_spider(self.spider)
+        for item in items:
+            pipeline.process_item(item, self.spider)
+        pipeline.close_spider(self.spider)
+        # The database isn't touched until the spider is closed
+        self.assertEquals(self.person_ids(), self.ids)
+        pipeline.spider_closed(self.spider, reason)
+
+    def changed_items(self):
+        jane = make_item('jane.schmoe', ('Wrench', 'Hammer'))
+        jane['person']['hardware'] = 'A new wrench.'
+        return [make_item('joe.schmoe', ('Wrench', 'Pliers')),
+                jane,
+                make_item('jack.schmoe', ('Hammer',))]
+
+    def test_database_replaced(self):
+        """Verify that the interviews of a complete crawl replace the contents of the database, and that the unchanged and changed interviews keep their IDs.
+        """
+        self.replace(self.changed_items())
+
+        ids = self.person_ids()
+        self.assertEquals(sorted(ids), sorted([
+            'https://usesthis.com/interviews/joe.schmoe/',
+            'https://usesthis.com/interviews/jane.schmoe/',
+            'https://usesthis.com/interviews/jack.schmoe/',
+        ]))
+        for slug in ('joe.schmoe', 'jane.schmoe'):
+            url = 'https://usesthis.com/interviews/{0}/'.format(slug)
+            self.assertEquals(ids[url], self.ids[url])
+        self.assertEquals(self.person_tools('joe.schmoe'), ['Pliers', 'Wrench'])
+        self.assertEquals(self.person_tools('jane.schmoe'), ['Hammer', 'Wrench'])
+        self.assertEquals(self.person_tools('jack.schmoe'), ['Hammer'])
+        # Jim's tool isn't anybody's tool anymore
+        self.assertEquals(
+            sorted(row[0] for row in self.engine.execute('SELECT tool_name FROM tools')),
+            ['Hammer', 'Pliers', 'Wrench'])
+
+        with self.engine.connect() as conn:
+            self.assertEquals(sorted(hit.name for hit in search(conn, 'hammer')),
+                              ['Jack Schmoe', 'Jane Schmoe'])
+            self.assertEquals(search(conn, 'plunger'), [])
+        self.assertEquals(os.listdir(self.tmpdir), ['interviews.db'])
+
+    def test_fresh_job_ignores_stale_stage(self):
+        """Verify that the staged interviews of a stopped crawl are only picked up by a crawl that resumes it, not by a fresh one with the same job directory.
+        """
+        job_dir = os.path.join(self.tmpdir, 'job')
+        self.replace([make_item('jack.schmoe', ('Hammer',))], reason='shutdown', job_dir=job_dir)
+        self.assertTrue(os.path.exists(self.db_path + STAGING_SUFFIX))
+
+        self.replace([make_item('joe.schmoe', ('Wrench', 'Pliers'))], job_dir=job_dir)
+        self.assertEquals(sorted(self.person_ids()),
+                          ['https://usesthis.com/interviews/joe.schmoe/'])
+
+        self.ids = self.person_ids()
+        self.replace([make_item('jack.schmoe', ('Hammer',))], reason='shutdown', job_dir=job_dir)
+        self.replace([], job_dir=job_dir, resumed=True)
+        self.assertEquals(sorted(self.person_ids()),
+                          ['https://usesthis.com/interviews/jack.schmoe/'])
+
+    def test_clashing_people_skipped(self):
+        """Verify that the staged people who would take the name or picture of another person are skipped (and not counted), rather than failing the whole replacement.
+        """
+        joe = make_item('joe.schmoe', ('Wrench', 'Pliers'))
+        jane = make_item('jane.schmoe', ('Wrench',))
+        joe['person']['name'], jane['person']['name'] = jane['person']['name'], joe['person']['name']
+        jack = make_item('jack.schmoe', ('Hammer',))
+        jack['person']['img_src'] = 'https://usesthis.com/images/portraits/jim.schmoe.jpg'
+        jill = make_item('jill.schmoe', ('Hammer',))
+        # Staged after Jill, with her picture
+        jill_again = make_item('jill.schmoe.again', ('Hammer',))
+        jill_again['person']['img_src'] = jill['person']['img_src']
+        stage = ReplaceStage(self.engine)
+        stage.open()
+        try:
+            stage.stage([joe, jane, make_item('jim.schmoe', ('Plunger',)), jack, jill])
+            stage.stage([jill_again])
+            self.assertEquals(stage.apply(), (1, 0))
+        finally:
+            stage.close()
+
+        self.assertEquals(sorted(self.person_ids()), sorted(self.ids.keys() + [
+            'https://usesthis.com/interviews/jill.schmoe/']))
+        self.assertEquals(self.person_tools('joe.schmoe'), ['Pliers', 'Wrench'])
+        self.assertEquals(self.person_tools('jill.schmoe'), ['Hammer'])
+
+    def test_failed_replacement_keeps_stage(self):
+        """Verify that the staged interviews are kept if they can't be applied.
+        """
+        with patch.object(ReplaceStage, 'apply', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                self.replace(self.changed_items())
+        self.assertTrue(os.path.exists(self.db_path + STAGING_SUFFIX))
+        self.assertEquals(self.person_ids(), self.ids)
+
+    def test_interrupted_crawl_keeps_interviews(self):
+        """Verify that the interviews that weren't crawled are kept, if the crawl was stopped early.
+        """
+        self.replace(self.changed_items(), reason='closespider_pagecount')
+
+        self.assertEquals(len(self.person_ids()), 4)
+        self.assertEquals(self.person_tools('jim.schmoe'), ['Plunger'])
+        self.assertEquals(self.person_tools('jane.schmoe'), ['Hammer', 'Wrench'])
+
+    def test_unchanged_interviews_kept(self):
+        """Verify that the interviews that the spider skipped because they didn't change aren't deleted.
+        """
+        self.spider.unchanged_article_urls = set(['https://usesthis.com/interviews/jim.schmoe/'])
+        self.replace(self.changed_items())
+
+        self.assertEquals(len(self.person_ids()), 4)
+        self.assertEquals(self.person_tools('jim.schmoe'), ['Plunger'])
+
+    def test_only_changes_staged(self):
+        """Verify that only the new and changed interviews are staged.
+        """
+        stage = ReplaceStage(self.engine)
+        stage.open()
+        self.assertEquals(stage.stage(self.changed_items()), 2)
+        self.assertEquals(stage.apply(), (2, 1))
+        stage.close()
+        self.assertFalse(os.path.exists(stage.path))
+
+
+class JSONLinesPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        logger.setLevel(logging.CRITICAL)
+        self.tmpdir = tempfile.mkdtemp()
+        self.spider = UsesthisSpider('usesthis')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_records(self, path, opener=open):
+        records = []
+        for path in sorted(glob.glob(path)):
+            with opener(path, 'rb') as jsonl_file:
+                records.extend(json.loads(line) for line in jsonl_file)
+        return records
+
+    def test_items_written_as_json_lines(self):
+        """Verify that every item is written as one JSON line, and returned unchanged.
+        """
+        path = os.path.join(self.tmpdir, 'interviews.jsonl')
+        pipeline = JSONLinesPipeline(path)
+        items = [make_item('joe.schmoe', ('Vim', 'Git')), make_item('jane.schmoe', ())]
+        for item in items:
+            self.assertEquals(pipeline.process_item(item, self.spider), item)
+        pipeline.close_spider(self.spider)
+
+        records = self.read_records(path)
+        self.assertEquals(len(records), 2)
+        self.assertEquals(records[0]['person'], dict(items[0]['person']))
+        self.assertEquals(records[0]['tools'], [dict(tool) for tool in items[0]['tools']])
+        self.assertEquals(records[1]['tools'], [])
+
+    def test_gzip_compression(self):
+        """Verify that the JSON lines can be gzip-compressed.
+        """
+        path = os.path.join(self.tmpdir, 'interviews.jsonl.gz')
+        pipeline = JSONLinesPipeline(path, compression='gzip', fsync_interval=0.001)
+        for idx in range(10):
+            pipeline.process_item(make_item('joe.schmoe.%d' % idx), self.spider)
+        pipeline.close_spider(self.spider)
+
+        self.assertEquals(pipeline.writer.paths, [path])
+        records = self.read_records(path, opener=gzip.open)
+        self.assertEquals([record['person']['name'] for record in records],
+                          ['Joe Schmoe %d' % idx for idx in range(10)])
+
+    def test_rotation_by_size(self):
+        """Verify that the output is split into numbered files of about JSONL_MAX_SIZE bytes.
+        """
+        path = os.path.join(self.tmpdir, 'interviews.jsonl.gz')
+        pipeline = JSONLinesPipeline(path, compression='gzip', max_bytes=1000)
+        for idx in range(10):
+            pipeline.process_item(make_item('joe.schmoe.%d' % idx), self.spider)
+        pipeline.close_spider(self.spider)
+
+        paths = pipeline.writer.paths
+        self.assertGreater(len(paths), 1)
+        self.assertEquals(paths[0], os.path.join(self.tmpdir, 'interviews.00000.jsonl.gz'))
+        records = self.read_records(os.path.join(self.tmpdir, 'interviews.*.jsonl.gz'),
+                                    opener=gzip.open)
+        self.assertEquals(len(records), 10)
@@ -0,0 +1,50 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from lxml import html
+from usesthis_crawler.profiling import code_group, profile_call
+from usesthis_crawler.spiders.usesthis import AddSpaceAfterPunct
+
+
+def parse_and_punctuate():
+    add_space_after_punct = AddSpaceAfterPunct()
+    for _ in range(100):
+        add_space_after_punct(html.fromstring('<p>Hello.World!</p>').text)
+    return 'done'
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_code_group(self):
+        """Verify that functions are grouped by the package of their file, or of their built-in type.
+        """
+        self.assertEquals(code_group(('/src/usesthis_crawler/pipelines.py', 1, 'flush')), 'usesthis_crawler')
+        self.assertEquals(code_group(('/lib/site-packages/scrapy/core/scraper.py', 1, 'f')), 'scrapy')
+        self.assertEquals(code_group(('/lib/site-packages/twisted/internet/base.py', 1, 'f')), 'twisted')
+        self.assertEquals(code_group(('~', 0, "<method 'xpath' of 'lxml.etree._Element' objects>")), 'lxml')
+        self.assertEquals(code_group(('~', 0, '<len>')), 'other')
+        self.assertEquals(code_group(('/lib/python2.7/re.py', 1, 'sub')), 'other')
+
+    def test_profile_call(self):
+        """Verify that a profiled call returns its result, writes a pstats dump, and prints a summary split between our code and the rest.
+        """
+        dump_path = os.path.join(self.tmpdir, 'crawl.prof')
+        output = StringIO()
+        self.assertEquals(profile_call(parse_and_punctuate, dump_path, top=3, output=output), 'done')
+
+        self.assertTrue(pstats.Stats(dump_path).total_calls)
+        lines = output.getvalue().splitlines()
+        self.assertEquals(lines[0], 'Internal time per package:')
+        self.assertIn('Top 3 functions of usesthis_crawler, by cumulative time:', lines)
+        self.assertIn('Top 3 other functions, by internal time:', lines)
+        self.assertTrue(any('usesthis.py' in line and '__call__' in line for line in lines))
+        self.assertTrue(any(line.endswith('  lxml') for line in lines))
+        self.assertEquals(lines[-1], 'Profile written to {0}'.format(dump_path))
@@ -0,0 +1,128 @@
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from StringIO import StringIO
+from mock import patch
+from usesthis_crawler import logger
+from usesthis_crawler.cli.search import main
+from usesthis_crawler.models import init_models
+from usesthis_crawler.pipelines import SQLPipeline
+from usesthis_crawler.search import search
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from tests.test_models import OLD_SCHEMA
+from tests.test_pipelines import make_item
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        logger.setLevel(logging.CRITICAL)
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'interviews.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def crawl(self, items):
+        """Write `items` to the database through the SQLPipeline."""
+        engine = init_models(self.db_path)
+        pipeline = SQLPipeline(batch_size=2)
+        spider = UsesthisSpider('usesthis')
+        pipeline.open_spider(spider)
+        for item in items:
+            pipeline.process_item(item, spider)
+        pipeline.close_spider(spider)
+        return engine
+
+    def make_items(self):
+        joe = make_item('joe.schmoe', ('Vim', 'Emacs'))
+        joe['person']['hardware'] = 'A ThinkPad with a mechanical keyboard.'
+        jane = make_item('jane.schmoe', ('Emacs',))
+        jane['person']['bio'] = 'I write keyboards firmware, mostly in Emacs.'
+        jim = make_item('jim.schmoe', ('Photoshop',))
+        return [joe, jane, jim]
+
+    def test_search_index_kept_in_sync(self):
+        """Verify that the people written by the SQLPipeline can be searched by their prose and by the names of their tools.
+        """
+        engine = self.crawl(self.make_items())
+        with engine.connect() as conn:
+            self.assertEquals([hit.name for hit in search(conn, 'vim')], ['Joe Schmoe'])
+            # Porter stemming: "keyboards" matches "keyboard"
+            self.assertEquals(sorted(hit.name for hit in search(conn, 'keyboard')),
+                              ['Jane Schmoe', 'Joe Schmoe'])
+            self.assertEquals([hit.name for hit in search(conn, 'hardware:keyboard')],
+                              ['Joe Schmoe'])
+            self.assertEquals(search(conn, 'macbook'), [])
+
+            # Jane mentions Emacs in her bio as well as in her tools
+            hits = search(conn, 'emacs')
+            self.assertEquals([hit.name for hit in hits], ['Jane Schmoe', 'Joe Schmoe'])
+            self.assertLessEqual(hits[0].score, hits[1].score)
+            self.assertIn(u'[Emacs]', hits[0].snippet)
+            self.assertEquals(len(search(conn, 'emacs', limit=1)), 1)
+        engine.dispose()
+
+    def test_duplicate_person_not_reindexed(self):
+        """Verify that a person that is already in the database keeps a single search index row.
+        """
+        items = self.make_items()
+        engine = self.crawl(items)
+        self.crawl(items[:1])
+        with engine.connect() as conn:
+            self.assertEquals(len(search(conn, 'vim')), 1)
+            self.assertEquals(conn.execute('SELECT count(*) FROM people_search').scalar(), 3)
+        engine.dispose()
+
+    def test_existing_database_indexed(self):
+        """Verify that init_models() fills the search index with the interviews of a database created without one.
+        """
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        con.executescript('''
+            INSERT INTO people VALUES (1, 'Joe Schmoe', '2014-04-08', 'Plumber',
+                'joe.jpg', 'https://usesthis.com/interviews/joe.schmoe/',
+                'Bio', 'A ThinkPad', 'Software', 'Dream');
+            INSERT INTO tools VALUES (1, 'Vim', 'http://www.vim.org/');
+            INSERT INTO people_to_tools VALUES (1, 1);
+        ''')
+        con.close()
+
+        engine = init_models(self.db_path)
+        with engine.connect() as conn:
+            self.assertEquals([hit.person_id for hit in search(conn, 'thinkpad')], [1])
+            self.assertEquals([hit.person_id for hit in search(conn, 'vim')], [1])
+        engine.dispose()
+
+    def test_search_command(self):
+        """Verify that the search command prints the matching interviews, with snippets.
+        """
+        self.crawl(self.make_items()).dispose()
+        stdout = StringIO()
+        self.assertEquals(main(['', '-d', self.db_path, 'thinkpad'], stdout=stdout), 0)
+        self.assertEquals(stdout.getvalue().splitlines(), [
+            'Joe Schmoe <https://usesthis.com/interviews/joe.schmoe/>',
+            '    A [ThinkPad] with a mechanical keyboard.',
+        ])
+
+        with self.assertRaises(SystemExit):
+            main(['', '-d', self.db_path, 'AND AND'], stdout=StringIO())
+
+    def test_search_command_leaves_database_alone(self):
+        """Verify that the search command doesn't migrate the database, or build its search index.
+        """
+        con = sqlite3.connect(self.db_path)
+        con.executescript(OLD_SCHEMA)
+        schema = con.execute('SELECT * FROM sqlite_master ORDER BY name').fetchall()
+        con.close()
+
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            main(['', '-d', self.db_path, 'vim'], stdout=StringIO())
+
+        con = sqlite3.connect(self.db_path)
+        self.assertEquals(con.execute('SELECT * FROM sqlite_master ORDER BY name').fetchall(),
+                          schema)
+        self.assertEquals(con.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        con.close()
@@ -1,10 +1,15 @@
+# -*- coding: utf-8 -*-
+
 import unittest
 import scrapy
 import requests
 import urlparse
 import re
 from mock import patch
-from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from scrapy.utils.test import get_crawler
+from usesthis_crawler.spiders.usesthis import \
+    UsesthisSpider, article_hash, extract_tool_items, split_sections
+from usesthis_crawler.synthetic import make_article
 from usesthis_crawler.items import PersonItem, ToolItem
 
 
@@ -110,6 +115,290 @@ class UsesthisSpiderTestCase(UsesthisHTTPTestCase):
                 dream='',
                 img_src='',
                 pub_date='',
+                content_hash=article_hash(response),
             )
         )
         self.assertEquals(spider_items[0]['tools'], [])
+
+
+LISTING_PAGE = u'''<html><body>
+<article class="interviewee h-card vcard"><a class="p-name" href="/interviews/joe.schmoe/">Joe Schmoe</a></article>
+<article class="interviewee h-card vcard"><a class="p-name" href="/interviews/jane.schmoe/">Jane Schmoe</a></article>
+<a id="next" href="/interviews/page/2/">Next</a>
+</body></html>'''
+
+
+class IncrementalSpiderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = UsesthisSpider('usesthis')
+        self.spider.incremental = True
+        self.response = scrapy.http.HtmlResponse(
+            url='https://usesthis.com/interviews/',
+            body=LISTING_PAGE,
+            encoding='utf-8',
+        )
+
+    def request_urls(self):
+        return [request.url for request in self.spider._requests_to_follow(self.response)]
+
+    def test_follows_everything_when_nothing_is_known(self):
+        """Verify that an incremental crawl of an empty database requests every article and the next page.
+        """
+        self.assertEquals(self.request_urls(), [
+            'https://usesthis.com/interviews/joe.schmoe/',
+            'https://usesthis.com/interviews/jane.schmoe/',
+            'https://usesthis.com/interviews/page/2/',
+        ])
+
+    def test_skips_known_articles(self):
+        """Verify that an incremental crawl doesn't request articles that are already in the database.
+        """
+        self.spider.known_article_urls = frozenset([
+            'https://usesthis.com/interviews/joe.schmoe/',
+        ])
+        self.assertEquals(self.request_urls(), [
+            'https://usesthis.com/interviews/jane.schmoe/',
+            'https://usesthis.com/interviews/page/2/',
+        ])
+
+    def test_stops_at_page_of_known_articles(self):
+        """Verify that an incremental crawl doesn't follow the next page once every article on the page is already in the database.
+        """
+        self.spider.known_article_urls = frozenset([
+            'https://usesthis.com/interviews/joe.schmoe/',
+            'https://usesthis.com/interviews/jane.schmoe/',
+        ])
+        self.assertEquals(self.request_urls(), [])
+
+    def test_not_incremental_follows_known_articles(self):
+        """Verify that a normal crawl requests articles even if they're already in the database.
+        """
+        self.spider.incremental = False
+        self.spider.known_article_urls = frozenset([
+            'https://usesthis.com/interviews/joe.schmoe/',
+            'https://usesthis.com/interviews/jane.schmoe/',
+        ])
+        self.assertEquals(len(self.request_urls()), 3)
+
+
+EDGE_CASE_ARTICLE = u'''<html><body>
+<div class="e-content">
+<p>Before the first heading.</p>
+<h4>Who are you?</h4>
+<p>I'm <a href="http://joe.example.com/">Joe</a>.I fix <em>pipes <b>and</b> drains</em>.</p>
+<p>Second paragraph.</p>
+<h4>Hardware?</h4>
+<div><p>Not a direct child.</p></div>
+<p>A <a href="http://pipebuster.example.com/">PipeBuster5000</a>!</p>
+<h4>Software?</h4>
+<h4>Dream setup?</h4>
+<p>A PipeBuster6000.</p>
+<h4>Anything else?</h4>
+<p>Not part of any section.</p>
+</div>
+<div class="e-content"><p>Another div.</p><h4>Again</h4><p>Bio, continued.</p></div>
+</body></html>'''
+
+
+class SectionSplitterTestCase(unittest.TestCase):
+    def xpath_sections(self, response):
+        return [
+            response.xpath('//div[@class="e-content"]/p[count(preceding-sibling::h4)={0}]'
+                           '/descendant-or-self::*/text()'.format(section)).extract()
+            for section in range(1, 5)
+        ]
+
+    def assertSameSections(self, body):
+        response = scrapy.http.HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=body.encode('utf-8'),
+            encoding='utf-8',
+        )
+        self.assertEquals(split_sections(response, 4), self.xpath_sections(response))
+
+    def test_matches_xpath_extraction(self):
+        """Verify that split_sections() extracts the same text as the per-section XPath queries.
+        """
+        self.assertSameSections(EDGE_CASE_ARTICLE)
+        self.assertSameSections(make_article('joe.schmoe', n_paragraphs=20))
+        self.assertSameSections(u'')
+
+    def test_parse_article_sections(self):
+        """Verify that parse_article() fills in every section of the interview.
+        """
+        response = scrapy.http.HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=EDGE_CASE_ARTICLE.encode('utf-8'),
+            encoding='utf-8',
+        )
+        person_item = list(UsesthisSpider('usesthis').parse_article(response))[0]['person']
+        self.assertEquals(person_item['bio'],
+                          u"I'm Joe. I fix pipes and drains. Second paragraph. Bio, continued.")
+        self.assertEquals(person_item['hardware'], u'A PipeBuster5000!')
+        self.assertEquals(person_item['software'], u'')
+        self.assertEquals(person_item['dream'], u'A PipeBuster6000.')
+
+
+LINK_EDGE_CASE_ARTICLE = u'''<html><body>
+<div class="e-content">
+<h4>Hardware?</h4>
+<p>A <a href="http://vim.org/"> Vim </a>, <a href="/relative/">relative link</a>,
+<a>no href</a>, <a href="">empty href</a>, <a href="http://x.example.com/"></a>,
+<a href="http://nested.example.com/"><em>nested</em> <b>tags<!-- comment --></b>!</a>
+<a href="http://unicode.example.com/">café ☃</a></p>
+<ul><li><a href="http://not-in-a-paragraph.example.com/">Skipped</a></li></ul>
+</div>
+<p><a href="http://outside.example.com/">Outside</a></p>
+</body></html>'''
+
+
+class ToolExtractionTestCase(unittest.TestCase):
+    def assertSameTools(self, body):
+        response = scrapy.http.HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=body.encode('utf-8'),
+            encoding='utf-8',
+        )
+        spider = UsesthisSpider('usesthis')
+        fast_items = extract_tool_items(response)
+        loader_items = spider.load_tool_items(response)
+        self.assertEquals([dict(item) for item in fast_items],
+                          [dict(item) for item in loader_items])
+        for item in fast_items:
+            self.assertTrue(isinstance(item, ToolItem))
+        return fast_items
+
+    def test_matches_loader_extraction(self):
+        """Verify that extract_tool_items() builds the same ToolItems as the ItemLoader-based extraction.
+        """
+        tool_items = self.assertSameTools(LINK_EDGE_CASE_ARTICLE)
+        self.assertEquals(len(tool_items), 7)
+        self.assertSameTools(make_article('joe.schmoe', n_paragraphs=5, n_links=4))
+        self.assertSameTools(u'')
+
+    def test_parse_article_uses_either_path(self):
+        """Verify that parse_article() yields the same tools whichever extraction path is selected.
+        """
+        response = scrapy.http.HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=LINK_EDGE_CASE_ARTICLE.encode('utf-8'),
+            encoding='utf-8',
+        )
+        spider = UsesthisSpider('usesthis')
+        fast_tools = list(spider.parse_article(response))[0]['tools']
+        spider.fast_tool_extraction = False
+        loader_tools = list(spider.parse_article(response))[0]['tools']
+        self.assertEquals(fast_tools, loader_tools)
+
+
+class ParallelListingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = UsesthisSpider('usesthis')
+        self.spider.parallel_listing = True
+        self.spider.listing_page_window = 3
+
+    def listing_response(self, url, body=LISTING_PAGE):
+        return scrapy.http.HtmlResponse(url=url, body=body, encoding='utf-8')
+
+    def listing_urls(self, response):
+        return [request.url for request in self.spider._requests_to_follow(response)
+                if request.meta['rule'] == self.spider.next_rule]
+
+    def test_requests_window_of_pages(self):
+        """Verify that without a page count, a window of pages after the "next" page is requested, and that no page is requested twice.
+        """
+        page_urls = self.listing_urls(self.listing_response('https://usesthis.com/interviews/'))
+        self.assertEquals(page_urls, [
+            'https://usesthis.com/interviews/page/{0}/'.format(page) for page in range(2, 6)
+        ])
+
+        body = LISTING_PAGE.replace('/interviews/page/2/', '/interviews/page/3/')
+        page_urls = self.listing_urls(self.listing_response(
+            'https://usesthis.com/interviews/page/2/', body))
+        self.assertEquals(page_urls, [
+            'https://usesthis.com/interviews/page/3/',
+            'https://usesthis.com/interviews/page/6/',
+        ])
+
+    def test_requests_every_page_of_known_count(self):
+        """Verify that when the page count is set, every page is requested from the first one.
+        """
+        self.spider.listing_page_count = 7
+        page_urls = self.listing_urls(self.listing_response('https://usesthis.com/interviews/'))
+        self.assertEquals(page_urls, [
+            'https://usesthis.com/interviews/page/{0}/'.format(page) for page in range(2, 8)
+        ])
+
+    def test_reads_page_count_from_pagination(self):
+        """Verify that the page count is read from the pagination links, if the page has them.
+        """
+        body = LISTING_PAGE.replace(
+            '</body>', '<a href="/interviews/page/9/">Last</a><a href="/about/9/">About</a></body>')
+        page_urls = self.listing_urls(self.listing_response('https://usesthis.com/interviews/', body))
+        self.assertEquals(page_urls, [
+            'https://usesthis.com/interviews/page/{0}/'.format(page) for page in range(2, 10)
+        ])
+
+    def test_last_page_requests_nothing(self):
+        """Verify that a listing page without a "next" link doesn't request more pages.
+        """
+        body = LISTING_PAGE.replace('id="next"', 'id="previous"')
+        self.assertEquals(self.listing_urls(self.listing_response(
+            'https://usesthis.com/interviews/page/9/', body)), [])
+
+
+class ContentHashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = UsesthisSpider('usesthis')
+
+    def article_response(self, body):
+        return scrapy.http.HtmlResponse(
+            url='https://usesthis.com/interviews/joe.schmoe/',
+            body=body.encode('utf-8'),
+            encoding='utf-8',
+        )
+
+    def test_hash_covers_extracted_parts(self):
+        """Verify that the content hash changes with the interview, but not with whitespace or with the rest of the page.
+        """
+        article = make_article('joe.schmoe')
+        content_hash = article_hash(self.article_response(article))
+
+        self.assertEquals(article_hash(self.article_response(article.replace('<p>', '<p>\n   '))),
+                          content_hash)
+        self.assertEquals(article_hash(self.article_response(article.replace('<body>', '<body><nav>Menu</nav>'))),
+                          content_hash)
+        self.assertNotEquals(article_hash(self.article_response(article.replace('Tool 1.0.0', 'Tool 1.0.0!'))),
+                             content_hash)
+        self.assertNotEquals(article_hash(self.article_response(article.replace('Joe Schmoe', 'Joseph Schmoe'))),
+                             content_hash)
+
+    def test_unchanged_article_skipped(self):
+        """Verify that parse_article() yields nothing for an interview that was stored with the same content hash, and records its URL.
+        """
+        response = self.article_response(make_article('joe.schmoe'))
+        items = list(self.spider.parse_article(response))
+        content_hash = items[0]['person']['content_hash']
+        self.assertEquals(content_hash, article_hash(response))
+
+        self.spider.known_content_hashes = {response.url: 'something else'}
+        self.assertEquals(len(list(self.spider.parse_article(response))), 1)
+        self.spider.known_content_hashes = {response.url: content_hash}
+        self.assertEquals(list(self.spider.parse_article(response)), [])
+        self.assertEquals(self.spider.unchanged_article_urls, set([response.url]))
+
+    def test_hashed_only_for_database(self):
+        """Verify that the pages are only hashed when the SQLPipeline, which stores the hashes, is enabled.
+        """
+        response = self.article_response(make_article('joe.schmoe'))
+        for sql_pipeline, hashed in ((500, True), (None, False)):
+            crawler = get_crawler(UsesthisSpider, {'ITEM_PIPELINES': {
+                'usesthis_crawler.pipelines.SQLPipeline': sql_pipeline}})
+            spider = UsesthisSpider.from_crawler(crawler, 'usesthis')
+            self.assertEquals(spider.hash_articles, hashed)
+
+        with patch('usesthis_crawler.spiders.usesthis.article_hash',
+                   side_effect=AssertionError('hashed without the database')):
+            items = list(spider.parse_article(response))
+        self.assertEquals(len(items), 1)
+        self.assertNotIn('content_hash', items[0]['person'])
@@ -0,0 +1,127 @@
+import unittest
+import hypothesis.strategies as st
+from hypothesis import given, example, settings
+from mock import patch
+from usesthis_crawler.items import PersonItem, ToolItem
+from usesthis_crawler import validation
+from usesthis_crawler.validation import \
+    ItemValidationError, is_valid_url, is_valid_src, is_valid_date, \
+    validate_person_item, validate_tool_items, fast_is_valid_url, \
+    fast_is_valid_src, fast_is_valid_date, fast_validate_person_item, \
+    fast_validate_tool_items
+
+
+# URLs made of the pieces that urlparse treats specially, plus arbitrary text
+url_pieces = st.lists(
+    st.sampled_from([
+        'http', 'https', 'HTTP', 'hTTpS', 'ftp', 'httpx', ':', '//', '/', '?',
+        '#', ';', '@', '[', ']', '.jpg', '.JPG', 'jpg', 'usesthis.com', '123',
+        ' ', '\n', u'\u2100', u'\uff0f', u'\xe9',
+    ]),
+    max_size=10,
+).map(u''.join)
+urls = st.one_of(
+    st.text(max_size=30),
+    url_pieces,
+    st.tuples(st.sampled_from(['http://', 'https://', 'HTTPS://']), url_pieces).map(u''.join),
+)
+
+date_pieces = st.lists(
+    st.sampled_from(['0', '1', '2', '3', '9', '00', '12', '29', '30', '31',
+                     '2015', '0000', '-', ' ', '\n', u'\u0663']),
+    max_size=8,
+).map(u''.join)
+dates = st.one_of(
+    st.text(max_size=12),
+    date_pieces,
+    st.dates().map(lambda day: day.isoformat()),
+    st.tuples(st.integers(0, 9999), st.integers(0, 13), st.integers(0, 32)).map(
+        lambda ymd: u'{0:04d}-{1:02d}-{2:2d}'.format(*ymd)),
+)
+
+
+def outcome(func, *args):
+    """Return what calling `func` returns or raises, and what it logs."""
+    with patch.object(validation, 'logger') as logger_mock:
+        try:
+            result = ('returned', func(*args))
+        except Exception, exc:
+            result = ('raised', type(exc), str(exc) if isinstance(exc, ItemValidationError) else None)
+    return result, logger_mock.method_calls
+
+
+def partial_items(item_cls, values):
+    """Items of `item_cls` with some of their fields set from `values`."""
+    fields = sorted(item_cls.fields)
+    return st.lists(st.tuples(st.sampled_from(fields), values)).map(
+        lambda pairs: item_cls(dict(pairs)))
+
+
+person_items = st.one_of(
+    st.builds(PersonItem, st.fixed_dictionaries(dict(
+        name=st.sampled_from([u'', u'Joe Schmoe']),
+        article_url=urls,
+        pub_date=dates,
+        title=st.just(u'Plumber'),
+        img_src=urls,
+        bio=st.sampled_from([u'', u'Bio']),
+        hardware=st.sampled_from([u'', u'Hardware']),
+        software=st.sampled_from([u'', u'Software']),
+        dream=st.sampled_from([u'', u'Dream']),
+    ))),
+    partial_items(PersonItem, st.one_of(urls, dates)),
+)
+tool_items = st.one_of(
+    st.builds(ToolItem, st.fixed_dictionaries(dict(
+        tool_name=st.sampled_from([u'', u'Vim']),
+        tool_url=urls,
+    ))),
+    partial_items(ToolItem, urls),
+)
+
+
+class FastValidationTestCase(unittest.TestCase):
+    @given(url=urls)
+    @example(url=u'http://[::1]/a.jpg')
+    @example(url=u'http://[::1/a.jpg')
+    @example(url=u'https://a\u2100b/a.jpg')
+    @example(url=u'http://usesthis.com/a.jpg;params?query#fragment')
+    @example(url=u'http://usesthis.com/a.jpg;x/b.png')
+    @settings(max_examples=300)
+    def test_url_checks_equivalent(self, url):
+        """Verify that the precompiled URL and image-source checks accept (or raise on) exactly the same strings as the urlparse-based ones.
+        """
+        for old, new in ((is_valid_url, fast_is_valid_url), (is_valid_src, fast_is_valid_src)):
+            old_outcome, _ = outcome(lambda url: bool(old(url)), url)
+            new_outcome, _ = outcome(new, url)
+            self.assertEquals(new_outcome, old_outcome)
+
+    @given(datestr=dates)
+    @example(datestr=u'2015-02-29')
+    @example(datestr=u'2016-02-29')
+    @example(datestr=u'2015-08- 6')
+    @example(datestr=u'0000-01-01')
+    @example(datestr=u'2015-08-16\n')
+    @settings(max_examples=300)
+    def test_date_check_equivalent(self, datestr):
+        """Verify that the precompiled date check accepts exactly the same strings as the strptime-based one.
+        """
+        self.assertEquals(fast_is_valid_date(datestr), is_valid_date(datestr))
+
+    @given(item=person_items, verbose=st.booleans())
+    def test_person_validation_equivalent(self, item, verbose):
+        """Verify that the fast PersonItem validation raises and logs exactly what the original one does.
+        """
+        self.assertEquals(outcome(fast_validate_person_item, item, verbose),
+                          outcome(validate_person_item, item, verbose))
+
+    @given(tools=st.lists(tool_items, max_size=10), verbose=st.booleans())
+    def test_tool_validation_equivalent(self, tools, verbose):
+        """Verify that the fast ToolItem validation keeps the same tools, and logs exactly what the original one does.
+        """
+        person = PersonItem(name=u'Joe Schmoe',
+                            article_url=u'https://usesthis.com/interviews/joe.schmoe/')
+        old_tools, new_tools = list(tools), list(tools)
+        self.assertEquals(outcome(fast_validate_tool_items, new_tools, person, verbose),
+                          outcome(validate_tool_items, old_tools, person, verbose))
+        self.assertEquals(new_tools, old_tools)
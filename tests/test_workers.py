@@ -0,0 +1,96 @@
+import scrapy
+from mock import patch
+from twisted.internet import defer
+from twisted.trial import unittest
+from usesthis_crawler.items import PersonItem, ToolItem
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from usesthis_crawler.synthetic import make_article
+from usesthis_crawler.workers import ParsePool, ParseWorkerError
+
+
+def article_response(slug):
+    url = 'https://usesthis.com/interviews/{0}/'.format(slug)
+    return scrapy.http.HtmlResponse(
+        url=url,
+        body=make_article(slug, n_paragraphs=2, n_links=2).encode('utf-8'),
+        encoding='utf-8',
+        request=scrapy.Request(url, meta=dict(rule=UsesthisSpider.article_rule)),
+    )
+
+
+class ParsePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spider = UsesthisSpider('usesthis')
+
+    @defer.inlineCallbacks
+    def test_same_items_as_spider(self):
+        """Verify that the spider yields the same items whether it parses an interview itself or has a worker process parse it.
+        """
+        response = article_response('joe.schmoe')
+        expected = list(self.spider.parse_article(response))
+        self.spider.parse_pool = ParsePool(2)
+        try:
+            items = yield self.spider._response_downloaded(response)
+        finally:
+            self.spider.parse_pool.close()
+
+        self.assertEquals(items, expected)
+        self.assertTrue(isinstance(items[0]['person'], PersonItem))
+        self.assertTrue(all(isinstance(tool_item, ToolItem) for tool_item in items[0]['tools']))
+
+    @defer.inlineCallbacks
+    def test_pages_hashed_in_workers(self):
+        """Verify that the worker processes hash the pages, and skip parsing the ones that didn't change, without the reactor's thread hashing them.
+        """
+        response = article_response('joe.schmoe')
+        expected = list(self.spider.parse_article(response))
+        content_hash = expected[0]['person']['content_hash']
+        self.spider.parse_pool = ParsePool(1)
+        try:
+            with patch('usesthis_crawler.spiders.usesthis.article_hash',
+                       side_effect=AssertionError('hashed on the reactor thread')):
+                items = yield self.spider._response_downloaded(response)
+                self.assertEquals(items[0]['person']['content_hash'], content_hash)
+
+                self.spider.known_content_hashes = {response.url: content_hash}
+                result = yield self.spider.parse_pool.parse(response, content_hash)
+                self.assertEquals(result, (content_hash, None))
+                items = yield self.spider._response_downloaded(response)
+        finally:
+            self.spider.parse_pool.close()
+
+        self.assertEquals(items, [])
+        self.assertEquals(self.spider.unchanged_article_urls, set([response.url]))
+
+    @defer.inlineCallbacks
+    def test_pages_not_hashed_without_database(self):
+        """Verify that the worker processes don't hash the pages when the spider doesn't.
+        """
+        response = article_response('joe.schmoe')
+        self.spider.hash_articles = False
+        expected = list(self.spider.parse_article(response))
+        # The worker processes are forked with the broken hash function
+        with patch('usesthis_crawler.spiders.usesthis.article_hash',
+                   side_effect=AssertionError('hashed without the database')):
+            self.spider.parse_pool = ParsePool(1, hash_articles=False)
+        try:
+            items = yield self.spider._response_downloaded(response)
+        finally:
+            self.spider.parse_pool.close()
+
+        self.assertEquals(items, expected)
+        self.assertNotIn('content_hash', items[0]['person'])
+
+    @defer.inlineCallbacks
+    def test_worker_errors_raised(self):
+        """Verify that a page that fails to parse in a worker process fails its Deferred, with the worker's traceback.
+        """
+        # The worker processes are forked with the broken spider
+        with patch.object(UsesthisSpider, 'load_article', side_effect=ValueError('Broken page')):
+            pool = ParsePool(1)
+        try:
+            with self.assertRaises(ParseWorkerError) as context:
+                yield pool.parse(article_response('joe.schmoe'))
+        finally:
+            pool.close()
+        self.assertIn('ValueError: Broken page', str(context.exception))
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import threading
+from twisted.internet import defer
+from twisted.trial import unittest
+from usesthis_crawler.models import init_models
+from usesthis_crawler.pipelines import SQLPipeline
+from usesthis_crawler.spiders.usesthis import UsesthisSpider
+from usesthis_crawler.writer import DatabaseWriter
+from tests.test_pipelines import make_item
+
+
+class DatabaseWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.writer = DatabaseWriter(max_pending=2)
+        self.writer.start()
+
+    def tearDown(self):
+        self.writer.stop()
+
+    @defer.inlineCallbacks
+    def test_calls_run_in_order_on_one_thread(self):
+        """Verify that the calls run one after the other, in order, on the writer thread.
+        """
+        calls = []
+        def record(idx):
+            calls.append((idx, threading.current_thread().name))
+            return idx
+
+        results = yield defer.gatherResults([self.writer.call(record, idx) for idx in range(10)])
+
+        self.assertEquals(results, range(10))
+        self.assertEquals([idx for idx, _ in calls], range(10))
+        self.assertEquals(len(set(name for _, name in calls)), 1)
+        self.assertNotEquals(calls[0][1], threading.current_thread().name)
+
+    @defer.inlineCallbacks
+    def test_queue_is_bounded(self):
+        """Verify that at most `max_pending` calls are handed to the writer thread, while the others wait.
+        """
+        blocker = threading.Event()
+        deferreds = [self.writer.call(blocker.wait) for _ in range(5)]
+
+        self.assertEquals(len(self.writer.semaphore.waiting), 3)
+        blocker.set()
+        yield defer.gatherResults(deferreds)
+        self.assertEquals(len(self.writer.semaphore.waiting), 0)
+
+
+class AsyncSQLPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.engine = init_models(os.path.join(self.tmpdir, 'interviews.db'))
+        self.spider = UsesthisSpider('usesthis')
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def count_people(self):
+        return self.engine.execute('SELECT count(*) FROM people').scalar()
+
+    @defer.inlineCallbacks
+    def test_items_written_by_writer_thread(self):
+        """Verify that a batch is written by the writer thread before the Deferred of its last item fires, and that closing the spider drains the queue.
+        """
+        pipeline = SQLPipeline(batch_size=2, async_writes=True)
+        yield pipeline.open_spider(self.spider)
+
+        item = make_item('joe.schmoe')
+        self.assertIs(pipeline.process_item(item, self.spider), item)
+        result = yield pipeline.process_item(make_item('jane.schmoe'), self.spider)
+        self.assertEquals(result['person']['name'], 'Jane Schmoe')
+        self.assertEquals(self.count_people(), 2)
+
+        pipeline.process_item(make_item('jim.schmoe'), self.spider)
+        yield pipeline.close_spider(self.spider)
+        self.assertEquals(self.count_people(), 3)
+        self.assertFalse(pipeline.writer.pool.started)
+
+    @defer.inlineCallbacks
+    def test_replace_applied_by_writer_thread(self):
+        """Verify that the database is replaced from the writer thread once the spider is closed.
+        """
+        pipeline = SQLPipeline(batch_size=10, async_writes=True)
+        yield pipeline.open_spider(self.spider)
+        pipeline.process_item(make_item('joe.schmoe'), self.spider)
+        yield pipeline.close_spider(self.spider)
+
+        pipeline = SQLPipeline(batch_size=10, replace=True, async_writes=True)
+        yield pipeline.open_spider(self.spider)
+        pipeline.process_item(make_item('jane.schmoe'), self.spider)
+        yield pipeline.close_spider(self.spider)
+        self.assertTrue(pipeline.writer.pool.started)
+        yield pipeline.spider_closed(self.spider, 'finished')
+
+        self.assertEquals(self.engine.execute('SELECT name FROM people').fetchall(),
+                          [('Jane Schmoe',)])
+        self.assertFalse(pipeline.writer.pool.started)
+        self.assertEquals(os.listdir(self.tmpdir), ['interviews.db'])
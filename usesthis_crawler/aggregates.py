@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""Tool popularity and co-occurrence counts, kept up to date as people are
+written, so that "which tools are the most used" and "which tools are used
+together" don't take a scan (or a self-join) of `people_to_tools`:
+
+    - tool_counts: the number of people who use each tool;
+    - tool_year_counts: the same, per year of the people's pub_date;
+    - tool_pairs: the number of people who use each pair of tools (a sparse
+      tool x tool matrix, with tool_a < tool_b).
+
+Rows are dropped once their count gets to 0. The indexes on the counts let
+the queries below read only the rows that they return.
+
+Keeping the counts in sync makes every batch of people several times slower
+to write, so they are only kept by crawls that ask for them (TOOL_STATS).
+Other crawls recount a database that has them once they are done.
+"""
+
+import re
+from collections import Counter, namedtuple
+from itertools import combinations
+
+
+AGGREGATE_SCHEMA = [
+    'CREATE TABLE tool_counts ('
+    '    tool_id INTEGER PRIMARY KEY, n_people INTEGER NOT NULL)',
+    'CREATE INDEX ix_tool_counts_n_people ON tool_counts (n_people)',
+    'CREATE TABLE tool_year_counts ('
+    '    tool_id INTEGER NOT NULL, year INTEGER NOT NULL, n_people INTEGER NOT NULL,'
+    '    PRIMARY KEY (tool_id, year)) WITHOUT ROWID',
+    'CREATE INDEX ix_tool_year_counts_year ON tool_year_counts (year, n_people)',
+    'CREATE TABLE tool_pairs ('
+    '    tool_a INTEGER NOT NULL, tool_b INTEGER NOT NULL, n_people INTEGER NOT NULL,'
+    '    PRIMARY KEY (tool_a, tool_b)) WITHOUT ROWID',
+    'CREATE INDEX ix_tool_pairs_a ON tool_pairs (tool_a, n_people)',
+    'CREATE INDEX ix_tool_pairs_b ON tool_pairs (tool_b, n_people)',
+    'CREATE INDEX ix_tool_pairs_n_people ON tool_pairs (n_people)',
+]
+
+# The year of a person's pub_date (YYYY-MM-DD), in SQL. Dates that don't
+# start with a number (which can be stored when validation is turned off)
+# are counted in year 0.
+YEAR_SQL = 'CAST(substr({0}, 1, 4) AS INTEGER)'
+# The leading integer that SQLite's CAST finds in a string
+CAST_INTEGER = re.compile(r'\s*[+-]?\d+')
+
+# Add counts to the aggregate tables: from a list of rows, or from a SELECT
+# (which must have a WHERE clause, for SQLite to parse the upsert)
+ADD_TOOL_COUNTS = (
+    'INSERT INTO tool_counts (tool_id, n_people) {0} '
+    'ON CONFLICT (tool_id) DO UPDATE SET n_people = n_people + excluded.n_people')
+ADD_TOOL_YEAR_COUNTS = (
+    'INSERT INTO tool_year_counts (tool_id, year, n_people) {0} '
+    'ON CONFLICT (tool_id, year) DO UPDATE SET n_people = n_people + excluded.n_people')
+ADD_TOOL_PAIRS = (
+    'INSERT INTO tool_pairs (tool_a, tool_b, n_people) {0} '
+    'ON CONFLICT (tool_a, tool_b) DO UPDATE SET n_people = n_people + excluded.n_people')
+
+AGGREGATE_TABLES = ('tool_counts', 'tool_year_counts', 'tool_pairs')
+
+DROP_EMPTY_COUNTS = [
+    'DELETE FROM tool_counts WHERE n_people = 0',
+    'DELETE FROM tool_year_counts WHERE n_people = 0',
+    'DELETE FROM tool_pairs WHERE n_people = 0',
+]
+
+ToolCount = namedtuple('ToolCount', 'tool_id tool_name tool_url n_people')
+ToolPairCount = namedtuple('ToolPairCount', 'tool_a tool_b n_people')
+
+
+def has_tool_stats(conn):
+    return conn.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'tool_counts'"
+    ).scalar() > 0
+
+
+def create_tool_stats(engine):
+    """Create the aggregate tables if they don't exist yet, counting every
+    interview already in the database.
+    """
+    with engine.begin() as conn:
+        if has_tool_stats(conn):
+            return
+        for statement in AGGREGATE_SCHEMA:
+            conn.execute(statement)
+        count_people(conn)
+
+
+def count_people(conn, person_ids_query=None, sign=1):
+    """Add the tools of the people whose IDs are selected by the SQL
+    `person_ids_query` (of every person, by default) to the counts, or
+    subtract them, with a `sign` of -1. Subtract people before their tools
+    or their pub_date change, and add them back afterwards.
+    """
+    where = 'WHERE 1'
+    if person_ids_query is not None:
+        where = 'WHERE pt.person_id IN ({0})'.format(person_ids_query)
+    conn.execute(ADD_TOOL_COUNTS.format(
+        'SELECT pt.tool_id, {0} * count(*) FROM people_to_tools pt {1} '
+        'GROUP BY pt.tool_id'.format(sign, where)))
+    conn.execute(ADD_TOOL_YEAR_COUNTS.format(
+        'SELECT pt.tool_id, {0} AS year, {1} * count(*) '
+        'FROM people_to_tools pt JOIN people p ON p.id = pt.person_id {2} '
+        'GROUP BY pt.tool_id, year'.format(YEAR_SQL.format('p.pub_date'), sign, where)))
+    conn.execute(ADD_TOOL_PAIRS.format(
+        'SELECT pt.tool_id, other.tool_id, {0} * count(*) FROM people_to_tools pt '
+        'JOIN people_to_tools other '
+        'ON other.person_id = pt.person_id AND other.tool_id > pt.tool_id {1} '
+        'GROUP BY pt.tool_id, other.tool_id'.format(sign, where)))
+    if sign < 0:
+        for statement in DROP_EMPTY_COUNTS:
+            conn.execute(statement)
+
+
+def recount_people(conn):
+    """Count the tools of every person from scratch."""
+    for table in AGGREGATE_TABLES:
+        conn.execute('DELETE FROM {0}'.format(table))
+    count_people(conn)
+
+
+def pub_year(pub_date):
+    """Return the year of the pub_date, as YEAR_SQL does."""
+    match = CAST_INTEGER.match((pub_date or '')[:4])
+    return int(match.group()) if match else 0
+
+
+class ToolStatsDelta(object):
+    """Changes to the aggregate counts, collected from the people of a batch
+    before they are applied in one go (see `apply()`).
+    """
+    def __init__(self):
+        self.tool_counts = Counter()
+        self.year_counts = Counter()
+        self.pair_counts = Counter()
+
+    def add_person(self, pub_date, tool_ids, sign=1):
+        """Count a person with the given pub_date and tool IDs (or uncount
+        them, with a `sign` of -1).
+        """
+        year = pub_year(pub_date)
+        tool_ids = sorted(tool_ids)
+        for tool_id in tool_ids:
+            self.tool_counts[tool_id] += sign
+            self.year_counts[(tool_id, year)] += sign
+        for pair in combinations(tool_ids, 2):
+            self.pair_counts[pair] += sign
+
+    def remove_person(self, pub_date, tool_ids):
+        self.add_person(pub_date, tool_ids, sign=-1)
+
+    def apply(self, conn):
+        """Add the changes to the counts, with one `executemany` call per
+        table. Changes that cancelled out aren't written.
+        """
+        removed = False
+        for statement, counts in (
+                (ADD_TOOL_COUNTS.format('VALUES (?, ?)'), self.tool_counts),
+                (ADD_TOOL_YEAR_COUNTS.format('VALUES (?, ?, ?)'), self.year_counts),
+                (ADD_TOOL_PAIRS.format('VALUES (?, ?, ?)'), self.pair_counts)):
+            rows = [(key if isinstance(key, tuple) else (key,)) + (count,)
+                    for key, count in sorted(counts.items()) if count]
+            if rows:
+                conn.execute(statement, rows)
+            removed = removed or any(count < 0 for count in counts.values())
+        if removed:
+            for statement in DROP_EMPTY_COUNTS:
+                conn.execute(statement)
+
+
+def most_used_tools(conn, limit=10, year=None):
+    """Return the `limit` tools used by the most people (in the given year of
+    pub_date, if any), most used first, as ToolCount tuples.
+    """
+    if year is None:
+        rows = conn.execute(
+            'SELECT t.id, t.tool_name, t.tool_url, c.n_people FROM tool_counts c '
+            'JOIN tools t ON t.id = c.tool_id ORDER BY c.n_people DESC LIMIT ?', (limit,))
+    else:
+        rows = conn.execute(
+            'SELECT t.id, t.tool_name, t.tool_url, c.n_people FROM tool_year_counts c '
+            'JOIN tools t ON t.id = c.tool_id WHERE c.year = ? '
+            'ORDER BY c.n_people DESC LIMIT ?', (year, limit))
+    return [ToolCount(*row) for row in rows]
+
+
+def tool_years(conn, tool_id):
+    """Return a list of (year, number of people) pairs for the tool, oldest
+    year first.
+    """
+    return [tuple(row) for row in conn.execute(
+        'SELECT year, n_people FROM tool_year_counts WHERE tool_id = ? ORDER BY year',
+        (tool_id,))]
+
+
+def tools_used_with(conn, tool_id, limit=10):
+    """Return the `limit` tools most often used along with the tool, as
+    ToolCount tuples whose n_people is the number of people who use both.
+    """
+    # Each side of the half matrix is read from its own index
+    rows = conn.execute(
+        'SELECT t.id, t.tool_name, t.tool_url, pairs.n_people FROM ('
+        '    SELECT * FROM (SELECT tool_b AS tool_id, n_people FROM tool_pairs'
+        '                   WHERE tool_a = ? ORDER BY n_people DESC LIMIT ?)'
+        '    UNION ALL'
+        '    SELECT * FROM (SELECT tool_a AS tool_id, n_people FROM tool_pairs'
+        '                   WHERE tool_b = ? ORDER BY n_people DESC LIMIT ?)'
+        ') pairs JOIN tools t ON t.id = pairs.tool_id '
+        'ORDER BY pairs.n_people DESC LIMIT ?',
+        (tool_id, limit, tool_id, limit, limit))
+    return [ToolCount(*row) for row in rows]
+
+
+def most_common_pairs(conn, limit=10):
+    """Return the `limit` pairs of tools used together by the most people,
+    as ToolPairCount tuples of tool IDs.
+    """
+    return [ToolPairCount(*row) for row in conn.execute(
+        'SELECT tool_a, tool_b, n_people FROM tool_pairs ORDER BY n_people DESC LIMIT ?',
+        (limit,))]
@@ -4,13 +4,18 @@ import os
 import sys
 import argparse
 import shutil
+import urlparse
 import scrapy
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings, ENVVAR
 from usesthis_crawler import logger
 from usesthis_crawler.spiders.usesthis import UsesthisSpider
-from usesthis_crawler.models import init_models
+from usesthis_crawler.models import init_models, create_indexes, SQLITE_PROFILES
+from usesthis_crawler.exporters import compression_module
+from usesthis_crawler.jobs import prepare_job
 from usesthis_crawler.pipelines import ValidationPipeline
+from usesthis_crawler.profiling import profile_call
+from usesthis_crawler.replace import STAGING_SUFFIX
 
 
 SCRIPTDIR = os.path.dirname(os.path.realpath(__file__))
@@ -57,12 +62,141 @@ class ArgParser(argparse.ArgumentParser):
             default=os.path.join(SCRIPTDIR, '..', 'db', 'interviews.db'),
         )
 
+        self.add_argument(
+            '--db-profile',
+            help='SQLite performance profile ("bulk-load" can corrupt the database on a crash)',
+            choices=sorted(SQLITE_PROFILES),
+        )
+
+        self.add_argument(
+            '--sync-db-writes',
+            help='write to the database from the reactor thread, instead of a dedicated writer thread',
+            action='store_true',
+        )
+
+        self.add_argument(
+            '--tool-stats',
+            help='keep count of the tools used per year and together, as interviews are written (about 5x slower writes)',
+            action='store_true',
+        )
+
         self.add_argument(
             '-r', '--replace-database',
-            help='replace the database entirely, instead of updating it',
+            help='replace the contents of the database with the crawled interviews, instead of adding to them',
             action='store_true',
         )
 
+        self.add_argument(
+            '-i', '--incremental',
+            help='only crawl interviews that aren\'t in the database yet',
+            action='store_true',
+        )
+
+        self.add_argument(
+            '--resume',
+            help='keep the state of the crawl in this directory, so that a crawl that was stopped carries on where it left off when run again',
+            metavar='DIR',
+        )
+
+        self.add_argument(
+            '-j', '--jsonl',
+            help='also stream the interviews to this JSON Lines file',
+            metavar='JSONL_PATH',
+        )
+
+        self.add_argument(
+            '--jsonl-compression',
+            help='compress the JSON Lines file',
+            choices=['gzip', 'zstd'],
+        )
+
+        self.add_argument(
+            '--jsonl-max-size',
+            help='start a new JSON Lines file after this many megabytes (0 for never)',
+            type=int,
+            default=0,
+            metavar='MB',
+        )
+
+        self.add_argument(
+            '-p', '--parallel-listing',
+            help='request the interviews listing pages concurrently',
+            action='store_true',
+        )
+
+        self.add_argument(
+            '--listing-pages',
+            help='number of listing pages, for --parallel-listing (default: infer it)',
+            type=int,
+            default=0,
+            metavar='N',
+        )
+
+        self.add_argument(
+            '--reparse',
+            help='parse every interview, even the ones whose pages didn\'t change since they were stored (implied by --jsonl)',
+            action='store_true',
+        )
+
+        self.add_argument(
+            '-w', '--parse-workers',
+            help='parse the interviews in this many worker processes (0 to parse them in the main process)',
+            type=int,
+            default=0,
+            metavar='N',
+        )
+
+        self.add_argument(
+            '-c', '--http-cache',
+            help='cache pages in this directory, and only re-download them if they changed',
+            metavar='CACHE_DIR',
+        )
+
+        self.add_argument(
+            '--http-cache-size',
+            help='maximum size of the HTTP cache, in megabytes (0 for no limit)',
+            type=int,
+            default=100,
+            metavar='MB',
+        )
+
+        self.add_argument(
+            '--metrics-report',
+            help='write per-stage timings and event counts to this JSON file at the end of the crawl',
+            metavar='PATH',
+        )
+
+        self.add_argument(
+            '--metrics-snapshot',
+            help='periodically write the metrics to this file, in the Prometheus text format',
+            metavar='PATH',
+        )
+
+        self.add_argument(
+            '--profile',
+            help='profile the crawl with cProfile, write the profile to this file, and print a summary of it (the database is written synchronously, so that the profile includes it)',
+            metavar='PATH',
+        )
+
+        self.add_argument(
+            '--profile-top',
+            help='number of functions to list in each part of the profile summary',
+            type=int,
+            default=20,
+            metavar='N',
+        )
+
+        self.add_argument(
+            '--start-url',
+            help='first interviews listing page to crawl (e.g. a local fixture site)',
+            default='https://usesthis.com/interviews/',
+        )
+
+        self.add_argument(
+            '--allowed-domain',
+            help='domain the crawl is restricted to (default: the start URL\'s domain)',
+        )
+
         self.add_argument(
             '-v', '--verbose',
             help='show more helpful error messages',
@@ -78,7 +212,23 @@ def main(argv=None):
                        formatter_class=HelpFormatter,
                        description='Scrape usesthis.com for people and tools.')
     args = parser.parse_args(args=argv[1:])
+    if args.incremental and args.skip_database:
+        parser.error('the "incremental" option requires the database')
+    if args.incremental and args.replace_database:
+        parser.error('the "incremental" and "replace-database" options are incompatible')
+    if args.jsonl:
+        try:
+            compression_module(args.jsonl_compression)
+        except ValueError, exc:
+            parser.error(str(exc))
+    # Stale job files are deleted, so that they don't filter out every request
+    resuming = args.resume and prepare_job(args.resume)
+    if (resuming and args.replace_database and
+        not os.path.exists(args.db_path + STAGING_SUFFIX)):
+        parser.error('the crawl in {0} wasn\'t replacing the database'.format(args.resume))
 
+    # Find the project settings even when run outside of the project directory
+    os.environ.setdefault(ENVVAR, 'usesthis_crawler.settings')
     settings = get_project_settings()
 
     settings.attributes['DB_PATH'].value = args.db_path
@@ -88,12 +238,8 @@ def main(argv=None):
         logger.info('Created database directory: %s', db_dir)
 
     if args.replace_database:
-        settings.attributes['DB_PATH'].value = args.db_path+'_new'
-        old_db_exists = os.path.exists(args.db_path)
-        if not old_db_exists:
-            logger.info('No previous database exists, so a new one will be created ("replace-database" option has no effect).')
-        else:
-            logger.info('Database will be replaced.')
+        settings.attributes['DB_REPLACE'].value = True
+        logger.info('Database will be replaced.')
 
     if (settings.attributes['LOG_LEVEL'].value != args.log_level and
         not args.verbose):
@@ -105,15 +251,83 @@ def main(argv=None):
         settings.attributes['CLOSESPIDER_PAGECOUNT'].value = 2
         logger.info('Debug-mode enabled.')
 
+    if args.incremental:
+        settings.attributes['INCREMENTAL_CRAWL'].value = True
+        logger.info('Incremental crawl enabled.')
+
+    if args.resume:
+        settings.attributes['JOBDIR'].value = args.resume
+        settings.attributes['JOB_RESUMED'].value = bool(resuming)
+        if resuming:
+            logger.info('Resuming the crawl in %s.', args.resume)
+        else:
+            logger.info('Keeping the state of the crawl in %s.', args.resume)
+
+    if args.jsonl:
+        settings.attributes['ITEM_PIPELINES'].value['usesthis_crawler.pipelines.JSONLinesPipeline'] = 600
+        settings.attributes['JSONL_PATH'].value = args.jsonl
+        settings.attributes['JSONL_COMPRESSION'].value = args.jsonl_compression or ''
+        settings.attributes['JSONL_MAX_SIZE'].value = args.jsonl_max_size * 1024 * 1024
+        logger.info('JSONLinesPipeline enabled: %s', args.jsonl)
+
+    if args.parallel_listing:
+        settings.attributes['PARALLEL_LISTING'].value = True
+        settings.attributes['LISTING_PAGE_COUNT'].value = args.listing_pages
+        logger.info('Parallel listing enabled.')
+
+    if args.reparse:
+        settings.attributes['SKIP_UNCHANGED'].value = False
+        logger.info('Unchanged interviews will be parsed again.')
+    elif args.jsonl:
+        # The JSON Lines file gets every interview, not just the changed ones
+        settings.attributes['SKIP_UNCHANGED'].value = False
+
+    if args.parse_workers:
+        settings.attributes['PARSE_WORKERS'].value = args.parse_workers
+        logger.info('Parsing interviews in %d worker processes.', args.parse_workers)
+
+    if args.http_cache:
+        settings.attributes['HTTPCACHE_ENABLED'].value = True
+        settings.attributes['HTTPCACHE_DIR'].value = os.path.abspath(args.http_cache)
+        settings.attributes['HTTPCACHE_MAX_SIZE'].value = args.http_cache_size * 1024 * 1024
+        logger.info('HTTP cache enabled: %s', args.http_cache)
+
+    if args.metrics_report or args.metrics_snapshot:
+        settings.attributes['METRICS_REPORT_PATH'].value = args.metrics_report or ''
+        settings.attributes['METRICS_SNAPSHOT_PATH'].value = args.metrics_snapshot or ''
+        logger.info('Crawl metrics enabled.')
+
     if args.no_validate:
         settings.attributes['ITEM_PIPELINES'].value['usesthis_crawler.pipelines.ValidationPipeline'] = None
         logger.info('ValidationPipeline disabled.')
 
+    if args.db_profile:
+        settings.attributes['DB_PROFILE'].value = args.db_profile
+        logger.info('Database profile set to %s.', args.db_profile)
+
+    if args.tool_stats:
+        settings.attributes['TOOL_STATS'].value = True
+        logger.info('Tool counts enabled.')
+
+    # cProfile only sees the thread it runs in, not the writer thread
+    if args.sync_db_writes or args.profile:
+        settings.attributes['DB_ASYNC_WRITES'].value = False
+        logger.info('Asynchronous database writes disabled.')
+
+    engine = None
     if args.skip_database:
         settings.attributes['ITEM_PIPELINES'].value['usesthis_crawler.pipelines.SQLPipeline'] = None
+        # Without the database, there's no telling what changed
+        settings.attributes['SKIP_UNCHANGED'].value = False
         logger.info('SQLPipeline disabled.')
     else:
-        init_models(settings.attributes['DB_PATH'].value, args.test)
+        # A bulk load builds the secondary indexes once it's done, instead of
+        # maintaining them row by row
+        profile = settings.attributes['DB_PROFILE'].value
+        bulk_load = profile == 'bulk-load'
+        engine = init_models(settings.attributes['DB_PATH'].value, args.test,
+                             profile=profile, defer_indexes=bulk_load,
+                             tool_stats=settings.attributes['TOOL_STATS'].value)
 
     ValidationPipeline._verbose = False
     if args.verbose:
@@ -122,20 +336,29 @@ def main(argv=None):
 
     process = CrawlerProcess(settings)
 
+    allowed_domain = args.allowed_domain
+    if allowed_domain is None:
+        allowed_domain = urlparse.urlparse(args.start_url).hostname
+
     process.crawl(
         UsesthisSpider,
         name='usesthis',
-        allowed_domains=['usesthis.com'],
+        allowed_domains=[allowed_domain],
         start_urls=(
-            'https://usesthis.com/interviews/',
+            args.start_url,
         ),
     )
 
-    process.start()
+    if args.profile:
+        profile_call(process.start, args.profile, top=args.profile_top)
+    else:
+        process.start()
 
-    if args.replace_database:
-        if old_db_exists:
-            os.remove(args.db_path)
-        os.rename(args.db_path+'_new', args.db_path)
+    # Close the database connections, so that SQLite checkpoints its WAL file
+    # into the database file
+    if engine is not None:
+        if bulk_load:
+            create_indexes(engine)
+        engine.dispose()
 
     return 0
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+from usesthis_crawler.cli import SCRIPTDIR, HelpFormatter
+from usesthis_crawler.export import FORMATS, export_database
+from usesthis_crawler.models import read_only_engine
+
+
+class ArgParser(argparse.ArgumentParser):
+    def __init__(self, *args, **kwargs):
+        super(ArgParser, self).__init__(*args, **kwargs)
+
+        self.add_argument(
+            'out_dir',
+            help='directory to write the people, tools and people_tools files to',
+        )
+
+        self.add_argument(
+            '-d', '--db-path',
+            help='path to the database to export',
+            default=os.path.join(SCRIPTDIR, '..', 'db', 'interviews.db'),
+        )
+
+        self.add_argument(
+            '-f', '--format',
+            help='file format',
+            choices=list(FORMATS),
+            default='parquet',
+        )
+
+        self.add_argument(
+            '--row-group-size',
+            help='number of rows per row group (or per record batch, for "arrow")',
+            type=int,
+            default=64 * 1024,
+            metavar='N',
+        )
+
+
+def main(argv=None, stdout=None):
+    if argv is None:
+        argv = sys.argv
+    if stdout is None:
+        stdout = sys.stdout
+
+    parser = ArgParser(prog=argv[0],
+                       formatter_class=HelpFormatter,
+                       description='Export a crawled database as Parquet or Arrow files.')
+    args = parser.parse_args(args=argv[1:])
+    if not os.path.exists(args.db_path):
+        parser.error('no database at {0}'.format(args.db_path))
+
+    engine = read_only_engine(args.db_path)
+    try:
+        with engine.connect() as conn:
+            written = export_database(conn, args.out_dir, file_format=args.format,
+                                      row_group_size=args.row_group_size)
+    except ValueError, exc:
+        parser.error(str(exc))
+    finally:
+        engine.dispose()
+
+    for path, n_rows in written:
+        stdout.write('Wrote {0} rows to {1}\n'.format(n_rows, path))
+
+    return 0
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+from sqlalchemy.exc import OperationalError
+from usesthis_crawler.cli import SCRIPTDIR, HelpFormatter
+from usesthis_crawler.models import read_only_engine
+from usesthis_crawler.search import has_search_index, search
+
+
+class ArgParser(argparse.ArgumentParser):
+    def __init__(self, *args, **kwargs):
+        super(ArgParser, self).__init__(*args, **kwargs)
+
+        self.add_argument(
+            'query',
+            help='FTS5 query, e.g. vim, \'hardware:thinkpad\' or \'"mechanical keyboard" NOT apple\'',
+        )
+
+        self.add_argument(
+            '-d', '--db-path',
+            help='path to the database to search',
+            default=os.path.join(SCRIPTDIR, '..', 'db', 'interviews.db'),
+        )
+
+        self.add_argument(
+            '-n', '--limit',
+            help='maximum number of hits',
+            type=int,
+            default=10,
+        )
+
+
+def main(argv=None, stdout=None):
+    if argv is None:
+        argv = sys.argv
+    if stdout is None:
+        stdout = sys.stdout
+
+    parser = ArgParser(prog=argv[0],
+                       formatter_class=HelpFormatter,
+                       description='Search the interviews in a crawled database.')
+    args = parser.parse_args(args=argv[1:])
+    if not os.path.exists(args.db_path):
+        parser.error('no database at {0}'.format(args.db_path))
+
+    engine = read_only_engine(args.db_path)
+    try:
+        with engine.connect() as conn:
+            if not has_search_index(conn):
+                parser.error('{0} has no search index yet; crawl into it to build one'
+                             .format(args.db_path))
+            hits = search(conn, args.query.decode('utf-8'), limit=args.limit)
+    except OperationalError, exc:
+        parser.error('bad query: {0}'.format(exc.orig))
+    finally:
+        engine.dispose()
+
+    for hit in hits:
+        stdout.write(u'{0} <{1}>\n    {2}\n'.format(
+            hit.name, hit.article_url, hit.snippet).encode('utf-8'))
+
+    return 0
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""Aggregate the validation warnings of a crawl, instead of writing each one
+to stderr as it happens.
+
+The validation functions log to the `usesthis_crawler.validation` logger,
+tagging each record with a `category` (e.g. 'missing_bio'). While a
+ValidationDiagnostics is started, those records are counted per category,
+and only the first few of each category are output, by a background thread
+fed through a queue, so that validation never waits on stderr. The counts
+and samples are then summarized at the end of the crawl.
+"""
+
+import logging
+import threading
+from collections import Counter, OrderedDict
+from Queue import Queue
+
+
+validation_logger = logging.getLogger('usesthis_crawler.validation')
+
+
+class QueueHandler(logging.Handler):
+    """Put log records on a queue (logging.handlers.QueueHandler is Python 3
+    only).
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        self.queue.put_nowait(record)
+
+
+class QueueListener(object):
+    """Hand the log records put on `queue` to `handler` (a Handler, or a
+    Logger), from a background thread.
+    """
+    sentinel = None
+
+    def __init__(self, queue, handler):
+        self.queue = queue
+        self.handler = handler
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='QueueListener')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self.sentinel:
+                break
+            self.handler.handle(record)
+
+    def stop(self):
+        """Output every queued record, then stop the thread."""
+        self.queue.put_nowait(self.sentinel)
+        self.thread.join()
+        self.thread = None
+
+
+class DiagnosticsHandler(logging.Handler):
+    """Count log records per category, keeping the messages of the first
+    `max_samples` records of each category, and passing those records (or
+    every record, with `output_all`) on to `target`.
+    """
+    def __init__(self, target, max_samples=5, output_all=False):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.max_samples = max_samples
+        self.output_all = output_all
+        self.counts = Counter()
+        self.samples = OrderedDict()
+
+    def emit(self, record):
+        category = getattr(record, 'category', record.msg)
+        self.counts[category] += 1
+        samples = self.samples.setdefault(category, [])
+        sampled = len(samples) < self.max_samples
+        if sampled:
+            samples.append(record.getMessage())
+        if sampled or self.output_all:
+            self.target.handle(record)
+
+
+class ValidationDiagnostics(object):
+    """Collect the validation warnings between `start()` and `stop()`.
+    Sampled warnings (or every warning, with `output_all`) are output through
+    `output` (by default, the `usesthis_crawler` logger, as if they had been
+    logged there). Only the samples are kept for the summary.
+    """
+    def __init__(self, max_samples=5, output=None, output_all=False):
+        self.queue = Queue()
+        self.listener = QueueListener(self.queue, output or validation_logger.parent)
+        self.handler = DiagnosticsHandler(QueueHandler(self.queue), max_samples, output_all)
+        self.propagate = None
+
+    @property
+    def counts(self):
+        return self.handler.counts
+
+    @property
+    def samples(self):
+        return self.handler.samples
+
+    def start(self):
+        self.listener.start()
+        validation_logger.addHandler(self.handler)
+        self.propagate, validation_logger.propagate = validation_logger.propagate, False
+
+    def stop(self):
+        validation_logger.removeHandler(self.handler)
+        validation_logger.propagate = self.propagate
+        self.listener.stop()
+
+    def summary(self):
+        """Return the lines of a summary of the warnings: their count per
+        category, most frequent first, with an example of each.
+        """
+        if not self.counts:
+            return ['No validation warnings.']
+        lines = ['Validation warnings:']
+        for category, count in self.counts.most_common():
+            lines.append(u'{0:>8} {1}, e.g. {2}'.format(
+                count, category, self.samples[category][0] if self.samples[category] else '-'))
+        return lines
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Export the database as columnar files (Parquet, or Arrow IPC), so that it
+can be analysed with pandas, DuckDB, etc. without joining SQLite tables:
+
+    - people: one row per person (the `people` columns, pub_date as a date);
+    - tools: one row per tool;
+    - people_tools: one row per (person, tool) pair, with the person's
+      pub_date, and the tool's name and URL.
+
+The tool names and URLs of `people_tools` are dictionary-encoded against the
+whole tool catalog, so that every row group shares the same dictionaries.
+Rows are read from the database and written `row_group_size` at a time, so
+memory use depends on that (and on the number of tools), not on the size of
+the database.
+
+Requires the "pyarrow" package.
+"""
+
+import datetime
+import os
+from collections import OrderedDict
+from usesthis_crawler.models import Person
+
+
+# File extension of each format
+FORMATS = OrderedDict([('parquet', '.parquet'), ('arrow', '.arrow')])
+
+PEOPLE_COLUMNS = [column.name for column in Person.__table__.columns]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError('exporting requires the "pyarrow" package')
+    return pyarrow, pyarrow.parquet
+
+
+def parse_date(value):
+    """Return the YYYY-MM-DD date `value` as a date, or None if it isn't one
+    (as can be stored when validation is turned off).
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def export_database(conn, out_dir, file_format='parquet', row_group_size=64 * 1024):
+    """Write the `people`, `tools` and `people_tools` files of the database
+    behind the SQLAlchemy connection `conn` to `out_dir`, from one snapshot
+    of the database, which is only read. Return a list of (path, number of
+    rows) pairs.
+    """
+    pa, pq = import_pyarrow()
+    if file_format not in FORMATS:
+        raise ValueError('Unknown format: {0}'.format(file_format))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    exporter = TableExporter(pa, pq, conn, out_dir, file_format, row_group_size)
+
+    # Every query reads the same snapshot
+    conn.execute('BEGIN')
+    try:
+        tool_codes, tool_names, tool_urls = tool_dictionaries(pa, conn)
+        # A database from an older crawler may lack some of the columns
+        existing = set(row[1] for row in conn.execute('PRAGMA table_info(people)'))
+        people_names = [name for name in PEOPLE_COLUMNS if name in existing]
+        pub_date_index = people_names.index('pub_date')
+        string = pa.string()
+        date = pa.date32()
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+
+        def people_columns(columns):
+            columns[pub_date_index] = map(parse_date, columns[pub_date_index])
+            return columns
+        people = exporter.export(
+            'people',
+            [(name, {'id': pa.int64(), 'pub_date': date}.get(name, string))
+             for name in people_names],
+            'SELECT {0} FROM people ORDER BY id'.format(', '.join(people_names)),
+            people_columns)
+
+        tools = exporter.export(
+            'tools', [('id', pa.int64()), ('tool_name', string), ('tool_url', string)],
+            'SELECT id, tool_name, tool_url FROM tools ORDER BY id',
+            lambda columns: columns)
+
+        def people_tools_columns(columns):
+            person_ids, pub_dates, tool_ids = columns
+            name_codes, url_codes = zip(*[tool_codes[tool_id] for tool_id in tool_ids])
+            return [
+                person_ids, map(parse_date, pub_dates), tool_ids,
+                pa.DictionaryArray.from_arrays(pa.array(name_codes, pa.int32()), tool_names),
+                pa.DictionaryArray.from_arrays(pa.array(url_codes, pa.int32()), tool_urls),
+            ]
+        people_tools = exporter.export(
+            'people_tools',
+            [('person_id', pa.int64()), ('pub_date', date), ('tool_id', pa.int64()),
+             ('tool_name', dictionary), ('tool_url', dictionary)],
+            # Links to a missing tool (or person) are left out
+            'SELECT pt.person_id, p.pub_date, pt.tool_id FROM people_to_tools pt '
+            'JOIN people p ON p.id = pt.person_id JOIN tools t ON t.id = pt.tool_id '
+            'ORDER BY pt.person_id, pt.tool_id',
+            people_tools_columns)
+    finally:
+        # Not a ROLLBACK statement: pysqlite would commit before running it
+        conn.connection.rollback()
+    return [people, tools, people_tools]
+
+
+def tool_dictionaries(pa, conn):
+    """Return a (dictionary mapping each tool ID to the (index of its name,
+    index of its URL) pair, array of the distinct tool names, array of the
+    distinct tool URLs) tuple.
+    """
+    rows = conn.execute('SELECT id, tool_name, tool_url FROM tools').fetchall()
+    names = sorted(set(row[1] for row in rows))
+    urls = sorted(set(row[2] for row in rows))
+    name_codes = dict((name, idx) for idx, name in enumerate(names))
+    url_codes = dict((url, idx) for idx, url in enumerate(urls))
+    tool_codes = dict((tool_id, (name_codes[tool_name], url_codes[tool_url]))
+                      for tool_id, tool_name, tool_url in rows)
+    return tool_codes, pa.array(names, pa.string()), pa.array(urls, pa.string())
+
+
+class TableExporter(object):
+    def __init__(self, pa, pq, conn, out_dir, file_format, row_group_size):
+        self.pa = pa
+        self.pq = pq
+        self.conn = conn
+        self.out_dir = out_dir
+        self.file_format = file_format
+        self.row_group_size = max(1, row_group_size)
+
+    def export(self, name, fields, query, make_columns):
+        """Write the rows of the SQL `query` to the file `name`, one row group
+        at a time. `make_columns` turns a list of columns (each a sequence of
+        values) into the arrays or lists of values of the `fields`, a list of
+        (name, Arrow type) pairs. Return a (path, number of rows) pair.
+        """
+        pa = self.pa
+        schema = pa.schema(fields)
+        path = os.path.join(self.out_dir, name + FORMATS[self.file_format])
+        tmp_path = path + '.tmp'
+        write_batch, close = self.open_writer(tmp_path, schema)
+
+        n_rows = 0
+        try:
+            try:
+                result = self.conn.execute(query)
+                while True:
+                    rows = result.fetchmany(self.row_group_size)
+                    if not rows:
+                        break
+                    columns = make_columns([list(column) for column in zip(*rows)])
+                    arrays = [column if isinstance(column, pa.Array) else pa.array(column, field_type)
+                              for column, (_, field_type) in zip(columns, fields)]
+                    write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                    n_rows += len(rows)
+            finally:
+                close()
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        # Readers only ever see complete files
+        os.rename(tmp_path, path)
+        return path, n_rows
+
+    def open_writer(self, path, schema):
+        """Return a (function that writes a RecordBatch, function that closes
+        the file) pair for a new file at `path`.
+        """
+        pa = self.pa
+        if self.file_format == 'parquet':
+            dictionary_columns = [field.name for field in schema
+                                  if isinstance(field.type, pa.DictionaryType)]
+            writer = self.pq.ParquetWriter(path, schema,
+                                           use_dictionary=dictionary_columns or False)
+            return (lambda batch: writer.write_table(pa.Table.from_batches([batch])),
+                    writer.close)
+
+        sink = pa.OSFile(path, 'wb')
+        writer = pa.RecordBatchFileWriter(sink, schema)
+        def close():
+            writer.close()
+            sink.close()
+        return writer.write_batch, close
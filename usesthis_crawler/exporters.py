@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import json
+import os
+import time
+
+
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def compression_module(compression):
+    """Return the module that compresses to the `compression` format (None
+    for gzip, which the writer handles itself, and for no compression).
+    Raise a ValueError if the format is unknown, or its package is missing.
+    """
+    if compression not in EXTENSIONS:
+        raise ValueError('Unknown compression: {0}'.format(compression))
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd compression requires the "zstandard" package')
+        return zstandard
+    return None
+
+
+class JSONLinesWriter(object):
+    """Write one JSON document per line to `path`, optionally compressed
+    ('gzip' or 'zstd'), through a `buffer_size`-byte write buffer.
+
+    Every `fsync_interval` seconds (0 to never), the buffers are flushed and
+    the file is fsync'ed. If `max_bytes` is set, the output is rotated to a
+    new numbered file (`interviews.00001.jsonl.gz`, ...) whenever the current
+    one has received `max_bytes` bytes of (uncompressed) JSON.
+    """
+    extensions = EXTENSIONS
+
+    def __init__(self, path, compression=None, buffer_size=1024 * 1024,
+                 fsync_interval=0, max_bytes=0):
+        self.zstandard = compression_module(compression)
+        self.path = path
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.file_number = 0
+        self.paths = []
+        self.raw = self.stream = None
+        self.bytes_written = 0
+        self.last_fsync = time.time()
+
+    def file_path(self):
+        if self.path.endswith(self.extensions[self.compression]):
+            base = self.path[:len(self.path) - len(self.extensions[self.compression])]
+        else:
+            base = self.path
+        if self.max_bytes:
+            stem, ext = os.path.splitext(base)
+            base = '{0}.{1:05d}{2}'.format(stem, self.file_number, ext)
+        return base + self.extensions[self.compression]
+
+    def open(self):
+        path = self.file_path()
+        self.raw = io.open(path, 'wb', buffering=self.buffer_size)
+        if self.compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            compressor = self.zstandard.ZstdCompressor()
+            self.stream = compressor.stream_writer(self.raw)
+        else:
+            self.stream = self.raw
+        self.paths.append(path)
+        self.bytes_written = 0
+
+    def write(self, record):
+        if self.stream is None:
+            self.open()
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        self.stream.write(line)
+        self.bytes_written += len(line)
+
+        if self.max_bytes and self.bytes_written >= self.max_bytes:
+            self.close()
+            self.file_number += 1
+        elif self.fsync_interval and time.time() - self.last_fsync >= self.fsync_interval:
+            self.fsync()
+
+    def fsync(self):
+        """Push everything written so far to disk."""
+        if self.stream is not None:
+            self.stream.flush()
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+        self.last_fsync = time.time()
+
+    def close(self):
+        if self.stream is None:
+            return
+        if self.stream is not self.raw:
+            if self.compression == 'zstd':
+                self.stream.flush(self.zstandard.FLUSH_FRAME)
+            else:
+                self.stream.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        self.raw = self.stream = None
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""A local stand-in for usesthis.com, serving synthetic interviews (with the
+real site's markup classes) for network-free crawls and load tests.
+Every page has an ETag, and conditional requests for unchanged pages are
+answered with "304 Not Modified".
+
+The listing starts at /interviews/ and continues at /interviews/page/N/,
+newest interview first; each interview lives at /interviews/<slug>/. Pages
+are generated on request, so serving 100k interviews costs no memory.
+
+The site counts the requests for each path (in `requests`), and can be slowed
+down by serving every interview after a delay (e.g. to stop a crawl midway).
+
+To run it by itself:
+
+    python -m usesthis_crawler.fixture_site -n 10000 -p 8000
+"""
+
+import argparse
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from usesthis_crawler.synthetic import make_article, make_listing_page, make_slug
+
+
+LISTING_PATH_RE = re.compile(r'^/interviews/(?:page/(\d+)/)?$')
+ARTICLE_PATH_RE = re.compile(r'^/interviews/interviewee\.(\d+)/$')
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        site = self.server
+        body = None
+        site.count_request(self.path)
+
+        listing_match = LISTING_PATH_RE.match(self.path)
+        article_match = ARTICLE_PATH_RE.match(self.path)
+        if listing_match:
+            body = site.listing_page(int(listing_match.group(1) or 1))
+        elif article_match:
+            time.sleep(site.article_delay)
+            body = site.article_page(int(article_match.group(1)))
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        body = body.encode('utf-8')
+        etag = '"{0}"'.format(hashlib.md5(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureSite(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, n_interviews, per_page=20, address=('127.0.0.1', 0),
+                 n_paragraphs=3, n_links=2, article_delay=0):
+        HTTPServer.__init__(self, address, FixtureRequestHandler)
+        self.n_interviews = n_interviews
+        self.per_page = per_page
+        self.n_paragraphs = n_paragraphs
+        self.n_links = n_links
+        self.article_delay = article_delay
+        self.requests = Counter()
+        self.requests_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def n_pages(self):
+        return max(1, -(-self.n_interviews // self.per_page))
+
+    @property
+    def domain(self):
+        return self.server_address[0]
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/interviews/'.format(*self.server_address)
+
+    def count_request(self, path):
+        with self.requests_lock:
+            self.requests[path] += 1
+
+    def listing_page(self, page):
+        if not 1 <= page <= self.n_pages:
+            return None
+        newest = self.n_interviews - 1 - (page - 1) * self.per_page
+        oldest = max(-1, newest - self.per_page)
+        next_url = None
+        if page < self.n_pages:
+            next_url = '/interviews/page/{0}/'.format(page + 1)
+        return make_listing_page([make_slug(idx) for idx in range(newest, oldest, -1)],
+                                 next_url)
+
+    def article_page(self, idx):
+        if not 0 <= idx < self.n_interviews:
+            return None
+        return make_article(make_slug(idx), n_paragraphs=self.n_paragraphs,
+                            n_links=self.n_links)
+
+    def start(self):
+        """Serve the site from a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description='Serve a synthetic usesthis.com.')
+    parser.add_argument('-n', '--interviews', type=int, default=1000,
+                        help='number of interviews')
+    parser.add_argument('--per-page', type=int, default=20,
+                        help='interviews per listing page')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    args = parser.parse_args(argv[1:])
+
+    site = FixtureSite(args.interviews, per_page=args.per_page,
+                       address=(args.host, args.port))
+    sys.stdout.write('Serving {0} interviews at {1}\n'.format(args.interviews, site.url))
+    sys.stdout.flush()
+    try:
+        site.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        site.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import time
+from six.moves import cPickle as pickle
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from scrapy.extensions.httpcache import RFC2616Policy
+
+
+class RevalidatingPolicy(RFC2616Policy):
+    """RFC2616 caching policy that never trusts a cached response without
+    asking the server first: every cached response is revalidated with a
+    conditional request (If-None-Match/If-Modified-Since), and its body is
+    reused if the server answers "304 Not Modified".
+    """
+    def is_cached_response_fresh(self, cachedresponse, request):
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class SQLiteCacheStorage(object):
+    """Persistent HTTP cache storage, keyed by URL, in a single SQLite file.
+    Once the stored bodies exceed HTTPCACHE_MAX_SIZE bytes, the least-recently
+    used responses are evicted. A HTTPCACHE_MAX_SIZE of 0 means no limit.
+    """
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.max_size = settings.getint('HTTPCACHE_MAX_SIZE')
+        self.db = None
+        self.size = 0
+
+    def open_spider(self, spider):
+        dbpath = os.path.join(self.cachedir, '%s.sqlite' % spider.name)
+        self.db = sqlite3.connect(dbpath)
+        self.db.text_factory = str
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            '    url TEXT PRIMARY KEY, status INTEGER NOT NULL,'
+            '    headers BLOB NOT NULL, body BLOB NOT NULL,'
+            '    size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS ix_responses_last_access '
+            'ON responses (last_access)'
+        )
+        self.size = self.db.execute(
+            'SELECT coalesce(sum(size), 0) FROM responses'
+        ).fetchone()[0]
+
+    def close_spider(self, spider):
+        self.db.commit()
+        self.db.close()
+
+    def retrieve_response(self, spider, request):
+        row = self.db.execute(
+            'SELECT url, status, headers, body FROM responses WHERE url = ?',
+            (request.url,)
+        ).fetchone()
+        if row is None:
+            return  # not cached
+
+        self.db.execute('UPDATE responses SET last_access = ? WHERE url = ?',
+                        (time.time(), request.url))
+        url, status, headers, body = row
+        headers = Headers(pickle.loads(str(headers)))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=str(body))
+
+    def store_response(self, spider, request, response):
+        headers = pickle.dumps(dict(response.headers), protocol=2)
+        size = len(response.body) + len(headers)
+        old_size = self.db.execute('SELECT size FROM responses WHERE url = ?',
+                                   (request.url,)).fetchone()
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+            (request.url, response.status, sqlite3.Binary(headers),
+             sqlite3.Binary(response.body), size, time.time())
+        )
+        self.size += size - (old_size[0] if old_size else 0)
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        """Delete the least-recently used responses until the cache fits in
+        HTTPCACHE_MAX_SIZE bytes.
+        """
+        if not self.max_size or self.size <= self.max_size:
+            return
+
+        # Only the rows that get evicted are read, in order, from the index
+        cursor = self.db.execute('SELECT url, size FROM responses ORDER BY last_access')
+        evicted = []
+        for url, size in cursor:
+            if self.size <= self.max_size:
+                break
+            evicted.append((url,))
+            self.size -= size
+        cursor.close()
+        self.db.executemany('DELETE FROM responses WHERE url = ?', evicted)
@@ -8,9 +8,17 @@
 import scrapy
 
 
+def required_fields(item_cls):
+    """Return the names of the fields of `item_cls` that aren't declared
+    `optional`.
+    """
+    return [name for name, field in item_cls.fields.items()
+            if not field.get('optional')]
+
+
 class FillableItem(scrapy.Item):
     def fill_empty_fields(self):
-        empty_fields = set(self.fields) - set(self)
+        empty_fields = set(required_fields(type(self))) - set(self)
         for field in empty_fields:
             self[field] = ''
 
@@ -25,6 +33,9 @@ class PersonItem(FillableItem):
     hardware = scrapy.Field()
     software = scrapy.Field()
     dream = scrapy.Field()
+    # Hash of the parts of the page that the spider extracts (see
+    # `article_hash()`); unset for items that didn't come from a page
+    content_hash = scrapy.Field(optional=True)
 
 
 class ToolItem(FillableItem):
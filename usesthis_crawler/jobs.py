@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Resumable crawls, on top of Scrapy's job directories (the JOBDIR setting).
+
+Scrapy keeps the state of a crawl in its job directory: the queue of pending
+requests (on disk), the fingerprints of the requests that were already made,
+and the spider's `state`. When a crawl is stopped gracefully (Ctrl-C once, or
+SIGTERM), the requests in progress are finished, and their interviews written
+to the database, before that state is saved; a crawl started again with the
+same directory carries on with the pending requests, without making any of
+the others again.
+
+A crawl that is killed outright (e.g. Ctrl-C twice, SIGKILL, or running out
+of memory) doesn't get to save that state, and what Scrapy did write (e.g. the
+fingerprints of the requests made so far) would stop the next crawl from
+making them again, including the start URL. So Scrapy's files are deleted
+before a crawl starts unless the spider's state was saved (see
+`prepare_job()`). The SQLPipeline also keeps a commit log in the directory,
+listing the article URLs of every batch once it is committed: a crawl that
+carries on after the previous one was killed starts from the first listing
+page again, but doesn't request the interviews that were already committed.
+
+Once a crawl finishes, JobCleanup deletes its job files, so that the next
+crawl with the same directory starts from scratch.
+"""
+
+import os
+import shutil
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from usesthis_crawler import logger
+
+
+# The files that Scrapy keeps in a job directory
+SCRAPY_JOB_FILES = ('requests.queue', 'requests.seen', 'spider.state')
+# The article URLs of the batches that the SQLPipeline committed, one per line
+COMMIT_LOG = 'committed.urls'
+JOB_FILES = SCRAPY_JOB_FILES + (COMMIT_LOG,)
+
+
+def has_spider_state(job_dir):
+    """Return whether `job_dir` holds a crawl that was stopped gracefully.
+    (The spider's state is saved whenever a crawl stops, and deleted once it
+    finishes.)
+    """
+    return os.path.exists(os.path.join(job_dir, 'spider.state'))
+
+
+def is_resumable(job_dir):
+    """Return whether `job_dir` holds a crawl that was stopped early, either
+    gracefully or outright (once it had committed anything).
+    """
+    return has_spider_state(job_dir) or bool(read_commit_log(job_dir))
+
+
+def prepare_job(job_dir):
+    """Make `job_dir` ready for a crawl: unless the crawl in it was stopped
+    gracefully, Scrapy's files are stale, and get deleted (along with the
+    commit log, if there's nothing to resume). Return whether the crawl in
+    `job_dir` is resumed.
+    """
+    resumable = is_resumable(job_dir)
+    if not resumable:
+        clear_job(job_dir)
+    elif not has_spider_state(job_dir):
+        clear_job(job_dir, SCRAPY_JOB_FILES)
+        logger.info('The crawl in %s was killed; carrying on without the interviews '
+                    'it committed.', job_dir)
+    return resumable
+
+
+def clear_job(job_dir, names=JOB_FILES):
+    """Delete the job files in `job_dir` (or the `names` ones), leaving
+    anything else alone.
+    """
+    for name in names:
+        path = os.path.join(job_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def read_commit_log(job_dir):
+    """Return the set of the article URLs in the commit log of `job_dir`. A
+    line that was cut short (by a crash while it was written) doesn't count.
+    """
+    path = os.path.join(job_dir, COMMIT_LOG)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb') as log_file:
+        return set(line[:-1].decode('utf-8') for line in log_file if line.endswith('\n'))
+
+
+class CommitLog(object):
+    """Append the article URLs of committed batches to the commit log of a
+    job directory, durably: each batch is fsync'ed before `record()` returns.
+    """
+    def __init__(self, job_dir):
+        if not os.path.exists(job_dir):
+            os.makedirs(job_dir)
+        self.file = open(os.path.join(job_dir, COMMIT_LOG), 'ab')
+
+    def record(self, urls):
+        self.file.write(''.join(url.encode('utf-8') + '\n' for url in urls))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class JobCleanup(object):
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Read the job directory from the crawler's settings.
+        Note: this gets called implicitly by scrapy.
+        """
+        job_dir = crawler.settings.get('JOBDIR')
+        if not job_dir:
+            raise NotConfigured
+        extension = cls(job_dir)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_closed(self, spider, reason):
+        """Delete the job files once the crawl is finished. (Scrapy's own
+        extensions, which save the spider's state, come first.)
+        """
+        if reason == 'finished':
+            clear_job(self.job_dir)
+            logger.info('Crawl finished; cleared the job files in %s.', self.job_dir)
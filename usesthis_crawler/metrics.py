@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""Per-stage timings and event counters for a crawl.
+
+MetricsExtension puts a CrawlMetrics on the crawler (as `crawler.metrics`)
+when METRICS_REPORT_PATH and/or METRICS_SNAPSHOT_PATH are set. The spider and
+the pipelines time their stages with it (see `crawler_metrics()`), and the
+extension itself records the download latencies and the scraped/dropped
+items. The metrics are written:
+
+    - to METRICS_REPORT_PATH, as a JSON report, once the spider is closed;
+    - to METRICS_SNAPSHOT_PATH, in the Prometheus text format, every
+      METRICS_SNAPSHOT_INTERVAL seconds during the crawl (and once at the
+      end), e.g. for node_exporter's textfile collector.
+"""
+
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from usesthis_crawler import logger
+
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """Count observations into fixed buckets, Prometheus-style."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, plus one for the values above the last bound
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        """Return (upper bound, number of observations <= bound) pairs, the
+        last bound being infinity.
+        """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Return an upper bound of the `q` quantile (0 < q <= 1): the bound
+        of the bucket it falls in, or the maximum, for the last bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative_counts():
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return OrderedDict([
+            ('count', self.count),
+            ('sum', self.sum),
+            ('mean', self.sum / self.count if self.count else 0.0),
+            ('p50', self.quantile(0.5)),
+            ('p90', self.quantile(0.9)),
+            ('p99', self.quantile(0.99)),
+            ('max', self.max),
+        ])
+
+
+class CrawlMetrics(object):
+    """Latency histograms per stage (e.g. 'download', 'parse_article'), and
+    event counters (e.g. 'items_dropped').
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = Counter()
+        self.started = time.time()
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, event, count=1):
+        self.counters[event] += count
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the body of a `with` block as one observation of `stage`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time() - start)
+
+    def report(self):
+        """Return the metrics as a JSON-serializable dictionary."""
+        return OrderedDict([
+            ('elapsed', time.time() - self.started),
+            ('stages', OrderedDict((stage, histogram.to_dict())
+                                   for stage, histogram in self.stages.items())),
+            ('counters', OrderedDict(sorted(self.counters.items()))),
+        ])
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            '# HELP usesthis_stage_seconds Time spent in each stage of the crawl.',
+            '# TYPE usesthis_stage_seconds histogram',
+        ]
+        for stage, histogram in self.stages.items():
+            for bound, total in histogram.cumulative_counts():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('usesthis_stage_seconds_bucket{{stage="{0}",le="{1}"}} {2}'.format(
+                    stage, le, total))
+            lines.append('usesthis_stage_seconds_sum{{stage="{0}"}} {1!r}'.format(stage, histogram.sum))
+            lines.append('usesthis_stage_seconds_count{{stage="{0}"}} {1}'.format(stage, histogram.count))
+        lines.extend([
+            '# HELP usesthis_events_total Number of times each event happened during the crawl.',
+            '# TYPE usesthis_events_total counter',
+        ])
+        for event, count in sorted(self.counters.items()):
+            lines.append('usesthis_events_total{{event="{0}"}} {1}'.format(event, count))
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics(object):
+    """Stands in for CrawlMetrics when the metrics aren't enabled."""
+    def observe(self, stage, seconds):
+        pass
+
+    def inc(self, event, count=1):
+        pass
+
+    @contextmanager
+    def timer(self, stage):
+        yield
+
+
+NULL_METRICS = NullMetrics()
+
+
+def crawler_metrics(crawler):
+    """Return the crawler's CrawlMetrics, or NULL_METRICS if there aren't any."""
+    return getattr(crawler, 'metrics', NULL_METRICS)
+
+
+def write_atomically(path, data):
+    """Replace the file at `path` with `data`, so that readers only ever see
+    a complete file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+    os.rename(tmp_path, path)
+
+
+class MetricsExtension(object):
+    def __init__(self, report_path='', snapshot_path='', snapshot_interval=10):
+        self.report_path = report_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.metrics = CrawlMetrics()
+        self.snapshot_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Read the output paths from the crawler's settings, and hook the
+        extension up to the crawler's signals.
+        Note: this gets called implicitly by scrapy.
+        """
+        settings = crawler.settings
+        if not (settings.get('METRICS_REPORT_PATH') or settings.get('METRICS_SNAPSHOT_PATH')):
+            raise NotConfigured
+        extension = cls(report_path=settings.get('METRICS_REPORT_PATH'),
+                        snapshot_path=settings.get('METRICS_SNAPSHOT_PATH'),
+                        snapshot_interval=settings.getfloat('METRICS_SNAPSHOT_INTERVAL', 10))
+        crawler.metrics = extension.metrics
+
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(extension.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(extension.spider_error, signal=signals.spider_error)
+        return extension
+
+    def spider_opened(self, spider):
+        if self.snapshot_path:
+            self.snapshot_task = task.LoopingCall(self.write_snapshot)
+            self.snapshot_task.start(self.snapshot_interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        """Write the final snapshot and the JSON report."""
+        if self.snapshot_task is not None and self.snapshot_task.running:
+            self.snapshot_task.stop()
+        if self.snapshot_path:
+            self.write_snapshot()
+        if self.report_path:
+            report = self.metrics.report()
+            report['finish_reason'] = reason
+            write_atomically(self.report_path, json.dumps(report, indent=2) + '\n')
+            logger.info('Wrote the crawl metrics to %s', self.report_path)
+
+    def write_snapshot(self):
+        write_atomically(self.snapshot_path, self.metrics.prometheus())
+
+    def response_received(self, response, request, spider):
+        self.metrics.inc('responses')
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.observe('download', latency)
+
+    def item_scraped(self, item, response, spider):
+        self.metrics.inc('items_scraped')
+
+    def item_dropped(self, item, response, exception, spider):
+        self.metrics.inc('items_dropped')
+
+    def spider_error(self, failure, response, spider):
+        self.metrics.inc('spider_errors')
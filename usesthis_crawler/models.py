@@ -1,30 +1,181 @@
 import inspect
-from sqlalchemy import Table, Column, ForeignKey, Integer, String
-from sqlalchemy import create_engine
+from sqlalchemy import Table, Column, ForeignKey, Index, Integer, String
+from sqlalchemy import create_engine, event, select
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 from usesthis_crawler import Session
+from usesthis_crawler.aggregates import create_tool_stats
+from usesthis_crawler.search import create_search_index
 
 
 Base = declarative_base()
 
 
-def init_models(db_path, enable_test_mode=False):
+# SQLite pragmas applied to every connection, per performance profile.
+#   - safe: WAL, so readers don't block the writer; every commit is durable.
+#   - fast: a crash may lose the last few commits, but can't corrupt the file.
+#   - bulk-load: no journal and no fsync at all. A crash in the middle of a
+#     load can corrupt the database, so only use it for databases that can be
+#     rebuilt from scratch. Without a journal, --replace-database isn't atomic
+#     either.
+SQLITE_PROFILES = {
+    'safe': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'FULL'),
+    ],
+    'fast': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('cache_size', -64 * 1024),
+        ('mmap_size', 256 * 1024 * 1024),
+        ('temp_store', 'MEMORY'),
+    ],
+    'bulk-load': [
+        ('journal_mode', 'OFF'),
+        ('synchronous', 'OFF'),
+        ('cache_size', -256 * 1024),
+        ('mmap_size', 1024 * 1024 * 1024),
+        ('temp_store', 'MEMORY'),
+    ],
+}
+
+
+def init_models(db_path, enable_test_mode=False, profile='safe',
+                defer_indexes=False, tool_stats=False):
+    """Create (or migrate) the database at `db_path`, along with its
+    full-text search index (and its tool counts, with `tool_stats`), tune its
+    connections with the named SQLite `profile`, and bind the Session to it.
+    Return the engine.
+
+    With `defer_indexes`, the secondary (non-unique) indexes are dropped, so
+    that a bulk load doesn't have to maintain them; call `create_indexes()`
+    once the load is done.
+    """
     engine = create_engine('sqlite:///'+db_path, echo=enable_test_mode)
+    apply_sqlite_profile(engine, profile)
     Base.metadata.create_all(engine)
+    migrate_people_table(engine)
+    migrate_tools_table(engine)
+    if defer_indexes:
+        drop_secondary_indexes(engine)
+        create_indexes(engine, secondary=False)
+    else:
+        create_indexes(engine)
+    create_search_index(engine)
+    if tool_stats:
+        create_tool_stats(engine)
     Session.configure(bind=engine)
+    return engine
+
+
+def read_only_engine(db_path):
+    """Return an engine for reading the database at `db_path` as it is:
+    without migrating it or changing its settings, and with its connections
+    refusing to write to it (the query_only pragma).
+    """
+    engine = create_engine('sqlite:///'+db_path)
+
+    def set_query_only(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA query_only = 1')
+
+    event.listen(engine, 'connect', set_query_only)
+    return engine
+
+
+def index_names(engine):
+    return set(row[0] for row in engine.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"
+    ))
+
+
+def create_indexes(engine, secondary=True):
+    """Create the declared indexes that are missing from the database (e.g.
+    because it was created by an older version of the crawler). Secondary
+    (non-unique) indexes are skipped unless `secondary` is true.
+    """
+    existing = index_names(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing or not (index.unique or secondary):
+                continue
+            index.create(engine)
+
+
+def drop_secondary_indexes(engine):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if not index.unique:
+                engine.execute('DROP INDEX IF EXISTS {0}'.format(index.name))
+
+
+def apply_sqlite_profile(engine, profile):
+    """Run the pragmas of the named SQLite profile on every new connection
+    of `engine`.
+    """
+    pragmas = SQLITE_PROFILES[profile]
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+        cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+
+def migrate_people_table(engine):
+    """Add the `people` columns that older versions of the crawler didn't
+    have (they are all nullable).
+    """
+    existing = set(row[1] for row in engine.execute('PRAGMA table_info(people)'))
+    for column in Person.__table__.columns:
+        if column.name not in existing:
+            engine.execute('ALTER TABLE people ADD COLUMN {0} {1}'.format(
+                column.name, column.type.compile(engine.dialect)))
+
+
+def migrate_tools_table(engine):
+    """Collapse the duplicate `tools` rows (same name and URL) written by
+    older versions of the crawler into one row each, re-pointing their
+    `people_to_tools` relations, so that the unique (name, URL) index can be
+    added. Does nothing if the index already exists.
+    """
+    if TOOL_INDEX_NAME in index_names(engine):
+        return
+
+    canonical_ids = 'SELECT min(id) FROM tools GROUP BY tool_name, tool_url'
+    with engine.begin() as conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO people_to_tools (person_id, tool_id) '
+            'SELECT pt.person_id, c.id FROM people_to_tools pt '
+            'JOIN tools t ON t.id = pt.tool_id '
+            'JOIN (SELECT min(id) AS id, tool_name, tool_url FROM tools '
+            '      GROUP BY tool_name, tool_url) c '
+            'ON c.tool_name = t.tool_name AND c.tool_url = t.tool_url '
+            'WHERE c.id != t.id'
+        )
+        conn.execute(
+            'DELETE FROM people_to_tools WHERE tool_id IN '
+            '(SELECT id FROM tools WHERE id NOT IN ({0}))'.format(canonical_ids)
+        )
+        conn.execute('DELETE FROM tools WHERE id NOT IN ({0})'.format(canonical_ids))
 
 
 people_to_tools_tbl = Table(
     'people_to_tools',
     Base.metadata,
     Column('person_id', Integer, ForeignKey('people.id'), primary_key=True, nullable=False),
-    Column('tool_id', Integer, ForeignKey('tools.id'), primary_key=True, nullable=False)
+    Column('tool_id', Integer, ForeignKey('tools.id'), primary_key=True, nullable=False),
+    # The primary key covers person -> tools; this covers tool -> people
+    Index('ix_people_to_tools_tool_id', 'tool_id', 'person_id'),
 )
 
 
 class Person(Base):
     __tablename__ = 'people'
+    __table_args__ = (
+        Index('ix_people_pub_date', 'pub_date'),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String, unique=True, nullable=False)
@@ -36,6 +187,8 @@ class Person(Base):
     hardware = Column(String, nullable=False)
     software = Column(String, nullable=False)
     dream = Column(String, nullable=False)
+    # See PersonItem.content_hash
+    content_hash = Column(String)
 
     tools = relationship('Tool',
                          secondary=people_to_tools_tbl,
@@ -63,8 +216,15 @@ class Person(Base):
         return '<{0}({1})>'.format(cls_name, ', '.join(variables))
 
 
+# Also serves tool-name lookups, as the name is its first column
+TOOL_INDEX_NAME = 'ix_tools_name_url'
+
+
 class Tool(Base):
     __tablename__ = 'tools'
+    __table_args__ = (
+        Index(TOOL_INDEX_NAME, 'tool_name', 'tool_url', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False)
     tool_name = Column(String, nullable=False)
@@ -90,3 +250,34 @@ class Tool(Base):
             variables.append(pair)
 
         return '<{0}({1})>'.format(cls_name, ', '.join(variables))
+
+
+class ToolIndex(object):
+    """In-memory (tool_name, tool_url) -> tool ID index over the `tools`
+    table, so that resolving a ToolItem doesn't cost a SELECT.
+    Assumes that this process is the only one writing to `tools`.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.max_id = 0
+
+    def load(self, conn):
+        """Warm the index with every row in the `tools` table."""
+        tools_tbl = Tool.__table__
+        query = select([tools_tbl.c.id, tools_tbl.c.tool_name, tools_tbl.c.tool_url])
+        for tool_id, tool_name, tool_url in conn.execute(query):
+            self.ids[(tool_name, tool_url)] = tool_id
+            self.max_id = max(self.max_id, tool_id)
+
+    def resolve(self, tool_item):
+        """Return a (tool ID, is-new) pair for `tool_item`. New tools are
+        assigned the next free ID; the caller is responsible for inserting
+        their rows.
+        """
+        key = (tool_item['tool_name'], tool_item['tool_url'])
+        tool_id = self.ids.get(key)
+        if tool_id is not None:
+            return tool_id, False
+        self.max_id += 1
+        self.ids[key] = self.max_id
+        return self.max_id, True
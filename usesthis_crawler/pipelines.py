@@ -1,16 +1,84 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from sqlalchemy.exc import IntegrityError
+import time
+from collections import Counter, OrderedDict
+from sqlalchemy import bindparam
+from scrapy import signals
 from scrapy.exceptions import DropItem
 from usesthis_crawler import Session, logger
-from usesthis_crawler.models import Person, Tool
+from usesthis_crawler.models import \
+    Tool, ToolIndex, people_to_tools_tbl
+from usesthis_crawler.diagnostics import ValidationDiagnostics
+from usesthis_crawler.exporters import JSONLinesWriter
+from usesthis_crawler.jobs import CommitLog
+from usesthis_crawler.aggregates import ToolStatsDelta, has_tool_stats, recount_people
+from usesthis_crawler.metrics import NULL_METRICS, crawler_metrics
+from usesthis_crawler.replace import MAX_VARIABLES, PERSON_COLUMNS, ReplaceStage, chunks
+from usesthis_crawler.search import has_search_index, index_people
+from usesthis_crawler.writer import DatabaseWriter
 from usesthis_crawler.validation import \
-    ItemValidationError, validate_person_item, validate_tool_items
-from sqlalchemy import create_engine
+    ItemValidationError, validate_person_item, validate_tool_items, \
+    fast_validate_person_item, fast_validate_tool_items
+
+
+# Insert a person, or update their row if their article URL is already in the
+# database and any of their columns changed. The update is skipped if it would
+# take the name or image of someone else, as is the insert (OR IGNORE).
+UPSERT_PERSON = (
+    'INSERT OR IGNORE INTO people ({0}) VALUES ({1}) '
+    'ON CONFLICT (article_url) DO UPDATE SET ({0}) = ({2}) '
+    'WHERE ({3}) AND NOT EXISTS ('
+    '    SELECT 1 FROM people other WHERE other.id != people.id'
+    '    AND (other.name = excluded.name OR other.img_src = excluded.img_src))'
+).format(', '.join(PERSON_COLUMNS),
+         ', '.join('?' * len(PERSON_COLUMNS)),
+         ', '.join('excluded.{0}'.format(name) for name in PERSON_COLUMNS),
+         ' OR '.join('people.{0} IS NOT excluded.{0}'.format(name) for name in PERSON_COLUMNS))
 
 
 class ValidationPipeline(object):
+    _verbose = False
+    fast_validation = True
+    log_samples = 5
+    stats = None
+    metrics = NULL_METRICS
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Pick the validation path and the number of warnings to output per
+        category from the crawler's settings.
+        Note: this gets called implicitly by scrapy.
+        """
+        pipeline = cls()
+        pipeline.fast_validation = crawler.settings.getbool('FAST_VALIDATION', True)
+        pipeline.log_samples = crawler.settings.getint('VALIDATION_LOG_SAMPLES', 5)
+        pipeline.stats = crawler.stats
+        pipeline.metrics = crawler_metrics(crawler)
+        return pipeline
+
+    def open_spider(self, spider):
+        """Start collecting the validation warnings. Only the first few of
+        each category are output, unless in verbose mode.
+        Note: this gets called implicitly by scrapy.
+        """
+        self.diagnostics = ValidationDiagnostics(
+            max_samples=self.log_samples, output_all=self._verbose)
+        self.diagnostics.start()
+
+    def close_spider(self, spider):
+        """Log a summary of the validation warnings, and record their counts
+        in the crawl stats (as "validation/<category>").
+        Note: this gets called implicitly by scrapy.
+        """
+        self.diagnostics.stop()
+        log = logger.warn if self.diagnostics.counts else logger.info
+        for line in self.diagnostics.summary():
+            log(line)
+        if self.stats is not None:
+            for category, count in self.diagnostics.counts.items():
+                self.stats.set_value('validation/{0}'.format(category), count)
+
     def process_item(self, item, spider):
         """Raise DropItem exception if the PersonItem component is not valid.
         Otherwise, delete any ToolItem components that are not valid.
@@ -25,31 +93,203 @@ class ValidationPipeline(object):
             - item: dictionary {'person': PersonItem component,
                                 'tools': list of ToolItem components}
         """
-        try:
-            validate_person_item(item['person'], verbose=self._verbose)
-        except ItemValidationError, exc:
-            raise DropItem(exc.message)
-        validate_tool_items(item['tools'], item['person'], verbose=self._verbose)
+        if self.fast_validation:
+            validate_person, validate_tools = fast_validate_person_item, fast_validate_tool_items
+        else:
+            validate_person, validate_tools = validate_person_item, validate_tool_items
+
+        with self.metrics.timer('validation'):
+            try:
+                validate_person(item['person'], verbose=self._verbose)
+            except ItemValidationError, exc:
+                raise DropItem(exc.message)
+            n_tools = len(item['tools'])
+            validate_tools(item['tools'], item['person'], verbose=self._verbose)
+        self.metrics.inc('tools_rejected', n_tools - len(item['tools']))
         return item
 
 
 class SQLPipeline(object):
+    def __init__(self, batch_size=1, flush_interval=0, search_index=True,
+                 replace=False, async_writes=False, max_pending_writes=4,
+                 job_dir='', resumed=False, tool_stats=False):
+        """Buffer up to `batch_size` items (or `flush_interval` milliseconds'
+        worth of items) before writing them to the database in a single
+        transaction. The defaults write every item as soon as it arrives.
+        With `search_index`, the full-text search index is kept in sync with
+        the people that get written (if the database has one), as are the
+        tool counts with `tool_stats` (see aggregates.py); without it, they
+        are rebuilt once the spider is closed.
+        With `replace`, the items are staged instead, and replace the contents
+        of the database once the spider is closed (see replace.py).
+        With a `job_dir`, the crawl is resumable: the article URLs of each
+        batch are added to the job's commit log once it is committed, and if
+        the crawl gets stopped early, the staged items are kept for the crawl
+        to resume with (see jobs.py). Those of a previous crawl are only
+        reused if the crawl is `resumed`.
+        With `async_writes`, the database is only used from a writer thread,
+        with up to `max_pending_writes` batches queued for it (see writer.py).
+        """
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.search_index = search_index
+        self.replace = replace
+        self.async_writes = async_writes
+        self.max_pending_writes = max_pending_writes
+        self.job_dir = job_dir
+        self.resumable = bool(job_dir)
+        self.resumed = resumed
+        self.commit_log = None
+        self.writer = None
+        self.stage = None
+        self.buffer = []
+        self.buffer_started = None
+        self.tool_index = None
+        self.has_search_index = None
+        self.tool_stats = tool_stats
+        self.has_tool_stats = None
+        self.metrics = NULL_METRICS
+        self.stats = None
+        # Number of people inserted, updated, unchanged, and skipped as duplicates
+        self.counts = Counter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Read the batching options from the crawler's settings.
+        Note: this gets called implicitly by scrapy.
+        """
+        settings = crawler.settings
+        pipeline = cls(batch_size=settings.getint('DB_BATCH_SIZE', 1),
+                       flush_interval=settings.getint('DB_FLUSH_INTERVAL', 0),
+                       search_index=settings.getbool('SEARCH_INDEX', True),
+                       replace=settings.getbool('DB_REPLACE'),
+                       async_writes=settings.getbool('DB_ASYNC_WRITES'),
+                       max_pending_writes=settings.getint('DB_WRITE_QUEUE_SIZE', 4),
+                       job_dir=settings.get('JOBDIR') or '',
+                       resumed=settings.getbool('JOB_RESUMED'),
+                       tool_stats=settings.getbool('TOOL_STATS'))
+        pipeline.metrics = crawler_metrics(crawler)
+        pipeline.stats = crawler.stats
+        if pipeline.replace:
+            crawler.signals.connect(pipeline.spider_closed,
+                                    signal=signals.spider_closed)
+        return pipeline
+
     def open_spider(self, spider):
-        """Create a SQLAlchemy session.
+        """Create a SQLAlchemy session (and the staging area, when replacing
+        the database), on the writer thread if writing asynchronously.
         Note: this gets called implicitly by scrapy.
         """
+        if not self.async_writes:
+            self.open_database()
+            return
+        self.writer = DatabaseWriter(self.max_pending_writes)
+        self.writer.start()
+        return self.writer.call(self.open_database)
+
+    def open_database(self):
         self.session = Session()
+        if self.job_dir:
+            self.commit_log = CommitLog(self.job_dir)
+        if self.replace:
+            self.stage = ReplaceStage(self.session.get_bind())
+            self.stage.open(keep=self.resumed)
 
     def close_spider(self, spider):
-        """Close the SQLAlchemy session.
+        """Write any buffered items, then close the SQLAlchemy session. When
+        writing asynchronously, wait for the writer thread to get through its
+        queue, and report how long that took.
         Note: this gets called implicitly by scrapy.
         """
-        self.session.close()
+        items, self.buffer = self.buffer, []
+        if self.writer is None:
+            self.close_database(items)
+            return
+
+        started = time.time()
+        d = self.writer.call(self.close_database, items)
+        d.addCallback(lambda _: self.writes_drained(time.time() - started))
+        if not self.replace:
+            d.addBoth(self.stop_writer)
+        return d
+
+    def close_database(self, items):
+        try:
+            self.write_batch(items)
+            if self.has_tool_stats and not self.tool_stats and not self.replace and \
+                    (self.counts['inserted'] or self.counts['updated']):
+                self.recount_tools()
+        finally:
+            self.session.close()
+            if self.commit_log is not None:
+                self.commit_log.close()
+        if not self.replace:
+            self.report_counts()
+
+    def recount_tools(self):
+        """Rebuild the tool counts that weren't kept in sync, in one go."""
+        started = time.time()
+        recount_people(self.session.connection())
+        self.session.commit()
+        logger.info('Recounted the tools in %.3f s.', time.time() - started)
+
+    def report_counts(self):
+        """Log how many people were inserted, updated, unchanged or skipped,
+        and record it in the crawl stats (as "sql/people_<outcome>").
+        """
+        outcomes = ('inserted', 'updated', 'unchanged', 'duplicate')
+        logger.info('People: %s.', ', '.join(
+            '{0} {1}'.format(self.counts[outcome], outcome) for outcome in outcomes))
+        if self.stats is not None:
+            for outcome in outcomes:
+                self.stats.set_value('sql/people_{0}'.format(outcome), self.counts[outcome])
+
+    def writes_drained(self, seconds):
+        logger.info('Waited %.3f s for the pending database writes.', seconds)
+        if self.stats is not None:
+            self.stats.set_value('sql/drain_seconds', seconds)
+
+    def stop_writer(self, result):
+        self.writer.stop()
+        return result
+
+    def spider_closed(self, spider, reason):
+        """Replace the contents of the database with the staged items. The
+        interviews that weren't crawled are only deleted if the spider
+        finished, rather than being stopped early. A resumable crawl that was
+        stopped early keeps the staged items for later instead.
+        Note: this gets called implicitly by scrapy, when replacing the database.
+        """
+        complete = reason == 'finished'
+        # The spider skips the interviews that didn't change, but they were seen
+        unchanged_urls = list(getattr(spider, 'unchanged_article_urls', ()))
+        if self.writer is None:
+            self.apply_stage(complete, unchanged_urls)
+            return
+        return self.writer.call(self.apply_stage, complete, unchanged_urls).addBoth(self.stop_writer)
+
+    def apply_stage(self, complete, unchanged_urls=()):
+        keep = self.resumable and not complete
+        try:
+            self.stage.mark_seen(unchanged_urls)
+            if keep:
+                logger.info('Crawl stopped early; kept the staged interviews in %s.',
+                            self.stage.path)
+            else:
+                self.stage.apply(complete=complete)
+        except Exception:
+            # The staged interviews are the crawl's only copy of its work
+            logger.error('Could not replace the database; kept the staged interviews in %s.',
+                         self.stage.path)
+            self.stage.close(keep=True)
+            raise
+        self.stage.close(keep=keep)
 
     def process_item(self, item, spider):
-        """Add the PersonItem component and the list of ToolItem components to
-        the database. Return the input item.
-        If a database constraint is violated, rollback the transaction.
+        """Buffer the PersonItem component and the list of ToolItem components,
+        writing the buffer to the database once it is full (or old enough).
+        Return the input item (or, when writing asynchronously and the buffer
+        got written, a Deferred that fires with it once the buffer is written).
 
         Arguments:
             - item: dictionary {'person': PersonItem component,
@@ -59,21 +299,251 @@ class SQLPipeline(object):
         Returns:
             - item: dictionary {'person': PersonItem component,
                                 'tools': list of ToolItem components}
+        """
+        if not self.buffer:
+            self.buffer_started = time.time()
+        self.buffer.append(item)
+
+        if self.buffer_is_due():
+            d = self.flush()
+            if d is not None:
+                return d.addCallback(lambda _: item)
+
+        return item
 
-        Note: the "rollback" behavior is currently untestable by SQLAlchemy.
+    def buffer_is_due(self):
+        if len(self.buffer) >= self.batch_size:
+            return True
+        elapsed_ms = (time.time() - self.buffer_started) * 1000
+        return bool(self.flush_interval) and elapsed_ms >= self.flush_interval
+
+    def flush(self):
+        """Write every buffered item to the database in one transaction.
+        When writing asynchronously, queue them for the writer thread instead,
+        and return a Deferred that fires once they are written.
+        """
+        items, self.buffer = self.buffer, []
+        if self.writer is not None:
+            return self.writer.call(self.write_batch, items)
+        self.write_batch(items)
+
+    def write_batch(self, items):
+        """Write `items` to the database in one transaction. People that are
+        already in the database are updated (or skipped, if they didn't change)
+        one at a time, so a duplicate doesn't cost the rest of the batch.
         """
-        person = Person(**item['person'])
+        if not items:
+            return
 
-        for tool_item in item['tools']:
-            tool = Tool(**tool_item)
-            person.tools.append(tool)
+        with self.metrics.timer('sql_flush'):
+            n_written = self.write(items)
+            if self.commit_log is not None:
+                self.commit_log.record([item['person']['article_url'] for item in items])
+        sys.stderr.write('.' * n_written)
 
-        self.session.add(person)
+    def write(self, items):
+        """Write (or stage) `items`. Return the number of people written."""
+        if self.replace:
+            return self.stage.stage(items)
+
+        conn = self.session.connection()
+        if self.tool_index is None:
+            self.tool_index = ToolIndex()
+            self.tool_index.load(conn)
+        if self.has_search_index is None:
+            self.has_search_index = self.search_index and has_search_index(conn)
+        if self.has_tool_stats is None:
+            self.has_tool_stats = has_tool_stats(conn)
         try:
+            person_ids, outcomes, pub_dates = self.upsert_people(conn, items)
+            relinked_ids = self.upsert_tools(conn, items, person_ids, pub_dates)
+            written_ids = set(person_ids[idx] for idx, outcome in outcomes.items()
+                              if outcome in ('inserted', 'updated'))
+            # e.g. parsed again with a better tool extraction
+            for idx, person_id in person_ids.items():
+                if person_id in relinked_ids and person_id not in written_ids:
+                    outcomes[idx] = 'updated'
+            written_ids.update(relinked_ids)
+            if self.has_search_index:
+                # The last item of each person is the one that was written
+                latest = dict((person_id, idx) for idx, person_id in sorted(person_ids.items()))
+                index_people(conn, [
+                    (person_id, items[idx]['person'],
+                     [tool_item['tool_name'] for tool_item in items[idx]['tools']])
+                    for person_id, idx in sorted(latest.items()) if person_id in written_ids
+                ])
             self.session.commit()
-            sys.stderr.write('.')
-        except IntegrityError:
-            logger.warn('"%s" is already in database.', person.name)
+        except Exception:
             self.session.rollback()
+            # The index may now refer to tools that were never written
+            self.tool_index = None
+            raise
+
+        for outcome in outcomes.values():
+            self.counts[outcome] += 1
+            self.metrics.inc('duplicate_people' if outcome == 'duplicate' else 'people_' + outcome)
+        return len(written_ids)
+
+    def upsert_people(self, conn, items):
+        """Insert the PersonItem components, one row at a time. People that
+        are already in the database (by article URL) are updated in place if
+        any of their columns changed, and left alone otherwise; people whose
+        name or image belong to someone else are skipped.
+        Return a (dictionary mapping the index of each item that wasn't
+        skipped to its person ID, dictionary mapping the index of each item to
+        'inserted', 'updated', 'unchanged' or 'duplicate', dictionary mapping
+        the ID of each person that was already in the database to their
+        previous pub_date) tuple.
+        """
+        people_rows = [dict((name, item['person'].get(name)) for name in PERSON_COLUMNS)
+                       for item in items]
+        current = self.current_people(conn, [row['article_url'] for row in people_rows])
+        pub_dates = dict((person_id, row['pub_date']) for person_id, row in current.values())
+
+        person_ids, outcomes = {}, {}
+        for idx, row in enumerate(people_rows):
+            result = conn.execute(UPSERT_PERSON, tuple(row[name] for name in PERSON_COLUMNS))
+            person_id, current_row = current.get(row['article_url'], (None, None))
+            if result.rowcount:
+                if person_id is None:
+                    person_id = result.lastrowid
+                    outcomes[idx] = 'inserted'
+                else:
+                    outcomes[idx] = 'updated'
+                    logger.info('"%s" changed; updating it.', row['name'])
+                current[row['article_url']] = (person_id, row)
+            elif person_id is not None and current_row == row:
+                outcomes[idx] = 'unchanged'
+            else:
+                outcomes[idx] = 'duplicate'
+                logger.warn('"%s" is already in database.', row['name'])
+                continue
+            person_ids[idx] = person_id
+        return person_ids, outcomes, pub_dates
+
+    def current_people(self, conn, urls):
+        """Return a dictionary mapping each of `urls` that is in the database
+        to a (person ID, dictionary of the person's columns) pair.
+        """
+        current = {}
+        for chunk in chunks(urls, MAX_VARIABLES):
+            rows = conn.execute(
+                'SELECT id, {0} FROM people WHERE article_url IN ({1})'
+                .format(', '.join(PERSON_COLUMNS), ', '.join('?' * len(chunk))),
+                chunk)
+            for row in rows:
+                current[row[1 + PERSON_COLUMNS.index('article_url')]] = \
+                    (row[0], dict(zip(PERSON_COLUMNS, row[1:])))
+        return current
+
+    def upsert_tools(self, conn, items, person_ids, pub_dates=None):
+        """Insert the ToolItem components of the written people that aren't in
+        the tool catalog yet, then bring each person's relations in line with
+        their tools: only the relations that were added or removed are
+        written, with one `executemany` call per statement. The tool counts
+        are updated with the differences, given the `pub_dates` that the
+        people had before the batch (see upsert_people()).
+        Return the set of the IDs of the people whose relations changed.
+        """
+        # The last item of each person wins
+        wanted = OrderedDict()
+        new_pub_dates = {}
+        tool_rows = []
+        for idx, person_id in sorted(person_ids.items()):
+            new_pub_dates[person_id] = items[idx]['person'].get('pub_date')
+            person_tool_ids = wanted[person_id] = set()
+            for tool_item in items[idx]['tools']:
+                tool_id, is_new = self.tool_index.resolve(tool_item)
+                if is_new:
+                    tool_rows.append(dict(tool_item, id=tool_id))
+                person_tool_ids.add(tool_id)
+
+        current = dict((person_id, set()) for person_id in wanted)
+        for chunk in chunks(list(wanted), MAX_VARIABLES):
+            rows = conn.execute(
+                'SELECT person_id, tool_id FROM people_to_tools WHERE person_id IN ({0})'
+                .format(', '.join('?' * len(chunk))), chunk)
+            for person_id, tool_id in rows:
+                current[person_id].add(tool_id)
+
+        added, removed = [], []
+        for person_id, tool_ids in wanted.items():
+            added.extend(dict(person_id=person_id, tool_id=tool_id)
+                         for tool_id in sorted(tool_ids - current[person_id]))
+            removed.extend(dict(person_id=person_id, tool_id=tool_id)
+                           for tool_id in sorted(current[person_id] - tool_ids))
+
+        if tool_rows:
+            conn.execute(Tool.__table__.insert(), tool_rows)
+        if removed:
+            relations = people_to_tools_tbl
+            conn.execute(relations.delete().where(
+                (relations.c.person_id == bindparam('person_id')) &
+                (relations.c.tool_id == bindparam('tool_id'))), removed)
+        if added:
+            conn.execute(people_to_tools_tbl.insert(), added)
+        if self.has_tool_stats and self.tool_stats:
+            self.count_tools(conn, wanted, current, pub_dates or {}, new_pub_dates)
+        return set(row['person_id'] for row in added + removed)
+
+    def count_tools(self, conn, wanted, current, old_pub_dates, new_pub_dates):
+        """Update the tool counts for the people whose tools or pub_date
+        changed: each is uncounted as they were, and counted as they are now.
+        """
+        delta = ToolStatsDelta()
+        for person_id, tool_ids in wanted.items():
+            old_pub_date = old_pub_dates.get(person_id)
+            new_pub_date = new_pub_dates[person_id]
+            if tool_ids == current[person_id] and old_pub_date == new_pub_date:
+                continue
+            if current[person_id]:
+                delta.remove_person(old_pub_date, current[person_id])
+            delta.add_person(new_pub_date, tool_ids)
+        delta.apply(conn)
+
+
+class JSONLinesPipeline(object):
+    def __init__(self, path, compression=None, fsync_interval=0, max_bytes=0):
+        """Stream every item to `path` as one JSON document per line (see
+        JSONLinesWriter for the options).
+        """
+        self.writer = JSONLinesWriter(path, compression=compression,
+                                      fsync_interval=fsync_interval,
+                                      max_bytes=max_bytes)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Read the output options from the crawler's settings.
+        Note: this gets called implicitly by scrapy.
+        """
+        settings = crawler.settings
+        # An output that can't be written is an error, not a reason to skip it
+        return cls(settings['JSONL_PATH'],
+                   compression=settings['JSONL_COMPRESSION'] or None,
+                   fsync_interval=settings.getfloat('JSONL_FSYNC_INTERVAL'),
+                   max_bytes=settings.getint('JSONL_MAX_SIZE'))
+
+    def close_spider(self, spider):
+        """Flush and close the output file.
+        Note: this gets called implicitly by scrapy.
+        """
+        self.writer.close()
+        logger.info('Wrote interviews to %s', ', '.join(self.writer.paths))
+
+    def process_item(self, item, spider):
+        """Write the item as a JSON line. Return the input item.
 
+        Arguments:
+            - item: dictionary {'person': PersonItem component,
+                                'tools': list of ToolItem components}
+            - spider: a spider instance (see scrapy docs)
+
+        Returns:
+            - item: dictionary {'person': PersonItem component,
+                                'tools': list of ToolItem components}
+        """
+        self.writer.write(dict(
+            person=dict(item['person']),
+            tools=[dict(tool_item) for tool_item in item['tools']],
+        ))
         return item
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""Profile a crawl with cProfile, and summarize where the time went: per
+package (our code, Scrapy, Twisted, lxml, everything else), then the top
+functions of our code and of the rest.
+
+cProfile doesn't see inside lxml's compiled functions: their time mostly
+counts as the internal time of whatever called them (e.g. Scrapy's selectors,
+or `split_sections()`).
+
+The dump can be explored further with `python -m pstats PATH` (or any tool
+that reads pstats files, e.g. snakeviz).
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+from collections import Counter
+
+
+# The packages the time is split between, in the order they are checked
+CODE_GROUPS = ('usesthis_crawler', 'scrapy', 'twisted', 'lxml')
+OTHER_GROUP = 'other'
+
+
+def code_group(func):
+    """Return the group of the function `func`, a pstats (filename, line
+    number, function name) key. Built-in functions (e.g. lxml's) have a
+    filename of '~', and name their module in the function name instead.
+    """
+    filename, _, name = func
+    if filename == '~':
+        parts = name.replace('.', ' ').replace("'", ' ').split()
+    else:
+        parts = filename.split(os.sep)
+    for group in CODE_GROUPS:
+        if group in parts:
+            return group
+    return OTHER_GROUP
+
+
+def profile_call(func, dump_path, top=20, output=None):
+    """Call `func` under cProfile, write the profile to `dump_path`, and
+    write a summary of it to `output` (by default, stderr). Return what
+    `func` returns.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        profiler.dump_stats(dump_path)
+        output = output or sys.stderr
+        for line in summary(pstats.Stats(dump_path), top):
+            output.write(line + '\n')
+        output.write('Profile written to {0}\n'.format(dump_path))
+
+
+def summary(stats, top=20):
+    """Return the lines of a summary of the pstats.Stats `stats`: the
+    internal time spent in each group of code, then the `top` functions of
+    our code by cumulative time, and the `top` other functions by internal
+    time.
+    """
+    group_times = Counter()
+    own_funcs, other_funcs = [], []
+    for func, (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        group = code_group(func)
+        group_times[group] += tottime
+        row = (func, ncalls, tottime, cumtime)
+        (own_funcs if group == CODE_GROUPS[0] else other_funcs).append(row)
+
+    total_time = sum(group_times.values()) or 1.0
+    lines = ['Internal time per package:']
+    for group, seconds in group_times.most_common():
+        lines.append('{0:>10.3f}s {1:>6.1%}  {2}'.format(seconds, seconds / total_time, group))
+
+    lines.append('Top {0} functions of {1}, by cumulative time:'.format(top, CODE_GROUPS[0]))
+    lines.extend(function_lines(sorted(own_funcs, key=lambda row: -row[3])[:top]))
+    lines.append('Top {0} other functions, by internal time:'.format(top))
+    lines.extend(function_lines(sorted(other_funcs, key=lambda row: -row[2])[:top]))
+    return lines
+
+
+def function_lines(rows):
+    lines = ['{0:>10} {1:>10} {2:>10}  function'.format('ncalls', 'tottime', 'cumtime')]
+    for func, ncalls, tottime, cumtime in rows:
+        lines.append('{0:>10} {1:>10.3f} {2:>10.3f}  {3}'.format(
+            ncalls, tottime, cumtime, pstats.func_std_string(func)))
+    return lines
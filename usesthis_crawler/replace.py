@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""Replace the contents of the database with the results of a crawl, without
+rebuilding it from scratch.
+
+During the crawl, the interviews that are new or that changed are staged in a
+separate SQLite file, attached to the database as `staging`, along with the
+URL of every interview seen. Once the crawl is done, the differences are
+applied to the database in a single transaction, so readers see either the
+old or the new contents, never a mix of both or a missing file. The staging
+file only grows with the number of changed interviews.
+
+A resumable crawl (see jobs.py) keeps the staging file when it is stopped
+early, and picks it up again when it is resumed, so that the interviews seen
+before the interruption aren't deleted once the crawl is done. Any other crawl
+starts with an empty staging file.
+"""
+
+import os
+from usesthis_crawler import logger
+from usesthis_crawler.aggregates import count_people, has_tool_stats
+from usesthis_crawler.models import Person
+from usesthis_crawler.search import has_search_index, reindex_people, unindex_people
+
+
+# The staging file lives next to the database, at its path plus this suffix
+STAGING_SUFFIX = '-replace'
+
+PERSON_COLUMNS = [column.name for column in Person.__table__.columns
+                  if column.name != 'id']
+NULLABLE_COLUMNS = set(column.name for column in Person.__table__.columns
+                       if column.nullable)
+
+STAGING_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS staging.seen (article_url VARCHAR PRIMARY KEY)',
+    'CREATE TABLE IF NOT EXISTS staging.people ({0}, PRIMARY KEY (article_url))'.format(
+        ', '.join('{0} VARCHAR{1}'.format(name, '' if name in NULLABLE_COLUMNS else ' NOT NULL')
+                  for name in PERSON_COLUMNS)),
+    'CREATE TABLE IF NOT EXISTS staging.people_tools ('
+    '    article_url VARCHAR NOT NULL, tool_name VARCHAR NOT NULL,'
+    '    tool_url VARCHAR NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS staging.ix_people_tools_article_url '
+    'ON people_tools (article_url)',
+    'CREATE INDEX IF NOT EXISTS staging.ix_people_name ON people (name)',
+    'CREATE INDEX IF NOT EXISTS staging.ix_people_img_src ON people (img_src)',
+]
+
+# SQLite's default limit on the number of "?" in a statement is 999
+MAX_VARIABLES = 500
+
+# The people that were staged, and the people that weren't seen by the crawl
+STAGED_IDS = ('SELECT id FROM people WHERE article_url IN '
+              '(SELECT article_url FROM staging.people)')
+UNSEEN_IDS = ('SELECT id FROM people WHERE article_url NOT IN '
+              '(SELECT article_url FROM staging.seen)')
+# The staged people who would take the name or picture of another person (as
+# UPSERT_PERSON in pipelines.py checks), or of a person staged before them
+CLASHING_PEOPLE = (
+    'SELECT s.article_url, s.name FROM staging.people s WHERE EXISTS ('
+    '    SELECT 1 FROM people other WHERE other.article_url != s.article_url'
+    '    AND (other.name = s.name OR other.img_src = s.img_src)'
+    ') OR EXISTS ('
+    '    SELECT 1 FROM staging.people other WHERE other.rowid < s.rowid'
+    '    AND (other.name = s.name OR other.img_src = s.img_src))')
+
+
+class ReplaceStage(object):
+    """Stage the new and changed interviews of a crawl next to the database
+    behind `engine`, then apply them (see the module docstring).
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.path = engine.url.database + STAGING_SUFFIX
+        self.conn = None
+
+    def open(self, keep=False):
+        """Create an empty staging file and attach it to the database. With
+        `keep`, the staging file of a previous crawl is reused instead.
+        """
+        if os.path.exists(self.path) and not keep:
+            os.remove(self.path)
+        # A connection of its own, since the staging file is attached to it
+        self.conn = self.engine.connect()
+        self.conn.execute('ATTACH DATABASE ? AS staging', (self.path,))
+        with self.conn.begin():
+            for statement in STAGING_SCHEMA:
+                self.conn.execute(statement)
+
+    def close(self, keep=False):
+        """Detach and delete the staging file (or only detach it, with
+        `keep`, for a later crawl to pick up).
+        """
+        if self.conn is None:
+            return
+        self.conn.execute('DETACH DATABASE staging')
+        self.conn.close()
+        self.conn = None
+        if not keep:
+            os.remove(self.path)
+
+    def stage(self, items):
+        """Record the article URLs of `items`, and stage the ones whose
+        PersonItem or ToolItem components differ from what's in the database.
+        Return the number of staged items.
+
+        Arguments:
+            - items: list of dictionaries {'person': PersonItem component,
+                                           'tools': list of ToolItem components}
+        """
+        urls = [item['person']['article_url'] for item in items]
+        current = self.current_interviews(urls)
+
+        people_rows, tool_rows = {}, []
+        for item in items:
+            person = dict((name, item['person'].get(name)) for name in PERSON_COLUMNS)
+            tools = set((tool_item['tool_name'], tool_item['tool_url'])
+                        for tool_item in item['tools'])
+            if current.get(person['article_url']) == (person, tools):
+                continue
+            people_rows[person['article_url']] = person
+            tool_rows.extend((person['article_url'], tool_name, tool_url)
+                             for tool_name, tool_url in tools)
+
+        with self.conn.begin():
+            self.conn.execute('INSERT OR IGNORE INTO staging.seen VALUES (?)',
+                              [(url,) for url in urls])
+            if not people_rows:
+                return 0
+            # An interview that was staged before is replaced, tools and all
+            for chunk in chunks(list(people_rows), MAX_VARIABLES):
+                self.conn.execute(
+                    'DELETE FROM staging.people_tools WHERE article_url IN ({0})'
+                    .format(', '.join('?' * len(chunk))), chunk)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO staging.people ({0}) VALUES ({1})'
+                .format(', '.join(PERSON_COLUMNS), ', '.join('?' * len(PERSON_COLUMNS))),
+                [tuple(person[name] for name in PERSON_COLUMNS)
+                 for person in people_rows.values()])
+            if tool_rows:
+                self.conn.execute('INSERT INTO staging.people_tools VALUES (?, ?, ?)',
+                                  tool_rows)
+        return len(people_rows)
+
+    def mark_seen(self, urls):
+        """Record that the crawl saw the interviews at `urls`, without staging
+        them (e.g. because their pages didn't change).
+        """
+        urls = list(urls)
+        if urls:
+            with self.conn.begin():
+                self.conn.execute('INSERT OR IGNORE INTO staging.seen VALUES (?)',
+                                  [(url,) for url in urls])
+
+    def current_interviews(self, urls):
+        """Return a dictionary mapping each of `urls` that is in the database
+        to a (person columns, set of (tool name, tool URL)) pair.
+        """
+        people, tools = {}, {}
+        for chunk in chunks(urls, MAX_VARIABLES):
+            rows = self.conn.execute(
+                'SELECT id, {0} FROM people WHERE article_url IN ({1})'
+                .format(', '.join(PERSON_COLUMNS), ', '.join('?' * len(chunk))),
+                chunk)
+            for row in rows:
+                people[row[0]] = dict(zip(PERSON_COLUMNS, row[1:]))
+                tools[row[0]] = set()
+
+        person_ids = list(people)
+        for chunk in chunks(person_ids, MAX_VARIABLES):
+            rows = self.conn.execute(
+                'SELECT pt.person_id, t.tool_name, t.tool_url '
+                'FROM people_to_tools pt JOIN tools t ON t.id = pt.tool_id '
+                'WHERE pt.person_id IN ({0})'.format(', '.join('?' * len(chunk))),
+                chunk)
+            for person_id, tool_name, tool_url in rows:
+                tools[person_id].add((tool_name, tool_url))
+
+        return dict((person['article_url'], (person, tools[person_id]))
+                    for person_id, person in people.items())
+
+    def apply(self, complete=True):
+        """Apply the staged interviews to the database, in one transaction.
+        If the crawl was `complete`, the interviews that it didn't see are
+        deleted; otherwise (e.g. it was interrupted), they are kept.
+        Return a (number of new or changed, number of deleted) pair.
+        """
+        conn = self.conn
+        with conn.begin():
+            search_index = has_search_index(conn)
+            tool_stats = has_tool_stats(conn)
+            n_deleted = 0
+            if complete:
+                n_deleted = conn.execute(
+                    'SELECT count(*) FROM ({0})'.format(UNSEEN_IDS)).scalar()
+                if search_index:
+                    unindex_people(conn, UNSEEN_IDS)
+                if tool_stats:
+                    count_people(conn, UNSEEN_IDS, sign=-1)
+                conn.execute('DELETE FROM people_to_tools WHERE person_id IN ({0})'
+                             .format(UNSEEN_IDS))
+                conn.execute('DELETE FROM people WHERE id IN ({0})'.format(UNSEEN_IDS))
+
+            self.skip_clashing_people(conn)
+
+            # Changed interviews are updated in place, so they keep their IDs
+            if tool_stats:
+                count_people(conn, STAGED_IDS, sign=-1)
+            conn.execute('DELETE FROM people_to_tools WHERE person_id IN ({0})'
+                         .format(STAGED_IDS))
+            conn.execute(
+                'UPDATE people SET ({0}) = (SELECT {0} FROM staging.people s '
+                '                           WHERE s.article_url = people.article_url) '
+                'WHERE article_url IN (SELECT article_url FROM staging.people)'
+                .format(', '.join(PERSON_COLUMNS)))
+            conn.execute('INSERT OR IGNORE INTO people ({0}) SELECT {0} FROM staging.people'
+                         .format(', '.join(PERSON_COLUMNS)))
+
+            conn.execute('INSERT OR IGNORE INTO tools (tool_name, tool_url) '
+                         'SELECT DISTINCT tool_name, tool_url FROM staging.people_tools')
+            conn.execute(
+                'INSERT OR IGNORE INTO people_to_tools (person_id, tool_id) '
+                'SELECT p.id, t.id FROM staging.people_tools s '
+                'JOIN people p ON p.article_url = s.article_url '
+                'JOIN tools t ON t.tool_name = s.tool_name AND t.tool_url = s.tool_url')
+            conn.execute('DELETE FROM tools WHERE id NOT IN '
+                         '(SELECT tool_id FROM people_to_tools)')
+
+            if search_index:
+                reindex_people(conn, STAGED_IDS)
+            if tool_stats:
+                count_people(conn, STAGED_IDS)
+            n_staged = conn.execute('SELECT count(*) FROM staging.people').scalar()
+
+        logger.info('Database replaced: %d new or changed interviews, %d deleted.',
+                    n_staged, n_deleted)
+        return n_staged, n_deleted
+
+    def skip_clashing_people(self, conn):
+        """Unstage the people who can't be written because of the unique
+        names and pictures. (Those who are in the database keep their
+        current row.)
+        """
+        clashing = conn.execute(CLASHING_PEOPLE).fetchall()
+        for article_url, name in clashing:
+            logger.warn('"%s" is already in database.', name)
+        if clashing:
+            urls = [(article_url,) for article_url, name in clashing]
+            for table in ('people', 'people_tools'):
+                conn.execute('DELETE FROM staging.{0} WHERE article_url = ?'.format(table), urls)
+
+
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""Full-text search over the interviews, with an SQLite FTS5 index.
+
+The `people_search` table has one row per person (its rowid is the person's
+ID), indexing the interview prose and the names of the person's tools.
+"""
+
+from collections import namedtuple
+from usesthis_crawler import logger
+
+
+SEARCH_TABLE = 'people_search'
+SEARCH_COLUMNS = ('bio', 'hardware', 'software', 'dream', 'tools')
+
+SearchHit = namedtuple('SearchHit', 'person_id name article_url score snippet')
+
+
+def fts5_available(conn):
+    """Return whether the SQLite library behind `conn` was built with FTS5."""
+    options = set(row[0] for row in conn.execute('PRAGMA compile_options'))
+    return 'ENABLE_FTS5' in options
+
+
+def has_search_index(conn):
+    return conn.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (SEARCH_TABLE,)
+    ).scalar() > 0
+
+
+def create_search_index(engine):
+    """Create the search index if it doesn't exist yet, filling it with every
+    interview already in the database. Return whether the index is available
+    (it isn't if SQLite was built without FTS5).
+    """
+    with engine.begin() as conn:
+        if has_search_index(conn):
+            return True
+        if not fts5_available(conn):
+            logger.warn('SQLite was built without FTS5: the search index is disabled.')
+            return False
+
+        conn.execute(
+            'CREATE VIRTUAL TABLE {0} USING fts5({1}, tokenize="porter unicode61")'
+            .format(SEARCH_TABLE, ', '.join(SEARCH_COLUMNS))
+        )
+        reindex_people(conn)
+    return True
+
+
+def reindex_people(conn, person_ids_query=None):
+    """Rebuild the search index rows of the people whose IDs are selected by
+    the SQL `person_ids_query` (of every person, by default) from the
+    `people` and `tools` tables.
+    """
+    where = ''
+    if person_ids_query is not None:
+        unindex_people(conn, person_ids_query)
+        where = 'WHERE p.id IN ({0})'.format(person_ids_query)
+    conn.execute(
+        'INSERT INTO {0} (rowid, {1}) '
+        'SELECT p.id, p.bio, p.hardware, p.software, p.dream, '
+        "       coalesce((SELECT group_concat(t.tool_name, ' ') "
+        '                 FROM people_to_tools pt JOIN tools t ON t.id = pt.tool_id '
+        "                 WHERE pt.person_id = p.id), '') "
+        'FROM people p {2}'.format(SEARCH_TABLE, ', '.join(SEARCH_COLUMNS), where)
+    )
+
+
+def unindex_people(conn, person_ids_query):
+    conn.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(SEARCH_TABLE, person_ids_query))
+
+
+def index_people(conn, rows):
+    """Add (or update) the search index rows of some people, within the
+    caller's transaction.
+
+    Arguments:
+        - conn: SQLAlchemy connection
+        - rows: list of (person ID, PersonItem component, tool names) tuples
+    """
+    if not rows:
+        return
+    conn.execute(
+        'INSERT OR REPLACE INTO {0} (rowid, {1}) VALUES (?, ?, ?, ?, ?, ?)'
+        .format(SEARCH_TABLE, ', '.join(SEARCH_COLUMNS)),
+        [(person_id, person['bio'], person['hardware'], person['software'],
+          person['dream'], u' '.join(tool_names))
+         for person_id, person, tool_names in rows]
+    )
+
+
+def search(conn, query, limit=10):
+    """Return the best `limit` matches of the FTS5 `query` (e.g. 'vim',
+    'hardware:thinkpad', '"mechanical keyboard" NOT apple'), best first, as
+    SearchHit tuples. Lower scores are better matches.
+    """
+    return [SearchHit(*row) for row in conn.execute(
+        'SELECT p.id, p.name, p.article_url, s.rank, '
+        "       snippet({0}, -1, '[', ']', '...', 12) "
+        'FROM {0} s JOIN people p ON p.id = s.rowid '
+        'WHERE {0} MATCH ? ORDER BY s.rank LIMIT ?'.format(SEARCH_TABLE),
+        (query, limit)
+    )]
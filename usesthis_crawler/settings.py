@@ -17,17 +17,95 @@ NEWSPIDER_MODULE = 'usesthis_crawler.spiders'
 #USER_AGENT = 'interviews (+http://www.yourdomain.com)'
 
 DB_PATH = 'interviews.db'
+# SQLite performance profile: 'safe', 'fast' or 'bulk-load' (see models.py)
+DB_PROFILE = 'safe'
+# Number of interviews (or milliseconds' worth of interviews) that SQLPipeline
+# buffers before writing them to the database in one transaction
+DB_BATCH_SIZE = 100
+DB_FLUSH_INTERVAL = 2000
+# Write to the database from a dedicated thread instead of the reactor's, with
+# up to DB_WRITE_QUEUE_SIZE batches waiting for it (see writer.py)
+DB_ASYNC_WRITES = True
+DB_WRITE_QUEUE_SIZE = 4
+# Replace the contents of the database with the results of the crawl, in one
+# transaction at the end of the crawl, instead of adding to them
+DB_REPLACE = False
+# Keep the full-text search index (see search.py) in sync with the database
+SEARCH_INDEX = True
+# Keep the tool popularity and co-occurrence counts (see aggregates.py) in sync
+# with every batch, which makes writing the database about 5 times slower.
+# Without it, a database that has the counts gets them rebuilt once the crawl
+# is done.
+TOOL_STATS = False
+
+# Keep the state of the crawl in this directory, so that a crawl that gets
+# stopped can be resumed (see jobs.py); '' for none
+JOBDIR = ''
+# Whether the crawl in JOBDIR carries on from a crawl that was stopped (set by
+# the command-line, once it has looked at JOBDIR)
+JOB_RESUMED = False
+
+# Skip interviews that are already in the database, and stop crawling at the
+# first listing page that doesn't have any new interviews
+INCREMENTAL_CRAWL = False
+
+# Request the interviews listing pages concurrently instead of one "next"
+# link at a time. If LISTING_PAGE_COUNT is 0, the count is read from the
+# pagination links, or else LISTING_PAGE_WINDOW pages are requested ahead
+PARALLEL_LISTING = False
+LISTING_PAGE_COUNT = 0
+LISTING_PAGE_WINDOW = 16
+
+# Read tool links straight from the page instead of with an ItemLoader per link
+FAST_TOOL_EXTRACTION = True
+# Don't parse the interviews whose pages didn't change since they were stored
+# (when the database is in use)
+SKIP_UNCHANGED = True
+# Number of worker processes that parse the interviews (0 to parse them on the
+# reactor's thread)
+PARSE_WORKERS = 0
+# Validate items with precompiled checks instead of urlparse/strptime
+FAST_VALIDATION = True
+# Number of validation warnings output per category (e.g. "missing_bio"); the
+# rest are only counted, and summarized at the end of the crawl
+VALIDATION_LOG_SAMPLES = 5
+
+# On-disk HTTP cache that revalidates every cached page with a conditional
+# request, evicting the least-recently used pages beyond HTTPCACHE_MAX_SIZE bytes
+HTTPCACHE_ENABLED = False
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_POLICY = 'usesthis_crawler.httpcache.RevalidatingPolicy'
+HTTPCACHE_STORAGE = 'usesthis_crawler.httpcache.SQLiteCacheStorage'
+HTTPCACHE_MAX_SIZE = 100 * 1024 * 1024
 
 LOG_ENABLED = True
 LOG_LEVEL = 'ERROR'
 ITEM_PIPELINES = {
     'usesthis_crawler.pipelines.ValidationPipeline': 400,
     'usesthis_crawler.pipelines.SQLPipeline': 500,
+    'usesthis_crawler.pipelines.JSONLinesPipeline': None,
 }
 
+# JSONLinesPipeline output: compression is '', 'gzip' or 'zstd'; the file is
+# fsync'ed every JSONL_FSYNC_INTERVAL seconds, and rotated every
+# JSONL_MAX_SIZE bytes (if non-zero)
+JSONL_PATH = 'interviews.jsonl'
+JSONL_COMPRESSION = ''
+JSONL_FSYNC_INTERVAL = 5
+JSONL_MAX_SIZE = 0
+
 EXTENSIONS = {
     'scrapy.extensions.closespider.CloseSpider': 500,
+    'usesthis_crawler.metrics.MetricsExtension': 500,
+    'usesthis_crawler.jobs.JobCleanup': 500,
 }
 
+# Crawl metrics (see metrics.py), enabled by setting either path: a JSON report
+# written at the end of the crawl, and a Prometheus text file rewritten every
+# METRICS_SNAPSHOT_INTERVAL seconds
+METRICS_REPORT_PATH = ''
+METRICS_SNAPSHOT_PATH = ''
+METRICS_SNAPSHOT_INTERVAL = 10
+
 CLOSESPIDER_PAGECOUNT = 0
 CLOSESPIDER_ERRORCOUNT = 1
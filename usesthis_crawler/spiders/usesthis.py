@@ -1,13 +1,37 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import urlparse
 import scrapy
 import re
+import time
+from scrapy import signals
+from usesthis_crawler import Session, logger
 from usesthis_crawler.items import PersonItem, ToolItem
+from usesthis_crawler.jobs import read_commit_log
+from usesthis_crawler.metrics import NULL_METRICS, crawler_metrics
+from usesthis_crawler.workers import ParsePool
+from usesthis_crawler.models import Person
 from scrapy.loader import ItemLoader
 from scrapy.loader.processors import Join, TakeFirst, Identity
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
+from lxml import etree
+
+
+# The string-value of an element: all of its descendant text, in order
+text_content = etree.XPath('string()')
+
+# The parts of an interview page that the spider extracts anything from
+ARTICLE_PARTS_CSS = ('h3.p-name, time.dt-published, p.summary.p-summary, '
+                     'img.portrait, div.e-content')
+# Bump this when the extraction changes, so that every interview is re-parsed
+ARTICLE_HASH_VERSION = '1'
+WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+TAG_SPACING_RE = re.compile(r' ?(<[^>]*>) ?')
+
+# The page number at the end of a listing page's URL (e.g. /interviews/page/2/)
+PAGE_NUMBER_RE = re.compile(r'(\d+)/?$')
 
 
 class UsesthisSpider(CrawlSpider):
@@ -15,19 +39,229 @@ class UsesthisSpider(CrawlSpider):
     Starting at http://usesthis.com/interviews, parse each interview article
     into a PersonItem (each containing a list of ToolsItems).
     If possible, navigate the "next" link and repeat the process.
+
+    In incremental mode, interviews that are already in the database aren't
+    requested, and the crawl stops at the first listing page that only
+    contains interviews that are already in the database.
+
+    In parallel-listing mode, the listing pages after the "next" link are
+    requested up front instead of one at a time: all of them, if the number of
+    pages is known (from the LISTING_PAGE_COUNT setting, or from the page's
+    pagination links), or else a window of LISTING_PAGE_WINDOW pages ahead of
+    every listing page that is parsed. Pages past the end are 404s, which are
+    ignored. Incremental mode takes precedence over parallel-listing mode.
+
+    With PARSE_WORKERS set, the interviews are parsed by that many worker
+    processes, instead of on the reactor's thread (see workers.py).
+
+    The pages of the interviews are hashed (see `article_hash()`) only when
+    the SQLPipeline is enabled, to be stored along with them. With
+    SKIP_UNCHANGED set, interviews whose pages hash the same as when they
+    were stored aren't parsed again, and yield nothing; their URLs are kept
+    in `unchanged_article_urls`.
+
+    With a JOBDIR, the interviews in the job's commit log (written before the
+    crawl was stopped, see jobs.py) aren't requested again.
     """
     rules = (
         Rule(LinkExtractor(restrict_css='article.interviewee.h-card.vcard a.p-name'), callback='parse_article'),
         Rule(LinkExtractor(restrict_css='a#next')),
     )
+    article_rule, next_rule = 0, 1
+
+    incremental = False
+    known_article_urls = frozenset()
+    fast_tool_extraction = True
+
+    hash_articles = True
+    skip_unchanged = False
+    known_content_hashes = {}
+
+    parallel_listing = False
+    listing_page_count = 0
+    listing_page_window = 16
+    last_listing_page = 1
+
+    committed_article_urls = frozenset()
+
+    metrics = NULL_METRICS
+    parse_pool = None
+
+    def __init__(self, *args, **kwargs):
+        super(UsesthisSpider, self).__init__(*args, **kwargs)
+        self.unchanged_article_urls = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(UsesthisSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.incremental = crawler.settings.getbool('INCREMENTAL_CRAWL')
+        spider.fast_tool_extraction = crawler.settings.getbool('FAST_TOOL_EXTRACTION', True)
+        # Only the database keeps the hashes
+        spider.hash_articles = crawler.settings.getdict('ITEM_PIPELINES').get(
+            'usesthis_crawler.pipelines.SQLPipeline') is not None
+        spider.skip_unchanged = crawler.settings.getbool('SKIP_UNCHANGED')
+        spider.parallel_listing = crawler.settings.getbool('PARALLEL_LISTING')
+        spider.listing_page_count = crawler.settings.getint('LISTING_PAGE_COUNT')
+        spider.listing_page_window = crawler.settings.getint('LISTING_PAGE_WINDOW', 16)
+        spider.metrics = crawler_metrics(crawler)
+        job_dir = crawler.settings.get('JOBDIR')
+        if job_dir:
+            spider.committed_article_urls = frozenset(read_commit_log(job_dir))
+            if spider.committed_article_urls:
+                logger.info('%d interviews were committed before the crawl was stopped.',
+                            len(spider.committed_article_urls))
+        parse_workers = crawler.settings.getint('PARSE_WORKERS')
+        if parse_workers:
+            spider.parse_pool = ParsePool(parse_workers, spider.fast_tool_extraction,
+                                          spider.hash_articles)
+            crawler.signals.connect(spider.close_parse_pool, signal=signals.spider_closed)
+        return spider
+
+    def close_parse_pool(self, spider, reason):
+        self.parse_pool.close()
+
+    def start_requests(self):
+        if self.incremental or self.skip_unchanged:
+            session = Session()
+            try:
+                rows = session.query(Person.article_url, Person.content_hash).all()
+            finally:
+                session.close()
+            if self.incremental:
+                self.known_article_urls = frozenset(url for url, _ in rows)
+                logger.info('%d interviews are already in the database.',
+                            len(self.known_article_urls))
+            if self.skip_unchanged:
+                self.known_content_hashes = dict(
+                    (url, content_hash) for url, content_hash in rows if content_hash)
+        return super(UsesthisSpider, self).start_requests()
+
+    def make_requests_from_url(self, url):
+        # Unlike Scrapy's default, the start URL goes through the duplicate
+        # filter, so that a resumed crawl doesn't request it again
+        return scrapy.Request(url)
+
+    def _response_downloaded(self, response):
+        # The Deferred's result is processed like the callback's output
+        if self.parse_pool is not None and response.meta['rule'] == self.article_rule:
+            return self.parse_in_worker(response)
+        return super(UsesthisSpider, self)._response_downloaded(response)
+
+    def parse_in_worker(self, response):
+        """Return a Deferred that fires with a list of the interview's item
+        (empty if it didn't change), once a worker process has hashed it (if
+        need be), and parsed it if need be.
+        """
+        started = time.time()
+        def parsed(result):
+            content_hash, item = result
+            if self.is_unchanged(response.url, content_hash):
+                return []
+            self.metrics.observe('parse_article', time.time() - started)
+            if content_hash is not None:
+                item['person']['content_hash'] = content_hash
+            return [item]
+        known_hash = self.known_content_hashes.get(response.url)
+        return self.parse_pool.parse(response, known_hash).addCallback(parsed)
+
+    def is_unchanged(self, url, content_hash):
+        """Return whether the interview at `url` was stored with the same
+        `content_hash`, recording it in `unchanged_article_urls` if so.
+        """
+        if content_hash is None or self.known_content_hashes.get(url) != content_hash:
+            return False
+        self.unchanged_article_urls.add(url)
+        self.metrics.inc('unchanged_articles')
+        return True
+
+    def _requests_to_follow(self, response):
+        requests = super(UsesthisSpider, self)._requests_to_follow(response)
+        if self.committed_article_urls:
+            requests = [request for request in requests
+                        if request.url not in self.committed_article_urls]
+        if self.incremental:
+            return self.skip_known_articles(response, list(requests))
+        if self.parallel_listing:
+            requests = list(requests)
+            return requests + self.listing_page_requests(response, requests)
+        return requests
+
+    def listing_page_requests(self, response, requests):
+        """Return requests for the listing pages after the "next" page that
+        haven't been requested yet. The page URLs are made by replacing the
+        page number at the end of the "next" link's URL.
+        """
+        next_urls = [request.url for request in requests
+                     if request.meta['rule'] == self.next_rule]
+        if not next_urls:
+            return []
+
+        match = PAGE_NUMBER_RE.search(next_urls[0])
+        if not match:
+            return []
+        next_page = int(match.group(1))
+        url_template = next_urls[0][:match.start(1)] + '{0}' + next_urls[0][match.end(1):]
+
+        last_page = self.listing_page_count or self.last_linked_page(response, url_template)
+        if last_page <= next_page:
+            last_page = next_page + self.listing_page_window
+
+        first_page = max(next_page, self.last_listing_page) + 1
+        self.last_listing_page = max(self.last_listing_page, last_page)
+        listing_requests = []
+        for page in range(first_page, last_page + 1):
+            request = scrapy.Request(url_template.format(page),
+                                     callback=self._response_downloaded)
+            request.meta.update(rule=self.next_rule, link_text='')
+            listing_requests.append(request)
+        return listing_requests
+
+    def last_linked_page(self, response, url_template):
+        """Return the highest page number that the page's links point to."""
+        page_url_re = re.compile(
+            '^' + re.escape(url_template).replace(re.escape('{0}'), r'(\d+)') + '$'
+        )
+        pages = [0]
+        for href in response.xpath('//a/@href').extract():
+            match = page_url_re.match(urlparse.urljoin(response.url, href))
+            if match:
+                pages.append(int(match.group(1)))
+        return max(pages)
+
+    def skip_known_articles(self, response, requests):
+        """Drop the requests for interviews that are already in the database.
+        If every interview on the page is already in the database, drop the
+        request for the next page, too.
+        """
+        article_urls = [request.url for request in requests
+                        if request.meta['rule'] == self.article_rule]
+        if article_urls and self.known_article_urls.issuperset(article_urls):
+            logger.info('Every interview at %s is already in the database; stopping.',
+                        response.url)
+            return []
+        return [request for request in requests
+                if request.url not in self.known_article_urls]
 
     def parse_article(self, response):
+        content_hash = article_hash(response) if self.hash_articles else None
+        if self.is_unchanged(response.url, content_hash):
+            return
+        with self.metrics.timer('parse_article'):
+            item = self.load_article(response)
+        if content_hash is not None:
+            item['person']['content_hash'] = content_hash
+        yield item
+
+    def load_article(self, response):
+        """Return the interview as a dictionary {'person': PersonItem,
+        'tools': list of ToolItems}.
+        """
         # Initialize some I/O processors
         join_all = Join('')
         take_first = TakeFirst()
         identity = Identity()
         prepend_url = PrependResponseUrl(response.url)
-        strip_all, strip_one = StripAll(), StripOne()
+        strip_all = StripAll()
         add_space_after_punct = AddSpaceAfterPunct()
 
         # Load PersonItem
@@ -38,10 +272,11 @@ class UsesthisSpider(CrawlSpider):
         person_loader.add_css('pub_date', 'time.dt-published::attr(datetime)')
         person_loader.add_css('title', 'p.summary.p-summary::text', strip_all)
         person_loader.add_css('img_src', 'img.portrait::attr(src)', prepend_url)
-        person_loader.add_xpath('bio', '//div[@class="e-content"]/p[count(preceding-sibling::h4)=1]/descendant-or-self::*/text()', join_all, add_space_after_punct)
-        person_loader.add_xpath('hardware', '//div[@class="e-content"]/p[count(preceding-sibling::h4)=2]/descendant-or-self::*/text()', join_all, add_space_after_punct)
-        person_loader.add_xpath('software', '//div[@class="e-content"]/p[count(preceding-sibling::h4)=3]/descendant-or-self::*/text()', join_all, add_space_after_punct)
-        person_loader.add_xpath('dream', '//div[@class="e-content"]/p[count(preceding-sibling::h4)=4]/descendant-or-self::*/text()', join_all, add_space_after_punct)
+        bio, hardware, software, dream = split_sections(response, 4)
+        person_loader.add_value('bio', bio, join_all, add_space_after_punct)
+        person_loader.add_value('hardware', hardware, join_all, add_space_after_punct)
+        person_loader.add_value('software', software, join_all, add_space_after_punct)
+        person_loader.add_value('dream', dream, join_all, add_space_after_punct)
         person_item = person_loader.load_item()
 
         # @gbrener 8/16/2015: The following line causes a NotImplementedError
@@ -49,6 +284,22 @@ class UsesthisSpider(CrawlSpider):
         person_item.fill_empty_fields()
 
         # Load a list of ToolItems
+        if self.fast_tool_extraction:
+            tool_items = extract_tool_items(response)
+        else:
+            tool_items = self.load_tool_items(response)
+
+        return dict(person=person_item, tools=tool_items)
+
+    def load_tool_items(self, response):
+        """Return a ToolItem for each link in the interview, built with one
+        ItemLoader per link. Slower than `extract_tool_items()`, but with the
+        same output.
+        """
+        join_all = Join('')
+        take_first = TakeFirst()
+        strip_one = StripOne()
+
         tool_items = []
         for tool_selector in response.css('div.e-content p a'):
             tool_loader = ItemLoader(item=ToolItem(), selector=tool_selector, response=response)
@@ -63,7 +314,57 @@ class UsesthisSpider(CrawlSpider):
 
             tool_items.append(tool_item)
 
-        yield dict(person=person_item, tools=tool_items)
+        return tool_items
+
+
+def article_hash(response):
+    """Return a hash of the parts of the interview page that the spider
+    extracts anything from (its header, and its e-content div), serialized,
+    with runs of whitespace collapsed, and dropped around tags. The rest of
+    the page (navigation, etc.) doesn't count.
+    """
+    digest = hashlib.sha1(ARTICLE_HASH_VERSION)
+    for part in response.css(ARTICLE_PARTS_CSS):
+        html = etree.tostring(part._root, method='html', encoding=unicode, with_tail=False)
+        html = TAG_SPACING_RE.sub(ur'\1', WHITESPACE_RE.sub(u' ', html))
+        digest.update(html.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def extract_tool_items(response):
+    """Return a ToolItem for each link in the interview. All of the links are
+    selected at once, and each one's text and URL are read straight from its
+    lxml element.
+    """
+    tool_items = []
+    for anchor in response.css('div.e-content p a'):
+        element = anchor._root
+        tool_items.append(ToolItem(
+            tool_name=unicode(text_content(element)).strip(),
+            tool_url=element.get('href') or '',
+        ))
+    return tool_items
+
+
+def split_sections(response, n_sections):
+    """Return the text of the paragraphs after each of the first `n_sections`
+    h4 headings of the interview's "e-content" div, as `n_sections` lists of
+    text nodes. This is one pass over the div, instead of one pass per
+    section with `p[count(preceding-sibling::h4)=k]` (which is quadratic).
+    """
+    sections = [[] for _ in range(n_sections + 1)]
+    for content in response.xpath('//div[@class="e-content"]'):
+        section = 0
+        # Walk the div's lxml element directly; one Selector per text node
+        # (or an XPath union, which libxml2 merges quadratically) is far slower
+        for child in content._root.iterchildren('h4', 'p'):
+            if child.tag == 'h4':
+                section += 1
+            elif 0 < section <= n_sections:
+                sections[section].extend(
+                    unicode(text) for text in child.xpath('descendant-or-self::*/text()')
+                )
+    return sections[1:]
 
 
 class PrependResponseUrl(object):
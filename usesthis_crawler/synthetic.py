@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Generate synthetic usesthis.com pages, with the same markup classes as the
+real site, for benchmarks and offline tests.
+"""
+
+SECTION_TITLES = (
+    u'Who are you, and what do you do?',
+    u'What hardware do you use?',
+    u'And what software?',
+    u'What would be your dream setup?',
+)
+
+
+def make_slug(idx):
+    """Return the URL slug of the `idx`-th synthetic interviewee."""
+    return u'interviewee.{0}'.format(idx)
+
+
+def make_paragraph(section, idx, n_links):
+    links = u' '.join(
+        u'<a href="https://tools.example.com/{0}/{1}/{2}">Tool {0}.{1}.{2}</a>'.format(section, idx, link_idx)
+        for link_idx in range(n_links)
+    )
+    return (u'<p>Paragraph {idx} of section {section}.It uses <em>some</em> '
+            u'tools: {links}.</p>').format(idx=idx, section=section, links=links)
+
+
+def make_article(slug, n_paragraphs=3, n_links=2):
+    """Return the HTML of an interview with `n_paragraphs` paragraphs in each
+    of its four sections, and `n_links` tool links in each paragraph.
+    """
+    name = slug.replace('.', ' ').title()
+    sections = []
+    for section, heading in enumerate(SECTION_TITLES, start=1):
+        sections.append(u'<h4>{0}</h4>'.format(heading))
+        sections.extend(make_paragraph(section, idx, n_links)
+                        for idx in range(n_paragraphs))
+
+    return u'''<html><body>
+<article class="h-entry">
+<header>
+<img class="portrait" src="/images/portraits/{slug}.jpg" alt="{name}">
+<h3 class="p-name">{name}</h3>
+<p class="summary p-summary">Synthetic interviewee</p>
+<time class="dt-published" datetime="2015-08-16">August 16, 2015</time>
+</header>
+<div class="e-content">
+{sections}
+</div>
+</article>
+</body></html>'''.format(slug=slug, name=name, sections=u'\n'.join(sections))
+
+
+def make_listing_page(slugs, next_url=None):
+    """Return the HTML of an interviews listing page that links to the
+    interviews in `slugs` (and to `next_url`, if there is a next page).
+    """
+    interviews = u'\n'.join(
+        u'<article class="interviewee h-card vcard">'
+        u'<a class="p-name u-url" href="/interviews/{0}/">{1}</a>'
+        u'</article>'.format(slug, slug.replace('.', ' ').title())
+        for slug in slugs
+    )
+    next_link = u''
+    if next_url:
+        next_link = u'<a id="next" href="{0}">Next page</a>'.format(next_url)
+
+    return u'''<html><body>
+<section class="interviews">
+{interviews}
+</section>
+<nav>{next_link}</nav>
+</body></html>'''.format(interviews=interviews, next_link=next_link)
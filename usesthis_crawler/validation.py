@@ -1,6 +1,8 @@
+import re
 import urlparse
-from usesthis_crawler import logger
-from datetime import datetime
+from usesthis_crawler.diagnostics import validation_logger as logger
+from usesthis_crawler.items import required_fields
+from datetime import date, datetime
 
 
 class ItemValidationError(Exception):
@@ -30,7 +32,7 @@ def is_valid_date(possible_datestr):
 
 
 def missing_item_fields(item):
-    return sorted(list(set(type(item).fields) - set(item)))
+    return sorted(list(set(required_fields(type(item))) - set(item)))
 
 
 def validate_person_item(item, verbose=False):
@@ -59,40 +61,40 @@ def validate_person_item(item, verbose=False):
         raise ItemValidationError(err_msg)
 
     if not item['bio']:
-        logger.warn('%s (%s) doesn\'t have a bio.', name, article_url)
+        logger.warn('%s (%s) doesn\'t have a bio.', name, article_url, extra=dict(category='missing_bio'))
 
     if not item['hardware']:
-        logger.warn('%s (%s) doesn\'t have a hardware section.', name, article_url)
+        logger.warn('%s (%s) doesn\'t have a hardware section.', name, article_url, extra=dict(category='missing_hardware'))
 
     if not item['software']:
-        logger.warn('%s (%s) doesn\'t have a software section.', name, article_url)
+        logger.warn('%s (%s) doesn\'t have a software section.', name, article_url, extra=dict(category='missing_software'))
 
     if not item['dream']:
-        logger.warn('%s (%s) doesn\'t have a dream-setup section.', name, article_url)
+        logger.warn('%s (%s) doesn\'t have a dream-setup section.', name, article_url, extra=dict(category='missing_dream'))
 
 
 def is_valid_tool(tool, name, article_url, verbose):
     missing_fields = missing_item_fields(tool)
     if missing_fields:
         if verbose:
-            logger.error('%s (%s) uses a tool that is missing fields %s. Skipping tool...', name, article_url, str(missing_fields))
+            logger.error('%s (%s) uses a tool that is missing fields %s. Skipping tool...', name, article_url, str(missing_fields), extra=dict(category='tool_missing_fields'))
         else:
-            logger.error('Found tool (at %s) that is missing one or more fields. Skipping...', article_url)
+            logger.error('Found tool (at %s) that is missing one or more fields. Skipping...', article_url, extra=dict(category='tool_missing_fields'))
         return False
 
     if not tool['tool_name']:
         if verbose:
-            logger.error('%s (%s) uses a tool that doesn\'t have a name. Skipping tool...', name, article_url)
+            logger.error('%s (%s) uses a tool that doesn\'t have a name. Skipping tool...', name, article_url, extra=dict(category='tool_missing_name'))
         else:
-            logger.error('Found tool (at %s) that doesn\'t have a name. Skipping...', article_url)
+            logger.error('Found tool (at %s) that doesn\'t have a name. Skipping...', article_url, extra=dict(category='tool_missing_name'))
         return False
 
     tool_name, tool_url = tool['tool_name'], tool['tool_url']
     if not is_valid_url(tool_url):
         if verbose:
-            logger.error('%s (%s) uses a tool "%s" (%s) that doesn\'t have a valid URL. Skipping tool...', name, article_url, tool_name, tool_url)
+            logger.error('%s (%s) uses a tool "%s" (%s) that doesn\'t have a valid URL. Skipping tool...', name, article_url, tool_name, tool_url, extra=dict(category='tool_invalid_url'))
         else:
-            logger.error('Found tool (%s) that doesn\'t have a valid URL. Skipping...', tool_name)
+            logger.error('Found tool (%s) that doesn\'t have a valid URL. Skipping...', tool_name, extra=dict(category='tool_invalid_url'))
         return False
 
     return True
@@ -103,11 +105,170 @@ def validate_tool_items(items, person_item, verbose=False):
     article_url = person_item['article_url']
 
     if not items:
-        logger.warn('%s (%s) doesn\'t use any tools.', name, article_url)
+        logger.warn('%s (%s) doesn\'t use any tools.', name, article_url, extra=dict(category='no_tools'))
         return
 
     # Replace the contents of `items` list with only the items that are valid
     items[:] = [item for item in items if is_valid_tool(item, name, article_url, verbose)]
 
     if not items:
-        logger.warn('%s doesn\'t use any tools that have valid URLs.', name)
+        logger.warn('%s doesn\'t use any tools that have valid URLs.', name, extra=dict(category='no_valid_tools'))
+
+
+# Precompiled equivalents of the checks above, for the fast validation path.
+# `urlparse` lower-cases the scheme, and takes the netloc to run up to the
+# first "/", "?" or "#". The image path is what's left before the query or
+# fragment, minus the ";params" of its last segment.
+URL_RE = re.compile(r'[hH][tT][tT][pP][sS]?://([^/?#]+)')
+SRC_RE = re.compile(r'[hH][tT][tT][pP][sS]?://[^/?#]+'
+                    r'[^?#]*/[^/;?#]*\.jpg(?:;[^/?#]*)?(?:[?#]|\Z)')
+# `urlparse` raises ValueError for unbalanced brackets in the netloc, and for
+# non-ASCII characters that NFKC-normalize to URL delimiters; leave it those
+UNUSUAL_NETLOC_RE = re.compile(u'[\\[\\]]|[^\\x00-\\x7f]')
+# What `strptime('%Y-%m-%d')` accepts in 10 characters (days may be
+# space-padded); the day is then checked against the month
+DATE_RE = re.compile(r'(\d\d\d\d)-(1[0-2]|0[1-9])-(3[01]|[12]\d|0[1-9]| [1-9])\Z')
+
+
+def urlparse_may_raise(possible_url, match):
+    """Return whether `urlparse` could raise ValueError on `possible_url`,
+    given its URL_RE `match` (if any), in which case it has to be asked.
+    """
+    if match is not None:
+        return UNUSUAL_NETLOC_RE.search(match.group(1)) is not None
+    # Any "//" can start a netloc, with or without a scheme
+    return '//' in possible_url and UNUSUAL_NETLOC_RE.search(possible_url) is not None
+
+
+def fast_is_valid_url(possible_url):
+    match = URL_RE.match(possible_url)
+    if urlparse_may_raise(possible_url, match):
+        return bool(is_valid_url(possible_url))
+    return match is not None
+
+
+def fast_is_valid_src(possible_src):
+    match = URL_RE.match(possible_src)
+    if urlparse_may_raise(possible_src, match):
+        return bool(is_valid_src(possible_src))
+    return match is not None and SRC_RE.match(possible_src) is not None
+
+
+def fast_is_valid_date(possible_datestr):
+    match = DATE_RE.match(possible_datestr)
+    if match is None:
+        return False
+    year, month, day = match.groups()
+    try:
+        date(int(year), int(month), int(day))
+    except ValueError:
+        return False
+    return True
+
+
+class ItemValidator(object):
+    """Precompiled field checks for the items of one Item class, built once
+    from its Field declarations.
+    """
+    def __init__(self, item_cls):
+        self.n_fields = len(item_cls.fields)
+        self.fields = tuple(sorted(required_fields(item_cls)))
+
+    def missing_fields(self, item):
+        # An item can only hold declared fields, so a full one is complete
+        if len(item) == self.n_fields:
+            return []
+        return [field for field in self.fields if field not in item]
+
+
+item_validators = {}
+
+
+def item_validator(item_cls):
+    validator = item_validators.get(item_cls)
+    if validator is None:
+        validator = item_validators[item_cls] = ItemValidator(item_cls)
+    return validator
+
+
+def fast_validate_person_item(item, verbose=False):
+    """Same as validate_person_item(), with the precompiled checks."""
+    missing_fields = item_validator(type(item)).missing_fields(item)
+    if missing_fields:
+        raise ItemValidationError('PersonItem missing fields: {0}'.format(missing_fields))
+
+    name = item['name']
+    article_url = item['article_url']
+    if not name:
+        err_msg = 'Interview at {0} doesn\'t have a person\'s name'.format(article_url)
+        raise ItemValidationError(err_msg)
+
+    if not fast_is_valid_url(article_url):
+        err_msg = '{0} ({1}) doesn\'t have a valid interview URL'.format(name, article_url)
+        raise ItemValidationError(err_msg)
+
+    if not fast_is_valid_date(item['pub_date']):
+        err_msg = '{0} ({1}) doesn\'t have a publication date.'.format(name, article_url)
+        raise ItemValidationError(err_msg)
+
+    img_src = item['img_src']
+    if not fast_is_valid_src(img_src):
+        err_msg = '{0} ({1}) doesn\'t have a valid image source URL ({2}).'.format(name, article_url, img_src)
+        raise ItemValidationError(err_msg)
+
+    if not item['bio']:
+        logger.warn('%s (%s) doesn\'t have a bio.', name, article_url, extra=dict(category='missing_bio'))
+
+    if not item['hardware']:
+        logger.warn('%s (%s) doesn\'t have a hardware section.', name, article_url, extra=dict(category='missing_hardware'))
+
+    if not item['software']:
+        logger.warn('%s (%s) doesn\'t have a software section.', name, article_url, extra=dict(category='missing_software'))
+
+    if not item['dream']:
+        logger.warn('%s (%s) doesn\'t have a dream-setup section.', name, article_url, extra=dict(category='missing_dream'))
+
+
+def fast_validate_tool_items(items, person_item, verbose=False):
+    """Same as validate_tool_items(), with the precompiled checks, in a
+    single pass over the tools.
+    """
+    name = person_item['name']
+    article_url = person_item['article_url']
+
+    if not items:
+        logger.warn('%s (%s) doesn\'t use any tools.', name, article_url, extra=dict(category='no_tools'))
+        return
+
+    valid_items = []
+    for tool in items:
+        missing_fields = item_validator(type(tool)).missing_fields(tool)
+        if missing_fields:
+            if verbose:
+                logger.error('%s (%s) uses a tool that is missing fields %s. Skipping tool...', name, article_url, str(missing_fields), extra=dict(category='tool_missing_fields'))
+            else:
+                logger.error('Found tool (at %s) that is missing one or more fields. Skipping...', article_url, extra=dict(category='tool_missing_fields'))
+            continue
+
+        tool_name, tool_url = tool['tool_name'], tool['tool_url']
+        if not tool_name:
+            if verbose:
+                logger.error('%s (%s) uses a tool that doesn\'t have a name. Skipping tool...', name, article_url, extra=dict(category='tool_missing_name'))
+            else:
+                logger.error('Found tool (at %s) that doesn\'t have a name. Skipping...', article_url, extra=dict(category='tool_missing_name'))
+            continue
+
+        if not fast_is_valid_url(tool_url):
+            if verbose:
+                logger.error('%s (%s) uses a tool "%s" (%s) that doesn\'t have a valid URL. Skipping tool...', name, article_url, tool_name, tool_url, extra=dict(category='tool_invalid_url'))
+            else:
+                logger.error('Found tool (%s) that doesn\'t have a valid URL. Skipping...', tool_name, extra=dict(category='tool_invalid_url'))
+            continue
+
+        valid_items.append(tool)
+
+    # Replace the contents of `items` list with only the items that are valid
+    items[:] = valid_items
+
+    if not items:
+        logger.warn('%s doesn\'t use any tools that have valid URLs.', name, extra=dict(category='no_valid_tools'))
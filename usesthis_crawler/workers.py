@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""Parse interview pages in a pool of worker processes, so that the
+CPU-bound extraction (lxml, the ItemLoader processors) isn't limited to the
+reactor's thread.
+
+Each worker hashes the raw body of a page (see `article_hash()`), if the
+spider hashes them, runs `UsesthisSpider.load_article()` on it unless the hash
+is the one the interview was stored with, and sends back the item's fields as plain dictionaries, which
+are turned back into a PersonItem and ToolItems on the reactor's side: the
+spider's output is the same as when it parses the pages itself.
+"""
+
+import multiprocessing
+import signal
+import traceback
+from scrapy.http import HtmlResponse
+from twisted.internet import defer, reactor
+from usesthis_crawler.items import PersonItem, ToolItem
+
+
+# The spider that parses the pages, and its hash function (None if the pages
+# aren't hashed), in a worker process
+worker_spider = None
+worker_article_hash = None
+
+
+class ParseWorkerError(Exception):
+    pass
+
+
+def init_worker(fast_tool_extraction, hash_articles):
+    global worker_spider, worker_article_hash
+    from usesthis_crawler.spiders.usesthis import UsesthisSpider, article_hash
+    worker_article_hash = article_hash if hash_articles else None
+    # Ctrl-C is the crawl's business; the pool is terminated when it stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_spider = UsesthisSpider('usesthis', fast_tool_extraction=fast_tool_extraction)
+
+
+def parse_page(url, body, encoding, known_hash=None):
+    """Return a (dictionary {'content_hash': str or None, 'person': dict,
+    'tools': list of dicts}, None) pair for the page (without 'person' and
+    'tools' if its hash is `known_hash`), or a (None, traceback) pair if
+    parsing it failed.
+    Note: this runs in a worker process.
+    """
+    try:
+        response = HtmlResponse(url=url, body=body, encoding=encoding)
+        content_hash = None
+        if worker_article_hash is not None:
+            content_hash = worker_article_hash(response)
+        if content_hash is not None and content_hash == known_hash:
+            return dict(content_hash=content_hash), None
+        item = worker_spider.load_article(response)
+        return dict(content_hash=content_hash,
+                    person=dict(item['person']),
+                    tools=[dict(tool_item) for tool_item in item['tools']]), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+class ParsePool(object):
+    def __init__(self, processes, fast_tool_extraction=True, hash_articles=True):
+        """Start `processes` worker processes (hashing the pages, with
+        `hash_articles`).
+        Note: start the pool before any other thread, since its processes are
+        forked from the current one.
+        """
+        self.pool = multiprocessing.Pool(processes, init_worker,
+                                         (fast_tool_extraction, hash_articles))
+
+    def parse(self, response, known_hash=None):
+        """Return a Deferred that fires with a (content hash or None,
+        interview) pair for `response`, the interview being a dictionary {'person':
+        PersonItem, 'tools': list of ToolItems}, or None if the page's hash is
+        `known_hash` (in which case it isn't parsed).
+        """
+        d = defer.Deferred()
+        # The callback runs on the pool's result thread
+        self.pool.apply_async(
+            parse_page, (response.url, response.body, response.encoding, known_hash),
+            callback=lambda result: reactor.callFromThread(self.parsed, d, result))
+        return d
+
+    def parsed(self, d, result):
+        fields, error = result
+        if error is not None:
+            d.errback(ParseWorkerError(error))
+            return
+        item = None
+        if 'person' in fields:
+            item = dict(person=PersonItem(fields['person']),
+                        tools=[ToolItem(tool_fields) for tool_fields in fields['tools']])
+        d.callback((fields['content_hash'], item))
+
+    def close(self):
+        """Stop the worker processes, once they are done with the pending
+        pages (Python 2's Pool.terminate() can deadlock with idle workers).
+        """
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""Run blocking database calls on a dedicated thread, off the reactor.
+
+SQLPipeline writes through a DatabaseWriter when DB_ASYNC_WRITES is set: each
+batch of items is handed to a single writer thread (so the database only ever
+has one writer connection), and the item that completed the batch waits on a
+Deferred until the batch is written. At most `max_pending` calls are queued
+for the thread; past that, callers wait on the reactor's side, so a slow
+database holds back Scrapy instead of buffering every item in memory.
+"""
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class DatabaseWriter(object):
+    def __init__(self, max_pending=4):
+        self.pool = ThreadPool(minthreads=1, maxthreads=1, name='DatabaseWriter')
+        self.semaphore = defer.DeferredSemaphore(max(1, max_pending))
+        self.shutdown_trigger = None
+
+    def start(self):
+        self.pool.start()
+        # Don't keep the process alive if the crawl ends without stop()
+        self.shutdown_trigger = reactor.addSystemEventTrigger(
+            'during', 'shutdown', self.pool.stop)
+
+    def stop(self):
+        """Stop the writer thread, once it is done with the queued calls."""
+        if self.shutdown_trigger is not None:
+            reactor.removeSystemEventTrigger(self.shutdown_trigger)
+            self.shutdown_trigger = None
+        if self.pool.started:
+            self.pool.stop()
+
+    def call(self, func, *args, **kwargs):
+        """Call `func(*args, **kwargs)` on the writer thread, after every call
+        made before it. Return a Deferred that fires with its result.
+        """
+        return self.semaphore.run(threads.deferToThreadPool, reactor, self.pool,
+                                  func, *args, **kwargs)